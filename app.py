@@ -1,19 +1,41 @@
 import asyncio
 import logging
+import signal
 import sys
 from aiogram import BaseMiddleware, Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import BotCommand, CallbackQuery, Message
 
-from database.base import async_session, init
-from database.models import get_user
+from classes.callback import page_codes
+from database.base import async_session, engine, init, warm_up
+from database.models import get_auth_user
+from database.storage import PostgresStorage, create_storage
+from services.activity import activity
+from services.catalog import PrefetchMiddleware, catalog, prefetcher
+from services.metrics import (
+    UpdateMetricsMiddleware,
+    instrument_handlers,
+    instrument_sender,
+)
+from services.payments import payments, stripe_webhook
+from services.recorder import recorder
+from services.replica import replica
+from services.search import search
+from services.sender import SendScheduler
+from services.tokens import current_chat, tokens
+from services.web import create_metrics_app, run_webhook, serve
+from services.workers import process_queue, run_polling, run_supervisor
 from settings import settings
+from utils import close_session, init_session
 
 TOKEN = settings.BOT_TOKEN
 
-dp = Dispatcher(storage=MemoryStorage())
+dp = Dispatcher(storage=create_storage())
+
+
+# Commands that work without a login
+AUTH_COMMANDS = {"/register", "/login", "/start"}
 
 
 class AuthMiddleware(BaseMiddleware):
@@ -22,61 +44,81 @@ class AuthMiddleware(BaseMiddleware):
         callback = getattr(event, "callback_query", None)
 
         user_id = None
-        is_auth_command = False
+        command = None
 
         if message:
             user_id = message.from_user.id
             text = message.text or ""
-
-            is_auth_command = text.startswith((
-                "/register",
-                "/login",
-                "/start"
-            ))
+            command = text.split(maxsplit=1)[0] if text else None
 
         elif callback:
             user_id = callback.from_user.id
 
-        if is_auth_command:
+        if user_id:
+            activity.touch(user_id, command)
+
+        # Lets a 401 from the backend refresh this chat's token
+        current_chat.set(user_id)
+
+        # Whole commands only, so "/startx" needs a login. The user is still
+        # passed when known: "/start payload" may reach an FSM state handler
+        if command and command.split("@", 1)[0] in AUTH_COMMANDS:
+            if user_id:
+                async with async_session() as session:
+                    user_data = await get_auth_user(session, user_id)
+                if user_data and user_data.token and not user_data.is_expired:
+                    data["user"] = user_data
             return await handler(event, data)
 
         if user_id:
             async with async_session() as session:
-                user_data = await get_user(session, user_id)
-
-                if not user_data or not user_data.token:
-                    if message:
-                        await message.answer(
-                            "🔒 Please login first!\n\n"
-                            "<code>/login email password</code>\n"
-                            "or\n"
-                            "<code>/register email password password_confirm</code>"
-                        )
-                    elif callback:
-                        await callback.answer(
-                            "Please login first!",
-                            show_alert=True
-                        )
-                    return
-
-                if user_data.is_expired:
-                    if message:
-                        await message.answer(
-                            "⏰ Session expired! Please login again:\n"
-                            "<code>/login email password</code>"
-                        )
-                    elif callback:
-                        await callback.answer(
-                            "Session expired! Please login again.",
-                            show_alert=True
-                        )
-                    return
+                user_data = await get_auth_user(session, user_id)
+
+            if not user_data or not user_data.token:
+                if message:
+                    await message.answer(
+                        "🔒 Please login first!\n\n"
+                        "<code>/login email password</code>\n"
+                        "or\n"
+                        "<code>/register email password password_confirm</code>"
+                    )
+                elif callback:
+                    await callback.answer(
+                        "Please login first!",
+                        show_alert=True
+                    )
+                return
+
+            if user_data.is_expired:
+                user_data = await tokens.refresh(
+                    user_id, user_data.token, trigger="expired"
+                )
+
+            if user_data is None:
+                if message:
+                    await message.answer(
+                        "⏰ Session expired! Please login again:\n"
+                        "<code>/login email password</code>"
+                    )
+                elif callback:
+                    await callback.answer(
+                        "Session expired! Please login again.",
+                        show_alert=True
+                    )
+                return
+
+            data["user"] = user_data
 
         return await handler(event, data)
 
 
 
+if recorder:
+    dp.update.outer_middleware(recorder)
+dp.update.outer_middleware(UpdateMetricsMiddleware())
 dp.update.outer_middleware(AuthMiddleware())
+if prefetcher:
+    dp.update.outer_middleware(PrefetchMiddleware(prefetcher))
 
 
 async def set_bot_commands(bot: Bot):
@@ -91,16 +133,138 @@ async def set_bot_commands(bot: Bot):
     await bot.set_my_commands(commands)
 
 
-async def main() -> None:
+def create_bot() -> Bot:
     bot = Bot(token=TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    # Chats are sharded between workers, the global limit is split evenly
+    scheduler = SendScheduler(
+        global_rate=settings.SEND_GLOBAL_RATE / settings.WORKERS,
+        global_burst=settings.SEND_GLOBAL_BURST / settings.WORKERS,
+        chat_rate=settings.SEND_CHAT_RATE,
+        chat_burst=settings.SEND_CHAT_BURST,
+        max_retries=settings.SEND_MAX_RETRIES,
+        chat_buckets_size=settings.SEND_CHAT_BUCKETS_SIZE,
+        chat_buckets_ttl=settings.SEND_CHAT_BUCKETS_TTL,
+    )
+    bot.session.middleware(scheduler)
+    instrument_sender(scheduler)
+    return bot
+
+
+def include_routers():
+    from routers import (
+        card_router,
+        error_router,
+        search_router,
+        start_router,
+        user_router,
+    )
+
+    dp.include_routers(start_router, user_router, card_router)
+    if search:
+        dp.include_router(search_router)
+    dp.include_router(error_router)
+    instrument_handlers(dp)
+
+
+async def close_resources(bot: Bot):
+    # Notifications of received Stripe events still need the bot and activity
+    if stripe_webhook:
+        await stripe_webhook.close()
+    await page_codes.flush()
+    await activity.close()
+    await tokens.close()
+    if recorder:
+        await recorder.close()
+    if prefetcher:
+        await prefetcher.close()
+    if search:
+        await search.close()
+    if replica:
+        await replica.close()
+    await catalog.close()
+    await payments.close()
+    await close_session()
+    await bot.session.close()
+    await engine.dispose()
+
+
+async def run_worker(index: int, queue) -> None:
+    """Process updates routed to this worker by the supervisor"""
+    bot = create_bot()
+    await init_session()
+    await warm_up()
+    include_routers()
+    # One background refresher is enough, the tokens are shared in the database
+    if index == 0:
+        tokens.start()
+    # Likewise for the catalog replica, the other workers follow its state
+    if replica:
+        replica.start(sync=index == 0)
+    if search:
+        search.start()
+    runner = None
+    if settings.METRICS_PATH:
+        runner = await serve(
+            create_metrics_app(),
+            settings.WEBHOOK_LISTEN_HOST,
+            settings.METRICS_WORKER_PORT + index,
+        )
+    try:
+        await process_queue(dp, bot, queue)
+    finally:
+        if runner is not None:
+            await runner.cleanup()
+        await dp.storage.close()
+        await close_resources(bot)
+
+
+def worker_main(index: int, queue) -> None:
+    """Entry point of a worker process"""
+    logging.basicConfig(
+        level=logging.INFO,
+        stream=sys.stdout,
+        format=f"[worker-{index}] %(levelname)s:%(name)s:%(message)s",
+    )
+    # Ctrl+C reaches the whole process group; the supervisor stops workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(run_worker(index, queue))
+
+
+async def main() -> None:
+    bot = create_bot()
     await set_bot_commands(bot)
 
     await init()
+    if isinstance(dp.storage, PostgresStorage):
+        await dp.storage.purge_expired()
+
+    include_routers()
 
-    from routers import card_router, error_router, start_router, user_router
+    if settings.WORKERS > 1:
+        try:
+            await run_supervisor(dp, bot, worker_main)
+        finally:
+            # Stripe webhooks are handled here and record paid orders
+            if stripe_webhook:
+                await stripe_webhook.close()
+            await activity.close()
+            await bot.session.close()
+        return
 
-    dp.include_routers(start_router, user_router, card_router, error_router)
-    await dp.start_polling(bot)
+    await init_session()
+    await warm_up()
+    tokens.start()
+    if replica:
+        replica.start(sync=True)
+    if search:
+        search.start()
+    try:
+        if settings.RUN_MODE == "webhook":
+            await run_webhook(dp, bot)
+        else:
+            await run_polling(dp, bot)
+    finally:
+        await close_resources(bot)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,93 @@
+"""Compare legacy and compact callback payloads.
+
+Measures callback_data size and pack/unpack cost of PageCallback and
+ProductCallback with raw values (the old format) and with short codes
+and binary-packed ids.
+
+    python -m bench.callbacks --n 100000
+"""
+
+import argparse
+import asyncio
+import time
+from uuid import uuid4
+
+from classes.callback import (
+    PageCallback,
+    ProductCallback,
+    ShortCodeRegistry,
+    pack_id,
+    unpack_id,
+)
+
+# A filtered listing path close to the 64-byte limit of the legacy format
+PAGE = "/api/v1/products/?category=phones&ordering=-price&page=12"
+
+
+def timed(label: str, n: int, func) -> None:
+    started = time.perf_counter()
+    for _ in range(n):
+        func()
+    elapsed = time.perf_counter() - started
+    print(f"{label:>28}: {elapsed / n * 1e6:6.2f} us")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--n", type=int, default=100_000)
+    args = parser.parse_args()
+
+    registry = ShortCodeRegistry(maxsize=1000)
+    registry.flush = lambda: asyncio.sleep(0)
+    product_id = str(uuid4())
+
+    legacy_page = PageCallback(link_page=PAGE).pack()
+    compact_page = PageCallback(link_page=registry.code_for(PAGE)).pack()
+    legacy_product = ProductCallback(product_id=product_id).pack()
+    compact_product = ProductCallback(product_id=pack_id(product_id)).pack()
+
+    print("callback_data size, bytes:")
+    print(f"{'page':>28}: {len(legacy_page)} -> {len(compact_page)}")
+    print(f"{'product (uuid)':>28}: {len(legacy_product)} -> {len(compact_product)}")
+    print(
+        f"{'product (int)':>28}: {len('product:48213')} -> "
+        f"{len(ProductCallback(product_id=pack_id(48213)).pack())}"
+    )
+
+    print("pack:")
+    timed("legacy page", args.n, lambda: PageCallback(link_page=PAGE).pack())
+    timed(
+        "compact page",
+        args.n,
+        lambda: PageCallback(link_page=registry.code_for(PAGE)).pack(),
+    )
+    timed(
+        "legacy product",
+        args.n,
+        lambda: ProductCallback(product_id=product_id).pack(),
+    )
+    timed(
+        "compact product",
+        args.n,
+        lambda: ProductCallback(product_id=pack_id(product_id)).pack(),
+    )
+
+    print("unpack + decode:")
+    timed("legacy page", args.n, lambda: PageCallback.unpack(legacy_page))
+
+    started = time.perf_counter()
+    for _ in range(args.n):
+        await registry.resolve(PageCallback.unpack(compact_page).link_page)
+    elapsed = time.perf_counter() - started
+    print(f"{'compact page (LRU hit)':>28}: {elapsed / args.n * 1e6:6.2f} us")
+
+    timed("legacy product", args.n, lambda: ProductCallback.unpack(legacy_product))
+    timed(
+        "compact product",
+        args.n,
+        lambda: unpack_id(ProductCallback.unpack(compact_product).product_id),
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
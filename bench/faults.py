@@ -0,0 +1,166 @@
+"""Check how the bot behaves while the backend degrades and recovers.
+
+Simulated chats browse the catalog and edit their carts (bench.load
+scenarios) against bench.stubs.StubBackend while faults are injected
+phase by phase: healthy, slow (a share of requests hangs), down (every
+request fails with 503) and recovered. Every phase prints latencies,
+the replies users got, retries and the state of the circuit breakers.
+
+    python -m bench.faults --phase-seconds 5
+
+The run fails if requests still wait for the backend while it is down,
+or if the breakers have not closed again once it recovered.
+"""
+
+import argparse
+import asyncio
+import logging
+import statistics
+import sys
+import time
+from collections import Counter
+
+from aiogram import Bot
+
+from bench.load import Chat, Runner, browse, cart, login
+from bench.stubs import CaptureSession, MemoryDatabase, StubBackend
+from buttons.static import UNAVAILABLE_TEXT
+from settings import settings
+
+PHASES = {
+    "healthy": {},
+    "slow": {"slow_rate": 0.3, "slow_delay": 3},
+    "down": {"error_rate": 1},
+    "recovered": {},
+}
+
+
+class ReplySession(CaptureSession):
+    """CaptureSession that sorts the bot's replies into outcomes"""
+
+    def __init__(self):
+        super().__init__()
+        self.replies: Counter = Counter()
+
+    async def make_request(self, bot: Bot, method, timeout=None):
+        text = getattr(method, "text", None) or ""
+        if text == UNAVAILABLE_TEXT:
+            self.replies["unavailable"] += 1
+        elif text.startswith(("😕", "❌")):
+            self.replies["error"] += 1
+        elif text:
+            self.replies["ok"] += 1
+        return await super().make_request(bot, method, timeout)
+
+
+async def run_phase(runner: Runner, chats: range, seconds: float) -> Counter:
+    """Run flows in every chat until the phase is over"""
+    deadline = time.monotonic() + seconds
+    flows = Counter()
+
+    async def run_chat(chat: Chat) -> None:
+        scenarios = (browse, cart)
+        index = 0
+        while time.monotonic() < deadline:
+            try:
+                await scenarios[index % 2](chat)
+            except (RuntimeError, KeyError):
+                # The bot did not send the keyboard the flow clicks next
+                flows["interrupted"] += 1
+            else:
+                flows["completed"] += 1
+            index += 1
+
+    await asyncio.gather(*(run_chat(Chat(runner, chat_id)) for chat_id in chats))
+    return flows
+
+
+def breakers() -> dict:
+    from utils import endpoints
+
+    names = {0: "closed", 1: "half-open", 2: "open"}
+    return {
+        f"{method} {path}": names[state.breaker.state]
+        for (method, path), state in sorted(endpoints.items())
+    }
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--phase-seconds", type=float, default=5)
+    parser.add_argument("--latency", type=float, default=0.01, help="seconds")
+    parser.add_argument(
+        "--breaker-reset", type=float, default=1, help="BACKEND_BREAKER_RESET"
+    )
+    args = parser.parse_args()
+
+    # Every failed update is logged, the summary below is what matters
+    logging.basicConfig(level=logging.CRITICAL)
+    settings.BACKEND_BREAKER_RESET = args.breaker_reset
+
+    backend = StubBackend(200, args.latency, 0.2, seed=1)
+    settings.HOST = await backend.start()
+    settings.STRIPE_API_BASE = backend.url
+
+    from app import close_resources, dp, include_routers
+    from services.catalog import catalog
+    from utils import backend_retries, init_session, retry_budget
+
+    include_routers()
+    MemoryDatabase().install()
+    await init_session()
+
+    session = ReplySession()
+    bot = Bot("123456:bench", session=session)
+    runner = Runner(dp, bot, session)
+    chats = range(1, args.chats + 1)
+    await login(chats)
+
+    failures = []
+    for phase, faults in PHASES.items():
+        backend.faults(**faults)
+        if phase == "recovered":
+            # Let the breakers probe the backend again
+            await asyncio.sleep(args.breaker_reset)
+        runner.latencies.clear()
+        session.replies.clear()
+        retries = sum(backend_retries._values.values())
+        stale = catalog.stale_hits
+
+        flows = await run_phase(runner, chats, args.phase_seconds)
+
+        latencies = sorted(runner.latencies)
+        p95 = statistics.quantiles(latencies, n=100, method="inclusive")[94]
+        states = breakers()
+        print(
+            f"{phase:>10}: updates={len(latencies)}, p50_ms="
+            f"{statistics.median(latencies) * 1e3:.1f}, p95_ms={p95 * 1e3:.1f}, "
+            f"max_ms={latencies[-1] * 1e3:.1f}, flows={dict(flows)}, "
+            f"replies={dict(session.replies)}, "
+            f"retries={sum(backend_retries._values.values()) - retries}, "
+            f"stale_catalog_hits={catalog.stale_hits - stale}"
+        )
+        print(f"{'':>10}  breakers={states}")
+
+        if phase == "down":
+            if "open" not in states.values():
+                failures.append("no breaker opened while the backend was down")
+            if p95 > settings.BACKEND_TIMEOUT_MIN:
+                failures.append(
+                    f"p95 {p95:.2f}s while down, requests did not fail fast"
+                )
+        if phase == "recovered" and set(states.values()) != {"closed"}:
+            failures.append(f"breakers did not close after recovery: {states}")
+
+    print("retry budget exhausted:", retry_budget.exhausted)
+    await close_resources(bot)
+    await backend.close()
+
+    for failure in failures:
+        print("FAIL", failure)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
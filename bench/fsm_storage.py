@@ -0,0 +1,69 @@
+"""Compare the configured FSM storage against MemoryStorage.
+
+Replays the add-to-cart flow (set_state, update_data, get_state,
+get_data, clear) for many chats concurrently and reports operations/s.
+
+    FSM_STORAGE=postgres python -m bench.fsm_storage --chats 500
+"""
+
+import argparse
+import asyncio
+import time
+
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from classes.fsm import ToCard
+from database.base import init
+from database.storage import create_storage
+
+OPS_PER_FLOW = 6
+
+
+async def flow(storage: BaseStorage, chat_id: int) -> None:
+    key = StorageKey(bot_id=1, chat_id=chat_id, user_id=chat_id)
+    await storage.set_data(key, {"product_id": str(chat_id)})
+    await storage.set_state(key, ToCard.quantity)
+    await storage.get_state(key)
+    await storage.update_data(key, {"quantity": 3})
+    await storage.get_data(key)
+    await storage.set_state(key, None)
+
+
+async def run(storage: BaseStorage, chats: int, rounds: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(chat_id: int) -> None:
+        async with semaphore:
+            await flow(storage, chat_id)
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        await asyncio.gather(*(limited(chat_id) for chat_id in range(chats)))
+    elapsed = time.perf_counter() - started
+
+    ops = chats * rounds * OPS_PER_FLOW
+    print(
+        f"{type(storage).__name__:>16}: {ops} ops in {elapsed:.3f}s, "
+        f"{ops / elapsed:,.0f} ops/s, {elapsed / ops * 1e6:.1f} us/op"
+    )
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    storage = create_storage()
+    if not isinstance(storage, MemoryStorage):
+        await init()
+
+    for candidate in (MemoryStorage(), storage):
+        await run(candidate, args.chats, args.rounds, args.concurrency)
+        await candidate.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
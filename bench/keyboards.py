@@ -0,0 +1,116 @@
+"""Per-render cost of keyboards, before and after precompilation.
+
+Compares the previous create_inline_keyboard/create_keyboard (copied
+below) with the current builders, and rebuilding the fixed cart and
+location keyboards with reusing the prebuilt ones from buttons.static.
+
+    python -m bench.keyboards --n 20000
+"""
+
+import argparse
+import time
+
+from aiogram.types import (
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    KeyboardButton,
+    ReplyKeyboardMarkup,
+)
+
+from buttons.inline import create_inline_keyboard, create_list_keyboard
+from buttons.keyboard import create_keyboard
+from buttons.static import CART_ACTIONS, LOCATION_KEYBOARD
+from classes.callback import ProductCallback, pack_id
+
+CART = [[("✏️ Update Cart", "update_card")], [("✅ Place Order", "to_order")]]
+LOCATION = [("📍 Send Location", "location")]
+PRODUCTS = [{"id": 1000 + i, "name": f"Product number {i}"} for i in range(10)]
+
+
+def legacy_inline_keyboard(buttons, row_width=3) -> InlineKeyboardMarkup:
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[])
+    if all(isinstance(i, list) for i in buttons):
+        for row in buttons:
+            keyboard.inline_keyboard.append(
+                [InlineKeyboardButton(text=t, callback_data=d) for t, d in row]
+            )
+    else:
+        row = []
+        for text, data in buttons:
+            row.append(InlineKeyboardButton(text=text, callback_data=data))
+            if len(row) == row_width:
+                keyboard.inline_keyboard.append(row)
+                row = []
+        if row:
+            keyboard.inline_keyboard.append(row)
+    return keyboard
+
+
+def legacy_keyboard(buttons, row_width=3) -> ReplyKeyboardMarkup:
+    keyboard = ReplyKeyboardMarkup(
+        resize_keyboard=True, one_time_keyboard=True, keyboard=[]
+    )
+    row = []
+    for b in buttons:
+        if isinstance(b, tuple) and len(b) == 2 and b[1] == "location":
+            row.append(KeyboardButton(text=b[0], request_location=True))
+        else:
+            row.append(KeyboardButton(text=b if isinstance(b, str) else b[0]))
+        if len(row) == row_width:
+            keyboard.keyboard.append(row)
+            row = []
+    if row:
+        keyboard.keyboard.append(row)
+    return keyboard
+
+
+def legacy_product_list() -> InlineKeyboardMarkup:
+    products = [
+        (
+            f"📦 {product['name'][:20]}",
+            ProductCallback(product_id=pack_id(product["id"])).pack(),
+        )
+        for product in PRODUCTS
+    ]
+    return legacy_inline_keyboard(products)
+
+
+def timed(label: str, n: int, func) -> float:
+    started = time.perf_counter()
+    for _ in range(n):
+        func()
+    per_call = (time.perf_counter() - started) / n * 1e6
+    print(f"{label:>28}: {per_call:7.2f} us")
+    return per_call
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--n", type=int, default=20_000)
+    args = parser.parse_args()
+
+    assert create_inline_keyboard(CART) == legacy_inline_keyboard(CART)
+    assert create_keyboard(LOCATION) == legacy_keyboard(LOCATION)
+    assert create_list_keyboard(PRODUCTS, ProductCallback) == legacy_product_list()
+
+    print("cart actions")
+    timed("legacy build", args.n, lambda: legacy_inline_keyboard(CART))
+    timed("create_inline_keyboard", args.n, lambda: create_inline_keyboard(CART))
+    timed("prebuilt", args.n, lambda: CART_ACTIONS)
+
+    print("location keyboard")
+    timed("legacy build", args.n, lambda: legacy_keyboard(LOCATION))
+    timed("create_keyboard", args.n, lambda: create_keyboard(LOCATION))
+    timed("prebuilt", args.n, lambda: LOCATION_KEYBOARD)
+
+    print(f"product list ({len(PRODUCTS)} items)")
+    timed("legacy build", args.n, legacy_product_list)
+    timed(
+        "create_list_keyboard",
+        args.n,
+        lambda: create_list_keyboard(PRODUCTS, ProductCallback),
+    )
+
+
+if __name__ == "__main__":
+    main()
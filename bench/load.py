@@ -0,0 +1,332 @@
+"""End-to-end load benchmark of the dispatcher with synthetic updates.
+
+Raw updates go through dp.feed_raw_update with every router and
+middleware of the bot. Backend and Stripe calls hit bench.stubs.StubBackend
+on localhost, Bot API calls are answered by a capturing session, and
+the database is an in-memory stand-in unless --db postgres is given.
+Every simulated chat runs a scenario (a fixed sequence of messages and
+button clicks, clicking buttons the bot actually sent) several times,
+all chats concurrently, and per-update latencies are collected.
+
+    python -m bench.load --scenario all --chats 200 --iterations 5
+    python -m bench.load --replica
+    python -m bench.load --json before.json
+    python -m bench.load --baseline before.json --tolerance 0.2
+
+With --baseline, the run fails if throughput drops or p95 latency grows
+by more than the tolerance in any scenario.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+from itertools import count
+
+from aiogram import Bot
+
+from bench.stubs import CaptureSession, MemoryDatabase, StubBackend
+from services.metrics import errors_total
+from settings import settings
+
+
+class Chat:
+    """One simulated user talking to the bot"""
+
+    def __init__(self, runner: "Runner", chat_id: int):
+        self.runner = runner
+        self.chat_id = chat_id
+        self.user = {"id": chat_id, "is_bot": False, "first_name": f"user{chat_id}"}
+        self.chat = {"id": chat_id, "type": "private"}
+
+    def _message(self, **fields) -> dict:
+        return {
+            "message_id": next(self.runner.ids),
+            "date": int(time.time()),
+            "chat": self.chat,
+            "from": self.user,
+            **fields,
+        }
+
+    async def send(self, text: str) -> None:
+        await self.runner.feed({"message": self._message(text=text)})
+
+    async def send_location(self) -> None:
+        location = {"latitude": 41.31, "longitude": 69.28}
+        await self.runner.feed({"message": self._message(location=location)})
+
+    async def click(self, prefix: str) -> None:
+        """Press the first button starting with prefix on the last keyboard"""
+        message, markup = self.runner.session.markups[self.chat_id]
+        data = next(
+            button.callback_data
+            for row in markup.inline_keyboard
+            for button in row
+            if button.text.startswith(prefix) and button.callback_data
+        )
+        query = {
+            "id": str(next(self.runner.ids)),
+            "from": self.user,
+            "chat_instance": str(self.chat_id),
+            "data": data,
+            "message": message.model_dump(mode="json", exclude_none=True),
+        }
+        await self.runner.feed({"callback_query": query})
+
+
+async def browse(chat: Chat) -> None:
+    await chat.send("/products")
+    await chat.click("➡️")
+    await chat.click("➡️")
+    await chat.click("📦")
+
+
+async def cart(chat: Chat) -> None:
+    await chat.send("/products")
+    await chat.click("📦")
+    await chat.click("➕")
+    await chat.send("2")
+    await chat.send("/my_cart")
+    await chat.click("✏️")
+    await chat.click("📦")
+    await chat.send("3")
+    await chat.send("/my_cart")
+    await chat.click("✏️")
+    await chat.click("📦")
+    await chat.send("delete")
+
+
+async def checkout(chat: Chat) -> None:
+    await chat.send("/products")
+    await chat.click("📦")
+    await chat.click("➕")
+    await chat.send("1")
+    await chat.send("/my_cart")
+    await chat.click("✅")
+    await chat.send_location()
+    await chat.click("✅")
+
+
+async def auth(chat: Chat) -> None:
+    await chat.send("/start")
+    await chat.send(f"/login user{chat.chat_id}@example.com secret123")
+
+
+SCENARIOS = {
+    "browse": browse,
+    "cart": cart,
+    "checkout": checkout,
+    "auth": auth,
+}
+# Share of flows in the mixed scenario
+MIX = {"browse": 0.6, "cart": 0.2, "checkout": 0.1, "auth": 0.1}
+
+
+class Runner:
+    def __init__(self, dp, bot: Bot, session: CaptureSession):
+        self.dp = dp
+        self.bot = bot
+        self.session = session
+        self.ids = count(1)
+        self.latencies: list[float] = []
+        self.errors = 0
+
+    @property
+    def handler_errors(self) -> int:
+        """Exceptions caught by the error router, plus the ones that escaped"""
+        return int(sum(errors_total._values.values())) + self.errors
+
+    async def feed(self, update: dict) -> None:
+        update["update_id"] = next(self.ids)
+        started = time.perf_counter()
+        try:
+            await self.dp.feed_raw_update(self.bot, update)
+        except Exception:
+            self.errors += 1
+        self.latencies.append(time.perf_counter() - started)
+
+    async def run(self, scenario: str, chats: range, iterations: int, seed: int):
+        names, weights = zip(*MIX.items())
+
+        async def run_chat(chat: Chat) -> None:
+            # Per-chat generator: the mix does not depend on task scheduling
+            rng = random.Random(seed * 1_000_003 + chat.chat_id)
+            for _ in range(iterations):
+                if scenario == "mixed":
+                    name = rng.choices(names, weights)[0]
+                else:
+                    name = scenario
+                await SCENARIOS[name](chat)
+
+        await asyncio.gather(*(run_chat(Chat(self, chat_id)) for chat_id in chats))
+
+
+def percentile(quantiles: list[float], p: int) -> float:
+    return quantiles[p - 1] * 1e3
+
+
+async def measure(runner: Runner, scenario: str, chats: range, args) -> dict:
+    runner.latencies.clear()
+    errors_before = runner.handler_errors
+    calls_before = sum(runner.session.calls.values())
+
+    started = time.perf_counter()
+    await runner.run(scenario, chats, args.iterations, args.seed)
+    elapsed = time.perf_counter() - started
+
+    latencies = runner.latencies
+    quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "updates": len(latencies),
+        "errors": runner.handler_errors - errors_before,
+        "seconds": elapsed,
+        "updates_per_s": len(latencies) / elapsed,
+        "p50_ms": percentile(quantiles, 50),
+        "p95_ms": percentile(quantiles, 95),
+        "p99_ms": percentile(quantiles, 99),
+        "bot_calls_per_update": (
+            (sum(runner.session.calls.values()) - calls_before) / len(latencies)
+        ),
+    }
+
+
+async def run_scenario(runner: Runner, scenario: str, args, first_chat: int) -> dict:
+    chats = range(first_chat, first_chat + args.chats)
+    await login(chats)
+
+    # Warm-up round: fills caches and pools, not measured
+    await runner.run(scenario, chats, 1, args.seed)
+
+    # Median of several runs per metric, to keep one noisy run from
+    # looking like a regression
+    runs = [await measure(runner, scenario, chats, args) for _ in range(args.repeat)]
+    result = {
+        key: round(statistics.median(run[key] for run in runs), 3) for key in runs[0]
+    }
+    result["errors"] = sum(run["errors"] for run in runs)
+    result["max_rss_mb"] = round(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+    )
+    return result
+
+
+async def login(chats: range) -> None:
+    from database.base import autocommit_session
+    from database.models import update_user_token
+
+    for chat_id in chats:
+        async with autocommit_session() as session:
+            await update_user_token(session, chat_id, f"token-{chat_id}", 50)
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+    for scenario, result in results.items():
+        before = baseline.get(scenario)
+        if before is None:
+            continue
+        if result["updates_per_s"] < before["updates_per_s"] * (1 - tolerance):
+            regressions.append(
+                f"{scenario}: {result['updates_per_s']} updates/s, "
+                f"baseline {before['updates_per_s']}"
+            )
+        if result["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            regressions.append(
+                f"{scenario}: p95 {result['p95_ms']} ms, baseline {before['p95_ms']}"
+            )
+    return regressions
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--scenario", choices=[*SCENARIOS, "mixed", "all"], default="all"
+    )
+    parser.add_argument("--chats", type=int, default=100)
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--products", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.01, help="seconds")
+    parser.add_argument("--jitter", type=float, default=0.2, help="share of latency")
+    parser.add_argument("--db", choices=("memory", "postgres"), default="memory")
+    parser.add_argument(
+        "--replica", action="store_true", help="browse the synced catalog replica"
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--tracemalloc", action="store_true")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="compare with results of an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    backend = StubBackend(args.products, args.latency, args.jitter, args.seed)
+    settings.HOST = await backend.start()
+    settings.STRIPE_API_BASE = backend.url
+
+    from app import close_resources, dp, include_routers
+    from database.base import init
+    from utils import init_session
+
+    include_routers()
+    if args.db == "memory":
+        database = MemoryDatabase()
+        database.install()
+    else:
+        await init()
+    await init_session()
+    if args.replica:
+        from services.replica import replica
+
+        await replica.sync()
+
+    session = CaptureSession()
+    bot = Bot("123456:bench", session=session)
+    runner = Runner(dp, bot, session)
+
+    scenarios = [*SCENARIOS, "mixed"] if args.scenario == "all" else [args.scenario]
+    results = {}
+    for index, scenario in enumerate(scenarios):
+        # Fresh chats per scenario, so carts and FSM states do not carry over
+        first_chat = (index + 1) * 1_000_000
+        results[scenario] = await run_scenario(runner, scenario, args, first_chat)
+        if args.tracemalloc:
+            results[scenario]["heap_peak_mb"] = round(
+                tracemalloc.get_traced_memory()[1] / 2**20, 1
+            )
+            tracemalloc.reset_peak()
+        print(
+            f"{scenario:>10}: "
+            + ", ".join(f"{k}={v}" for k, v in results[scenario].items())
+        )
+
+    print("backend requests:", dict(backend.requests.most_common()))
+    print("bot calls:", dict(session.calls.most_common()))
+
+    await close_resources(bot)
+    await backend.close()
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION", regression)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,105 @@
+"""Measure the per-update overhead of the metrics middlewares.
+
+Feeds the same synthetic messages and callback queries through a bare
+dispatcher and through one instrumented like the bot's (update and
+handler middlewares), with no-op handlers, and prints the difference.
+
+    python -m bench.metrics --updates 50000
+"""
+
+import argparse
+import asyncio
+import time
+from datetime import datetime
+
+from aiogram import Bot, Dispatcher, F, Router
+from aiogram.types import CallbackQuery, Chat, Message, Update, User
+
+from classes.metrics import registry
+from services.metrics import UpdateMetricsMiddleware, instrument_handlers
+
+
+def make_updates(count: int) -> list[Update]:
+    user = User(id=1, is_bot=False, first_name="Bench")
+    chat = Chat(id=1, type="private")
+    updates = []
+    for update_id in range(count):
+        message = Message(
+            message_id=update_id,
+            date=datetime.now(),
+            chat=chat,
+            from_user=user,
+            text="/products",
+        )
+        if update_id % 2:
+            updates.append(Update(update_id=update_id, message=message))
+        else:
+            query = CallbackQuery(
+                id=str(update_id),
+                from_user=user,
+                chat_instance="1",
+                message=message,
+                data="update_card",
+            )
+            updates.append(Update(update_id=update_id, callback_query=query))
+    return updates
+
+
+def make_dispatcher(instrumented: bool) -> Dispatcher:
+    router = Router()
+
+    @router.message(F.text == "/products")
+    async def products(message: Message):
+        pass
+
+    @router.callback_query(F.data == "update_card")
+    async def update_card(call: CallbackQuery):
+        pass
+
+    dp = Dispatcher()
+    if instrumented:
+        dp.update.outer_middleware(UpdateMetricsMiddleware())
+    dp.include_router(router)
+    if instrumented:
+        instrument_handlers(dp)
+    return dp
+
+
+async def run(dp: Dispatcher, bot: Bot, updates: list[Update]) -> float:
+    started = time.perf_counter()
+    for update in updates:
+        await dp.feed_update(bot, update)
+    return (time.perf_counter() - started) / len(updates) * 1e6
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--updates", type=int, default=50_000)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    bot = Bot("123456:bench")
+    updates = make_updates(args.updates)
+    bare = make_dispatcher(instrumented=False)
+    instrumented = make_dispatcher(instrumented=True)
+
+    # Best of several rounds, alternating, to keep noise out of the difference
+    bare_us, instrumented_us = [], []
+    for _ in range(args.rounds):
+        bare_us.append(await run(bare, bot, updates))
+        instrumented_us.append(await run(instrumented, bot, updates))
+    bare_best, instrumented_best = min(bare_us), min(instrumented_us)
+
+    print(f"{'bare dispatcher':>20}: {bare_best:6.2f} us/update")
+    print(f"{'instrumented':>20}: {instrumented_best:6.2f} us/update")
+    print(f"{'overhead':>20}: {instrumented_best - bare_best:6.2f} us/update")
+
+    started = time.perf_counter()
+    text = registry.render()
+    elapsed = (time.perf_counter() - started) * 1e3
+    print(f"{'scrape':>20}: {elapsed:6.2f} ms, {len(text)} bytes")
+    await bot.session.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
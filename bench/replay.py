@@ -0,0 +1,181 @@
+"""Replay recorded updates (services.recorder) into the dispatcher.
+
+Updates from one or more recording files are merged by arrival time and
+fed through dp.feed_raw_update with every router and middleware of the
+bot, at the recorded pace scaled by --speed (1 = real time, 10 = ten
+times faster, 0 = as fast as possible). Updates of one chat are handled
+one after another in recorded order, chats run concurrently. Bot API
+calls are always answered by a capturing session, so recorded users
+never get messages; the backend is bench.stubs.StubBackend unless
+--backend settings is given.
+
+    python -m bench.replay recordings/*.jsonl.gz --speed 0
+    python -m bench.replay recordings/updates-*.jsonl.gz --speed 5 --json out.json
+"""
+
+import argparse
+import asyncio
+import heapq
+import json
+import logging
+import statistics
+import sys
+import time
+from collections import Counter
+
+from aiogram import Bot
+
+from bench.load import login, percentile
+from bench.stubs import CaptureSession, MemoryDatabase, StubBackend
+from services.metrics import errors_total
+from services.recorder import read_recording
+from services.scheduler import shard_key
+from settings import settings
+
+
+class Replayer:
+    def __init__(self, dp, bot: Bot, speed: float):
+        self.dp = dp
+        self.bot = bot
+        self.speed = speed
+        self.latencies: list[float] = []
+        self.lags: list[float] = []
+        self.errors = 0
+        self._chats: dict[int, asyncio.Queue] = {}
+        self._workers: list[asyncio.Task] = []
+
+    async def _work(self, queue: asyncio.Queue) -> None:
+        while True:
+            due, update = await queue.get()
+            started = time.perf_counter()
+            self.lags.append(max(started - due, 0))
+            try:
+                await self.dp.feed_raw_update(self.bot, update)
+            except Exception:
+                self.errors += 1
+            self.latencies.append(time.perf_counter() - started)
+            queue.task_done()
+
+    def _queue(self, chat_id: int) -> asyncio.Queue:
+        queue = self._chats.get(chat_id)
+        if queue is None:
+            queue = self._chats[chat_id] = asyncio.Queue()
+            self._workers.append(asyncio.create_task(self._work(queue)))
+        return queue
+
+    async def run(self, records) -> int:
+        """Schedule every update at its scaled offset, return the count"""
+        started = time.perf_counter()
+        first = None
+        total = 0
+        for recorded_at, update in records:
+            if first is None:
+                first = recorded_at
+            due = started
+            if self.speed > 0:
+                due += (recorded_at - first) / self.speed
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            self._queue(shard_key(update)).put_nowait((due, update))
+            total += 1
+
+        await asyncio.gather(*(queue.join() for queue in self._chats.values()))
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        return total
+
+
+def merged(paths: list[str]):
+    """Records of all files in arrival order"""
+    return heapq.merge(*(read_recording(path) for path in paths), key=lambda r: r[0])
+
+
+def recorded_chats(paths: list[str]) -> tuple[set[int], Counter]:
+    chats, kinds = set(), Counter()
+    for _, update in merged(paths):
+        chats.add(shard_key(update))
+        kinds.update(key for key in update if key != "update_id")
+    chats.discard(0)
+    return chats, kinds
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("paths", nargs="+", help="recording files")
+    parser.add_argument("--speed", type=float, default=1, help="0 = no delays")
+    parser.add_argument("--backend", choices=("stub", "settings"), default="stub")
+    parser.add_argument("--products", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.01, help="seconds")
+    parser.add_argument("--jitter", type=float, default=0.2, help="share of latency")
+    parser.add_argument("--db", choices=("memory", "postgres"), default="memory")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    chats, kinds = recorded_chats(args.paths)
+    print(f"{sum(kinds.values())} updates from {len(chats)} chats:", dict(kinds))
+
+    backend = None
+    if args.backend == "stub":
+        backend = StubBackend(args.products, args.latency, args.jitter, seed=1)
+        settings.HOST = await backend.start()
+        settings.STRIPE_API_BASE = backend.url
+
+    from app import close_resources, dp, include_routers
+    from database.base import init
+    from utils import init_session
+
+    include_routers()
+    if args.db == "memory":
+        MemoryDatabase().install()
+        # Recorded users were logged in when the traffic was captured
+        await login(sorted(chats))
+    else:
+        await init()
+    await init_session()
+
+    session = CaptureSession()
+    bot = Bot("123456:replay", session=session)
+    replayer = Replayer(dp, bot, args.speed)
+
+    def errors() -> int:
+        return int(sum(errors_total._values.values())) + replayer.errors
+
+    errors_before = errors()
+    started = time.perf_counter()
+    total = await replayer.run(merged(args.paths))
+    elapsed = time.perf_counter() - started
+
+    result = {"updates": total, "seconds": round(elapsed, 3)}
+    if total:
+        latencies = statistics.quantiles(replayer.latencies, n=100, method="inclusive")
+        lags = statistics.quantiles(replayer.lags, n=100, method="inclusive")
+        result.update(
+            updates_per_s=round(total / elapsed, 1),
+            errors=errors() - errors_before,
+            p50_ms=round(percentile(latencies, 50), 3),
+            p95_ms=round(percentile(latencies, 95), 3),
+            p99_ms=round(percentile(latencies, 99), 3),
+            lag_p95_ms=round(percentile(lags, 95), 3),
+            lag_max_ms=round(max(replayer.lags) * 1e3, 3),
+        )
+    print(", ".join(f"{k}={v}" for k, v in result.items()))
+    if backend is not None:
+        print("backend requests:", dict(backend.requests.most_common()))
+    print("bot calls:", dict(session.calls.most_common()))
+
+    await close_resources(bot)
+    if backend is not None:
+        await backend.close()
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(result, file, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,94 @@
+"""Measure inline search: index rebuilds and query latency.
+
+Builds the index from bench.stubs.StubBackend with a synthetic catalog,
+rebuilds it again (unchanged products are not fetched twice), then
+times queries of different shapes against it.
+
+    python -m bench.search --products 5000
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import sys
+import time
+
+from bench.stubs import StubBackend
+from settings import settings
+
+WORDS = (
+    "red blue green black white leather cotton wool silk steel wooden glass "
+    "phone case charger cable laptop stand lamp chair table mug bottle bag "
+    "shoes jacket scarf watch wallet pillow blanket speaker headphones mouse "
+    "keyboard monitor camera tripod backpack umbrella notebook pen"
+).split()
+QUERIES = ("", "ch", "lea", "leather", "blue mug", "wireless", "steel bottle 1")
+
+
+def make_catalog(backend: StubBackend, rng: random.Random) -> None:
+    for product_id, product in backend.products.items():
+        name = " ".join(rng.sample(WORDS, 3)).title()
+        product["name"] = f"{name} {product_id}"
+        product["description"] = " ".join(rng.choices(WORDS, k=40)).capitalize()
+        product["stock"] = rng.randint(0, 500)
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.002, help="seconds")
+    args = parser.parse_args()
+
+    backend = StubBackend(args.products, args.latency, 0.2, seed=1)
+    make_catalog(backend, random.Random(1))
+    settings.HOST = await backend.start()
+
+    from services.search import ProductSearch
+    from utils import close_session, init_session
+
+    await init_session()
+    search = ProductSearch(
+        interval=3600,
+        detail_ttl=settings.SEARCH_DETAIL_TTL,
+        concurrency=settings.SEARCH_FETCH_CONCURRENCY,
+        page_size=settings.SEARCH_PAGE_SIZE,
+    )
+
+    for rebuild in ("first", "second"):
+        requests = backend.requests.total()
+        started = time.perf_counter()
+        await search.rebuild()
+        print(
+            f"{rebuild} rebuild: {time.perf_counter() - started:.2f}s, "
+            f"{backend.requests.total() - requests} backend requests, "
+            f"{len(search.index)} products"
+        )
+
+    slow = False
+    for query in QUERIES:
+        durations = []
+        for i in range(args.queries):
+            offset = i % 3 * settings.SEARCH_PAGE_SIZE
+            if offset == 0:
+                # The first page of a query is the uncached lookup
+                search.index._results.clear()
+            started = time.perf_counter()
+            results, _ = search.search(query, offset)
+            durations.append(time.perf_counter() - started)
+        matches = len(search.index.search(query))
+        p50 = statistics.median(durations) * 1e3
+        p99 = statistics.quantiles(durations, n=100, method="inclusive")[98] * 1e3
+        print(f"{query!r:>18}: {matches:5d} matches, p50={p50:.3f}ms p99={p99:.3f}ms")
+        slow |= p99 >= 1
+
+    await close_session()
+    await backend.close()
+    if slow:
+        print("FAIL: p99 query latency is 1 ms or more")
+    return 1 if slow else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,441 @@
+"""Stand-ins for the bot's external services, used by bench.load.
+
+- StubBackend: the /api/v1/ backend and the Stripe Checkout endpoint,
+  served by aiohttp on localhost with configurable latency and injected
+  faults (5xx answers, slow responses).
+- CaptureSession: a Bot session that records outgoing calls and answers
+  them locally instead of calling Telegram.
+- MemoryDatabase: in-memory versions of the database helpers the
+  handlers use, for runs without Postgres.
+"""
+
+import asyncio
+import random
+import sys
+from collections import Counter
+from datetime import datetime, timezone
+from itertools import count
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import TelegramMethod
+from aiogram.types import Chat, InlineKeyboardMarkup, Message
+from aiohttp import web
+
+import database.models
+from database.models import CachedUser, Product, SyncState, User, user_cache
+
+PAGE_SIZE = 10
+
+
+class StubBackend:
+    """Fake backend with a fixed catalog and a cart per auth token"""
+
+    def __init__(self, products: int, latency: float, jitter: float, seed: int):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = 0.0
+        self.slow_rate = 0.0
+        self.slow_delay = 0.0
+        self._random = random.Random(seed)
+        self.products = {
+            product_id: {
+                "id": product_id,
+                "name": f"Product {product_id}",
+                "price": 10 + product_id % 90,
+                "discount_percent": product_id % 30,
+                "avg_rating": 4.5,
+                "stock": 100,
+                "description": "Synthetic product used by the load benchmark.",
+                "image": None,
+            }
+            for product_id in range(1, products + 1)
+        }
+        self.carts: dict[str, dict[int, int]] = {}
+        self.requests: Counter = Counter()
+        self.url = ""
+        self._runner: web.AppRunner | None = None
+        self._session_ids = count(1)
+
+    def _app(self) -> web.Application:
+        app = web.Application()
+        app.middlewares.append(self._delay)
+        app.router.add_get("/api/v1/products/", self.product_list)
+        app.router.add_get("/api/v1/products/{id}", self.product_detail)
+        app.router.add_get("/api/v1/card/", self.cart)
+        app.router.add_post("/api/v1/to_card/", self.to_cart)
+        app.router.add_post("/api/v1/update_card/", self.update_cart)
+        app.router.add_delete("/api/v1/remove_card/{id}", self.remove_from_cart)
+        app.router.add_post("/api/v1/to_order/", self.to_order)
+        app.router.add_post("/api/v1/token/", self.token)
+        app.router.add_post("/api/v1/token/refresh/", self.refresh_token)
+        app.router.add_post("/api/v1/register/", self.register)
+        app.router.add_get("/v1/checkout/sessions/{id}", self.checkout_session)
+        return app
+
+    def faults(
+        self, error_rate: float = 0, slow_rate: float = 0, slow_delay: float = 0
+    ) -> None:
+        """Answer a share of requests with 503, delay another share"""
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.slow_delay = slow_delay
+
+    @web.middleware
+    async def _delay(self, request: web.Request, handler):
+        self.requests[request.match_info.route.resource.canonical] += 1
+        delay = self.latency * (1 + self._random.uniform(-self.jitter, self.jitter))
+        fault = self._random.random()
+        if fault < self.slow_rate:
+            delay += self.slow_delay
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if fault >= 1 - self.error_rate:
+            return web.json_response({"detail": "Injected fault"}, status=503)
+        return await handler(request)
+
+    async def start(self) -> str:
+        self._runner = web.AppRunner(self._app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+        return self.url
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    @staticmethod
+    def _token(request: web.Request) -> str:
+        return request.headers.get("Authorization", "").removeprefix("Bearer ")
+
+    async def product_list(self, request: web.Request) -> web.Response:
+        page = int(request.query.get("page", 1))
+        ids = sorted(self.products)
+        pages = (len(ids) + PAGE_SIZE - 1) // PAGE_SIZE
+        start = (page - 1) * PAGE_SIZE
+        link = f"{self.url}/api/v1/products/?page="
+        return web.json_response(
+            {
+                "count": len(ids),
+                "next": f"{link}{page + 1}" if page < pages else None,
+                "previous": f"{link}{page - 1}" if page > 1 else None,
+                "results": [
+                    {"id": i, "name": self.products[i]["name"]}
+                    for i in ids[start : start + PAGE_SIZE]
+                ],
+            },
+            headers={"Cache-Control": "max-age=60"},
+        )
+
+    async def product_detail(self, request: web.Request) -> web.Response:
+        product = self.products.get(int(request.match_info["id"]))
+        if product is None:
+            return web.json_response({"detail": "Not found."}, status=404)
+        return web.json_response(product)
+
+    def _cart_body(self, token: str) -> dict:
+        products = []
+        for product_id, quantity in self.carts.get(token, {}).items():
+            price = self.products[product_id]["price"]
+            products.append(
+                {
+                    "id": product_id,
+                    "name": self.products[product_id]["name"],
+                    "quantity": quantity,
+                    "price": price,
+                    "total_price": price * quantity,
+                }
+            )
+        total = sum(product["total_price"] for product in products)
+        return {"products": products, "total_price": total}
+
+    async def cart(self, request: web.Request) -> web.Response:
+        return web.json_response(self._cart_body(self._token(request)))
+
+    async def to_cart(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        cart = self.carts.setdefault(self._token(request), {})
+        product_id = int(data["product_id"])
+        cart[product_id] = cart.get(product_id, 0) + int(data["quantity"])
+        return web.json_response({"message": "Added"})
+
+    async def update_cart(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        cart = self.carts.setdefault(self._token(request), {})
+        cart[int(data["card_product_id"])] = int(data["quantity"])
+        return web.json_response({"message": "Updated"})
+
+    async def remove_from_cart(self, request: web.Request) -> web.Response:
+        cart = self.carts.setdefault(self._token(request), {})
+        cart.pop(int(request.match_info["id"]), None)
+        return web.Response(status=204)
+
+    async def to_order(self, request: web.Request) -> web.Response:
+        self.carts.pop(self._token(request), None)
+        session_id = f"cs_bench_{next(self._session_ids)}"
+        return web.json_response(
+            {
+                "session_id": session_id,
+                "checkout_url": f"https://checkout.stripe.com/c/pay/{session_id}",
+            }
+        )
+
+    async def token(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        return web.json_response(
+            {
+                "access": f"token-{data['identifier']}",
+                "refresh": f"refresh-{data['identifier']}",
+            }
+        )
+
+    async def refresh_token(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        identifier = data["refresh"].removeprefix("refresh-")
+        return web.json_response({"access": f"token-{identifier}"})
+
+    async def register(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        return web.json_response({"email": data["email"]}, status=201)
+
+    async def checkout_session(self, request: web.Request) -> web.Response:
+        return web.json_response(
+            {
+                "id": request.match_info["id"],
+                "object": "checkout.session",
+                "status": "complete",
+                "payment_status": "paid",
+            }
+        )
+
+
+class CaptureSession(BaseSession):
+    """Bot session that records calls and fabricates Telegram's answers"""
+
+    def __init__(self):
+        super().__init__()
+        self.calls: Counter = Counter()
+        self.markups: dict[int, tuple[Message, InlineKeyboardMarkup]] = {}
+        self._message_ids = count(1)
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout=None):
+        self.calls[type(method).__name__] += 1
+        if method.__returning__ is bool:
+            return True
+
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return True
+        message = Message(
+            message_id=getattr(method, "message_id", None) or next(self._message_ids),
+            date=datetime.now(timezone.utc),
+            chat=Chat(id=chat_id, type="private"),
+            text=getattr(method, "text", None),
+        ).as_(bot)
+
+        markup = getattr(method, "reply_markup", None)
+        if isinstance(markup, InlineKeyboardMarkup):
+            self.markups[chat_id] = (message, markup)
+        return message
+
+    async def stream_content(self, *args, **kwargs):
+        """The bench never downloads files, so every stream is empty"""
+        for chunk in ():
+            yield chunk
+
+    async def close(self) -> None:
+        pass
+
+
+class MemoryDatabase:
+    """Dict-backed replacements for the database helpers used per update"""
+
+    def __init__(self):
+        self.users: dict[int, CachedUser] = {}
+        self.refresh_tokens: dict[int, str | None] = {}
+        self.checkouts: dict[str, int] = {}
+        self.notified: set[str] = set()
+        self.callback_codes: dict[str, str] = {}
+        self.products: dict[str, dict] = {}
+        self.sync_state: SyncState | None = None
+        self.calls: Counter = Counter()
+
+    def _user(self, chat_id: int) -> CachedUser:
+        user = self.users.setdefault(chat_id, CachedUser(None, None, None))
+        user_cache.set(chat_id, user)
+        return user
+
+    async def get_auth_user(self, session, chat_id: int):
+        self.calls["get_auth_user"] += 1
+        cached = user_cache.get(chat_id)
+        if cached is not None:
+            return cached
+        user = self.users.get(chat_id)
+        if user is not None:
+            user_cache.set(chat_id, user)
+        return user
+
+    async def get_or_create_user(self, session, chat_id: int) -> CachedUser:
+        self.calls["get_or_create_user"] += 1
+        return self._user(chat_id)
+
+    async def get_login_status(self, session, chat_id: int) -> CachedUser:
+        self.calls["get_login_status"] += 1
+        cached = user_cache.get(chat_id)
+        return cached if cached is not None else self._user(chat_id)
+
+    async def get_user(self, session, chat_id: int) -> User | None:
+        self.calls["get_user"] += 1
+        user = self.users.get(chat_id)
+        if user is None:
+            return None
+        return User(
+            chat_id=chat_id,
+            token=user.token,
+            exp=user.exp,
+            updated_at=user.updated_at,
+            token_expires_at=user.expires_at,
+            refresh_token=self.refresh_tokens.get(chat_id),
+        )
+
+    async def update_user_token(
+        self, session, chat_id, token, exp, refresh_token=None, expires_at=None
+    ):
+        self.calls["update_user_token"] += 1
+        self.users[chat_id] = CachedUser(
+            token, exp, datetime.now(timezone.utc), expires_at
+        )
+        self.refresh_tokens[chat_id] = refresh_token
+        return self._user(chat_id)
+
+    async def forget_refresh_token(self, session, chat_id: int):
+        self.calls["forget_refresh_token"] += 1
+        self.refresh_tokens[chat_id] = None
+
+    async def save_checkout_session(self, session, session_id: str, chat_id: int):
+        self.calls["save_checkout_session"] += 1
+        self.checkouts[session_id] = chat_id
+
+    async def get_checkout_chat(self, session, session_id: str):
+        self.calls["get_checkout_chat"] += 1
+        return self.checkouts.get(session_id)
+
+    async def claim_checkout_notification(self, session, session_id: str):
+        self.calls["claim_checkout_notification"] += 1
+        if session_id in self.notified:
+            return None
+        chat_id = self.checkouts.get(session_id)
+        if chat_id is not None:
+            self.notified.add(session_id)
+        return chat_id
+
+    async def save_callback_codes(self, session, codes: dict):
+        self.calls["save_callback_codes"] += 1
+        taken = {}
+        for code, value in codes.items():
+            stored = self.callback_codes.setdefault(code, value)
+            if stored != value:
+                taken[code] = stored
+        return taken
+
+    async def get_callback_value(self, session, code: str):
+        self.calls["get_callback_value"] += 1
+        return self.callback_codes.get(code)
+
+    async def save_user_activity(self, session, rows: list):
+        self.calls["save_user_activity"] += 1
+
+    def _by_position(self) -> list[dict]:
+        return sorted(self.products.values(), key=lambda row: row["position"])
+
+    async def get_products_page(self, session, position, before, limit):
+        self.calls["get_products_page"] += 1
+        rows = [
+            (row["position"], row["listing"])
+            for row in self._by_position()
+            if (row["position"] < position if before else row["position"] > position)
+        ]
+        return rows[-limit:] if before else rows[:limit]
+
+    async def get_product(self, session, product_id: str):
+        self.calls["get_product"] += 1
+        row = self.products.get(product_id)
+        return row and row["data"]
+
+    async def get_product_list_path(self, session, position: int):
+        self.calls["get_product_list_path"] += 1
+        for row in self.products.values():
+            if row["position"] == position:
+                return row["list_path"]
+        return None
+
+    async def get_products(self, session):
+        self.calls["get_products"] += 1
+        return [Product(**row) for row in self._by_position()]
+
+    async def get_product_listings(self, session):
+        self.calls["get_product_listings"] += 1
+        return {
+            product_id: (
+                row["position"],
+                row["listing"],
+                row["list_path"],
+                row["synced_at"],
+            )
+            for product_id, row in self.products.items()
+        }
+
+    async def save_products(self, session, rows, moved, removed, synced_at):
+        self.calls["save_products"] += 1
+        for row in rows:
+            self.products[row["id"]] = dict(row)
+        for row in moved:
+            self.products[row["id"]].update(row)
+        for product_id in removed:
+            self.products.pop(product_id, None)
+        self.sync_state = SyncState(
+            name="products", synced_at=synced_at, rows=len(self.products)
+        )
+        return len(self.products)
+
+    async def get_sync_state(self, session, name: str):
+        self.calls["get_sync_state"] += 1
+        return self.sync_state
+
+    def install(self) -> None:
+        """Replace the helpers everywhere the bot's modules imported them"""
+        replacements = {}
+        for name in (
+            "get_auth_user",
+            "get_or_create_user",
+            "get_login_status",
+            "get_user",
+            "update_user_token",
+            "forget_refresh_token",
+            "save_checkout_session",
+            "get_checkout_chat",
+            "claim_checkout_notification",
+            "save_callback_codes",
+            "get_callback_value",
+            "save_user_activity",
+            "get_products_page",
+            "get_product",
+            "get_product_list_path",
+            "get_products",
+            "get_product_listings",
+            "save_products",
+            "get_sync_state",
+        ):
+            replacements[id(getattr(database.models, name))] = getattr(self, name)
+
+        packages = ("app", "routers", "services", "classes", "database")
+        for module_name, module in list(sys.modules.items()):
+            if module is None or module_name.split(".")[0] not in packages:
+                continue
+            for attr, value in list(vars(module).items()):
+                replacement = replacements.get(id(value))
+                if replacement is not None:
+                    setattr(module, attr, replacement)
@@ -1,57 +1,71 @@
+from aiogram.filters.callback_data import CallbackData
 from aiogram.types import (
     InlineKeyboardButton,
     InlineKeyboardMarkup,
 )
 
-from classes.callback import PageCallback
+from classes.callback import PageCallback, pack_id, page_codes
 from settings import settings
 
 
+def _page_button(text: str, link: str | CallbackData) -> InlineKeyboardButton:
+    """Button to a backend list page by its link, or with ready callback data"""
+    if isinstance(link, CallbackData):
+        return InlineKeyboardButton(text=text, callback_data=link.pack())
+    return InlineKeyboardButton(
+        text=text,
+        callback_data=PageCallback(
+            link_page=page_codes.code_for(link.replace(settings.HOST, ""))
+        ).pack(),
+    )
+
+
+def _navigation_row(next=None, previous=None) -> list[InlineKeyboardButton]:
+    row = []
+    if previous is not None:
+        row.append(_page_button("◀️ Previous", previous))
+    if next is not None:
+        row.append(_page_button("➡️ Next", next))
+    return row
+
+
 def create_inline_keyboard(
     buttons, row_width=3, next=None, previous=None
 ) -> InlineKeyboardMarkup:
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[])
-
-    if all(isinstance(i, list) for i in buttons):
-        for row in buttons:
-            keyboard_row = [
-                InlineKeyboardButton(text=text, callback_data=data)  # TODO eslatma
-                for text, data in row
-            ]
-            keyboard.inline_keyboard.append(keyboard_row)
+    if buttons and isinstance(buttons[0], list):
+        rows = [
+            [InlineKeyboardButton(text=text, callback_data=data) for text, data in row]
+            for row in buttons
+        ]
     else:
-        row = []
-        for text, data in buttons:
-            row.append(InlineKeyboardButton(text=text, callback_data=data))
-            if len(row) == row_width:
-                keyboard.inline_keyboard.append(row)
-                row = []
-        if row:
-            keyboard.inline_keyboard.append(row)
+        flat = [
+            InlineKeyboardButton(text=text, callback_data=data)
+            for text, data in buttons
+        ]
+        rows = [flat[i : i + row_width] for i in range(0, len(flat), row_width)]
 
-    next_previous = []
+    navigation = _navigation_row(next, previous)
+    if navigation:
+        rows.append(navigation)
 
-    if previous is not None:
-        next_previous.append(
-            InlineKeyboardButton(
-                text="◀️ Previous",
-                callback_data=PageCallback(
-                    link_page=previous.replace(settings.HOST, "")
-                ).pack(),
-            )
-        )
+    return InlineKeyboardMarkup(inline_keyboard=rows)
 
-    if next is not None:
-        next_previous.append(
-            InlineKeyboardButton(
-                text="➡️ Next",
-                callback_data=PageCallback(
-                    link_page=next.replace(settings.HOST, "")
-                ).pack(),
-            )
+
+def create_list_keyboard(
+    items, callback, row_width=3, next=None, previous=None
+) -> InlineKeyboardMarkup:
+    """Keyboard of product-like dicts, one button per item, in a single pass"""
+    flat = [
+        InlineKeyboardButton(
+            text=f"📦 {item['name'][:20]}",
+            callback_data=callback(product_id=pack_id(item["id"])).pack(),
         )
+        for item in items
+    ]
+    rows = [flat[i : i + row_width] for i in range(0, len(flat), row_width)]
 
-    if next_previous:
-        keyboard.inline_keyboard.append(next_previous)
+    navigation = _navigation_row(next, previous)
+    if navigation:
+        rows.append(navigation)
 
-    return keyboard
+    return InlineKeyboardMarkup(inline_keyboard=rows)
@@ -1,44 +1,29 @@
 from aiogram.types import KeyboardButton, ReplyKeyboardMarkup
 
 
+def _button(b) -> KeyboardButton:
+    if isinstance(b, str):
+        return KeyboardButton(text=b)
+    if len(b) == 2 and b[1] == "location":
+        return KeyboardButton(text=b[0], request_location=True)
+    if len(b) == 2 and b[1] == "contact":
+        return KeyboardButton(text=b[0], request_contact=True)
+    return KeyboardButton(text=b[0])
+
+
 def create_keyboard(
     buttons,
     row_width=3,
     resize=True,
     one_time=True,
 ) -> ReplyKeyboardMarkup:
-    keyboard = ReplyKeyboardMarkup(
-        resize_keyboard=resize, one_time_keyboard=one_time, keyboard=[]
-    )
-
-    if all(isinstance(i, list) for i in buttons):
-        for row in buttons:
-            keyboard_row = []
-            for b in row:
-                if len(b) == 2 and b[1] == "location":
-                    keyboard_row.append(
-                        KeyboardButton(text=b[0], request_location=True)
-                    )
-                elif len(b) == 2 and b[1] == "contact":
-                    keyboard_row.append(KeyboardButton(text=b[0], request_contact=True))
-                else:
-                    keyboard_row.append(KeyboardButton(text=b[0]))
-            keyboard.keyboard.append(keyboard_row)
+    if buttons and isinstance(buttons[0], list):
+        rows = [[_button(b) for b in row] for row in buttons]
     else:
         # плоский список
-        row = []
-        for b in buttons:
-            if isinstance(b, tuple) and len(b) == 2 and b[1] == "location":
-                row.append(KeyboardButton(text=b[0], request_location=True))
-            elif isinstance(b, tuple) and len(b) == 2 and b[1] == "contact":
-                row.append(KeyboardButton(text=b[0], request_contact=True))
-            else:
-                row.append(KeyboardButton(text=b if isinstance(b, str) else b[0]))
-
-            if len(row) == row_width:
-                keyboard.keyboard.append(row)
-                row = []
-        if row:
-            keyboard.keyboard.append(row)
+        flat = [_button(b) for b in buttons]
+        rows = [flat[i : i + row_width] for i in range(0, len(flat), row_width)]
 
-    return keyboard
+    return ReplyKeyboardMarkup(
+        resize_keyboard=resize, one_time_keyboard=one_time, keyboard=rows
+    )
@@ -0,0 +1,58 @@
+"""Keyboards and texts that never change, built once at import"""
+
+from buttons.inline import create_inline_keyboard
+from buttons.keyboard import create_keyboard
+
+CART_ACTIONS = create_inline_keyboard(
+    [[("✏️ Update Cart", "update_card")], [("✅ Place Order", "to_order")]]
+)
+LOCATION_KEYBOARD = create_keyboard([("📍 Send Location", "location")])
+
+WELCOME_BACK_TEXT = """
+    👋 <b>Welcome back!</b>
+
+    You are logged in. Here's what you can do:
+
+    🛒 <b>Shopping:</b>
+    /products - Browse all products
+    /my_cart - View your shopping cart
+
+    📋 <b>Account:</b>
+    /login - Switch account
+    /register - Create new account
+
+    💡 <b>Tips:</b>
+    - Add products to cart from /products
+    - Check out from /my_card
+    - Your session is renewed automatically, /login again if it is ever lost
+        """
+
+WELCOME_TEXT = """
+    🛍️ <b>Welcome to E-Commerce Bot!</b>
+
+    This bot helps you shop online with ease.
+
+    🔐 <b>First, you need to log in:</b>
+    <code>/login email password</code>
+
+    🆕 <b>New user? Register:</b>
+    <code>/register email password password_confirm</code>
+
+    🛒 <b>After login you can:</b>
+    /products - Browse products
+    /my_card - View shopping cart
+
+    📱 <b>Example:</b>
+    <code>/login user@example.com mypassword</code>
+        """
+
+UPDATE_CART_TEXT = """
+✏️ *Update Product:*
+Enter new quantity (number)
+Or type 'delete' to remove from cart
+Or type 'cancel' to cancel
+    """
+
+UNAVAILABLE_TEXT = (
+    "🛠 The shop is temporarily unavailable. Please try again in a minute."
+)
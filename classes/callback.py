@@ -1,10 +1,172 @@
+import asyncio
+import base64
+import hashlib
+import logging
+import re
+from collections import OrderedDict
+from urllib.parse import urlsplit
+from uuid import UUID
+
 from aiogram.filters.callback_data import CallbackData
 
+from database.base import async_session
+from database.models import get_callback_value, save_callback_codes
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Compact values start with "~", which never occurs in backend paths or ids,
+# so buttons sent before the compact encoding keep working
+COMPACT = "~"
+
+CATALOG_PATHS = ("/api/v1/products", "/api/v1/products/")
+# Ids sent before the compact encoding, as the backend makes them
+LEGACY_ID = re.compile(r"[A-Za-z0-9_-]+")
+
+
+def is_catalog_page(path: str) -> bool:
+    """Whether a page callback value is a product list page of the backend
+
+    Values come from the client and are appended to settings.HOST, so
+    anything else could send requests, with the user's token, elsewhere.
+    """
+    parts = urlsplit(path)
+    return (
+        not parts.scheme
+        and not parts.netloc
+        and not parts.fragment
+        and parts.path in CATALOG_PATHS
+    )
+
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def _b64decode(value: str) -> bytes:
+    return base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+
+
+def pack_id(value) -> str:
+    """Binary-pack numeric and UUID ids into a short callback value"""
+    value = str(value)
+    if value.isdigit() and not value.startswith("0"):
+        number = int(value)
+        return f"{COMPACT}n" + _b64encode(
+            number.to_bytes((number.bit_length() + 7) // 8, "big")
+        )
+    try:
+        uuid = UUID(value)
+    except ValueError:
+        return value
+    if str(uuid) == value:
+        return f"{COMPACT}u" + _b64encode(uuid.bytes)
+    return value
+
+
+def unpack_id(value: str) -> str | None:
+    """Reverse pack_id(), None for a value it could not have produced"""
+    if not value.startswith(COMPACT):
+        return value if LEGACY_ID.fullmatch(value) else None
+    try:
+        raw = _b64decode(value[2:])
+    except ValueError:
+        return None
+    if value[1:2] == "n" and raw:
+        return str(int.from_bytes(raw, "big"))
+    if value[1:2] == "u" and len(raw) == 16:
+        return str(UUID(bytes=raw))
+    return None
+
+
+class ShortCodeRegistry:
+    """Maps long callback values (backend paths) to short stable codes
+
+    Codes are a hash of the value, recently used ones are kept in an LRU
+    and every new code is persisted, so buttons outlive restarts.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._values: OrderedDict[str, str] = OrderedDict()
+        self._unsaved: dict[str, str] = {}
+        self._flush_task: asyncio.Task | None = None
+
+    @staticmethod
+    def make_code(value: str, attempt: int = 0) -> str:
+        salt = attempt.to_bytes(1, "big") if attempt else b""
+        digest = hashlib.blake2b(value.encode(), digest_size=6, salt=salt).digest()
+        return COMPACT + _b64encode(digest)
+
+    def code_for(self, value: str) -> str:
+        # Another value with the same hash moves this one to a salted code
+        attempt = 0
+        code = self.make_code(value)
+        while (known := self._values.get(code)) not in (None, value):
+            attempt += 1
+            code = self.make_code(value, attempt)
+        if known is not None:
+            self._values.move_to_end(code)
+            return code
+
+        self._remember(code, value)
+        self._unsaved[code] = value
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self.flush())
+        return code
+
+    def _remember(self, code: str, value: str) -> None:
+        self._values[code] = value
+        while len(self._values) > self.maxsize:
+            self._values.popitem(last=False)
+
+    async def resolve(self, code: str) -> str | None:
+        if not code.startswith(COMPACT):
+            return code
+
+        value = self._values.get(code)
+        if value is not None:
+            self._values.move_to_end(code)
+            return value
+
+        async with async_session() as session:
+            value = await get_callback_value(session, code)
+        if value is not None:
+            self._remember(code, value)
+        return value
+
+    async def flush(self) -> None:
+        """Persist codes created since the last flush"""
+        if not self._unsaved:
+            return
+        codes, self._unsaved = self._unsaved, {}
+        try:
+            async with async_session() as session:
+                taken = await save_callback_codes(session, codes)
+        except Exception:
+            logger.exception("Failed to persist %d callback codes", len(codes))
+            self._unsaved.update(codes)
+            return
+        for code in taken:
+            # Evicted from the LRU before the collision could be seen; the
+            # button resolves correctly only while the code stays cached
+            logger.error("Callback code %s is taken by another value", code)
+
+
+page_codes = ShortCodeRegistry(maxsize=settings.CALLBACK_CODES_CACHE_SIZE)
+
 
 class PageCallback(CallbackData, prefix="page"):
     link_page: str
 
 
+class ReplicaPageCallback(CallbackData, prefix="rpage"):
+    """Keyset page of the catalog replica: after `position`, or before it"""
+
+    position: int
+    before: bool = False
+
+
 class PaginationCard(CallbackData, prefix="pagination"):
     page: int
 
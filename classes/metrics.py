@@ -0,0 +1,145 @@
+from bisect import bisect_left
+from typing import Callable
+
+# Seconds, from a cached lookup up to a slow backend call
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    """Metrics rendered together in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics: dict[str, "Metric"] = {}
+
+    def register(self, metric: "Metric") -> None:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+class Metric:
+    """A named metric with optional labels
+
+    Values are updated in place, or, when `collect` is given, read from
+    it on every scrape: a number, or {label values: number} for a
+    labelled metric. The latter exports counters kept elsewhere.
+    """
+
+    type = "untyped"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: tuple = (),
+        collect: Callable | None = None,
+        registry: Registry = registry,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.collect = collect
+        self._values: dict[tuple, float] = {}
+        registry.register(self)
+
+    def _current(self) -> dict[tuple, float]:
+        if self.collect is None:
+            return self._values
+        values = self.collect()
+        return values if isinstance(values, dict) else {(): values}
+
+    def samples(self):
+        for values, value in self._current().items():
+            yield f"{self.name}{_labels(self.labels, values)} {_number(value)}"
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, *labels) -> None:
+        self._values[labels] = value
+
+
+class _Series:
+    __slots__ = ("counts", "sum")
+
+    def __init__(self, size: int):
+        self.counts = [0] * size
+        self.sum = 0.0
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, *args, buckets: tuple = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(buckets)
+        self._series: dict[tuple, _Series] = {}
+
+    def observe(self, value: float, *labels) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = _Series(len(self.buckets) + 1)
+        series.counts[bisect_left(self.buckets, value)] += 1
+        series.sum += value
+
+    def samples(self):
+        bounds = self.buckets + (float("inf"),)
+        for values, series in self._series.items():
+            total = 0
+            for bound, count in zip(bounds, series.counts):
+                total += count
+                le = _labels(self.labels, values, f'le="{_number(bound)}"')
+                yield f"{self.name}_bucket{le} {total}"
+            labels = _labels(self.labels, values)
+            yield f"{self.name}_sum{labels} {_number(series.sum)}"
+            yield f"{self.name}_count{labels} {total}"
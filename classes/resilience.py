@@ -0,0 +1,128 @@
+from collections import deque
+from time import monotonic
+
+
+class CircuitBreaker:
+    """Stop calling an endpoint after `failures` failures in a row
+
+    An open breaker rejects calls for `reset_timeout` seconds, then lets
+    a single probe through (half-open): its success closes the breaker,
+    its failure opens it again.
+    """
+
+    CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+
+    def __init__(self, failures: int, reset_timeout: float):
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failed = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+        self.opened = 0
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        if self.state == self.OPEN:
+            if monotonic() - self._opened_at < self.reset_timeout:
+                self.rejected += 1
+                return False
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            if self._probing:
+                self.rejected += 1
+                return False
+            self._probing = True
+        return True
+
+    def success(self) -> None:
+        self.state = self.CLOSED
+        self._failed = 0
+        self._probing = False
+
+    def failure(self) -> None:
+        self._failed += 1
+        if self.state == self.HALF_OPEN or self._failed >= self.failures:
+            if self.state != self.OPEN:
+                self.opened += 1
+            self.state = self.OPEN
+            self._opened_at = monotonic()
+        self._probing = False
+
+    def release(self) -> None:
+        """The call was cancelled: neither a success nor a failure"""
+        self._probing = False
+
+
+class RetryBudget:
+    """Retries allowed as a share of requests, so retries cannot snowball
+
+    Every request adds `ratio` of a retry, and `min_per_second` retries
+    are added per second so a quiet bot can still retry; at most
+    `max_tokens` are saved up.
+    """
+
+    def __init__(self, ratio: float, min_per_second: float, max_tokens: float = 10):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._updated = monotonic()
+
+        self.exhausted = 0
+
+    def deposit(self) -> None:
+        self._tokens = min(self._tokens + self.ratio, self.max_tokens)
+
+    def withdraw(self) -> bool:
+        now = monotonic()
+        self._tokens = min(
+            self._tokens + (now - self._updated) * self.min_per_second,
+            self.max_tokens,
+        )
+        self._updated = now
+        if self._tokens < 1:
+            self.exhausted += 1
+            return False
+        self._tokens -= 1
+        return True
+
+
+class AdaptiveTimeout:
+    """Timeout of `factor` × p99 of the last `window` call durations
+
+    Stays at `maximum` until `min_samples` durations are known. Calls
+    that time out are recorded with their duration, so the timeout grows
+    back when the endpoint slows down for good.
+    """
+
+    def __init__(
+        self,
+        minimum: float,
+        maximum: float,
+        factor: float,
+        window: int = 200,
+        min_samples: int = 20,
+    ):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.factor = factor
+        self.min_samples = min_samples
+        self._durations: deque[float] = deque(maxlen=window)
+        self._timeout = maximum
+        self._stale = 0
+
+    def observe(self, seconds: float) -> None:
+        self._durations.append(seconds)
+        self._stale += 1
+
+    @property
+    def timeout(self) -> float:
+        # Sorting the window on every call would cost more than the request
+        if self._stale >= self.min_samples:
+            self._stale = 0
+            durations = sorted(self._durations)
+            p99 = durations[min(int(len(durations) * 0.99), len(durations) - 1)]
+            self._timeout = min(max(p99 * self.factor, self.minimum), self.maximum)
+        return self._timeout
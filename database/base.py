@@ -1,11 +1,98 @@
+import asyncio
+from time import perf_counter
+
+from sqlalchemy import event, exc, inspect, text
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import DeclarativeBase, declared_attr, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
+from classes.metrics import Histogram
 from settings import settings
 
 DATABASE_URL = settings.DATABASE_URL
 
-engine = create_async_engine(DATABASE_URL, echo=False, future=True)
+
+class PoolMetrics:
+    """Счётчики пула соединений и времени запросов"""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.checkout_timeouts = 0
+        self.checkout_wait_total = 0.0
+        self.checkout_wait_max = 0.0
+        self.overflow_max = 0
+
+        self.queries = 0
+        self.query_time_total = 0.0
+        self.query_time_max = 0.0
+
+    def snapshot(self, pool) -> dict:
+        """Текущее состояние пула вместе с накопленными счётчиками"""
+        return {
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "idle": pool.checkedin(),
+            "overflow": max(pool.overflow(), 0),
+            "overflow_max": self.overflow_max,
+            "checkouts": self.checkouts,
+            "checkout_timeouts": self.checkout_timeouts,
+            "checkout_wait_avg": self.checkout_wait_total / (self.checkouts or 1),
+            "checkout_wait_max": self.checkout_wait_max,
+            "queries": self.queries,
+            "query_time_avg": self.query_time_total / (self.queries or 1),
+            "query_time_max": self.query_time_max,
+        }
+
+
+pool_metrics = PoolMetrics()
+query_seconds = Histogram("bot_db_query_seconds", "Database query latency")
+
+
+class MeasuredPool(AsyncAdaptedQueuePool):
+    """Пул, замеряющий ожидание свободного соединения"""
+
+    def _do_get(self):
+        started = perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            pool_metrics.checkout_timeouts += 1
+            raise
+        finally:
+            waited = perf_counter() - started
+            pool_metrics.checkouts += 1
+            pool_metrics.checkout_wait_total += waited
+            pool_metrics.checkout_wait_max = max(pool_metrics.checkout_wait_max, waited)
+            pool_metrics.overflow_max = max(pool_metrics.overflow_max, self.overflow())
+
+
+engine = create_async_engine(
+    DATABASE_URL,
+    echo=False,
+    future=True,
+    poolclass=MeasuredPool,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    pool_pre_ping=settings.DB_POOL_PRE_PING,
+    connect_args={"prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE},
+)
+
+
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    # Kept on the execution context, which a failed statement simply drops
+    context._query_started = perf_counter()
+
+
+@event.listens_for(engine.sync_engine, "after_cursor_execute")
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    elapsed = perf_counter() - context._query_started
+    query_seconds.observe(elapsed)
+    pool_metrics.queries += 1
+    pool_metrics.query_time_total += elapsed
+    pool_metrics.query_time_max = max(pool_metrics.query_time_max, elapsed)
 
 
 class Base(DeclarativeBase):
@@ -16,7 +103,54 @@ class Base(DeclarativeBase):
 
 async_session = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
 
+# Single-statement writes commit by themselves, without BEGIN/COMMIT round trips
+autocommit_session = sessionmaker(
+    engine.execution_options(isolation_level="AUTOCOMMIT"),
+    expire_on_commit=False,
+    class_=AsyncSession,
+)
+
+
+def _add_missing_columns(conn):
+    """create_all не меняет существующие таблицы: добавить новые колонки
+
+    Колонки, добавленные в модели позже, должны быть nullable.
+    """
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=conn.dialect)
+                conn.execute(
+                    text(
+                        f'ALTER TABLE "{table.name}" '
+                        f'ADD COLUMN IF NOT EXISTS "{column.name}" {column_type}'
+                    )
+                )
+
 
 async def init():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_add_missing_columns)
+
+
+async def warm_up(connections: int = settings.DB_POOL_MIN_SIZE):
+    """Заранее открыть соединения, чтобы первые апдейты их не ждали"""
+    conns = [engine.connect() for _ in range(min(connections, settings.DB_POOL_SIZE))]
+    results = await asyncio.gather(
+        *(conn.start() for conn in conns), return_exceptions=True
+    )
+    # Возвращаем соединения в пул, где они и остаются открытыми
+    await asyncio.gather(
+        *(conn.close() for conn in conns if conn.sync_connection is not None)
+    )
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+
+
+def pool_stats() -> dict:
+    """Метрики пула соединений движка"""
+    return pool_metrics.snapshot(engine.pool)
@@ -1,24 +1,46 @@
 from datetime import datetime, timedelta, timezone
+from typing import NamedTuple
 
 from sqlalchemy import (
     BigInteger,
     DateTime,
     Integer,
+    SmallInteger,
     String,
+    delete,
+    func,
+    literal_column,
     select,
     update,
 )
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects.postgresql import JSONB, insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Mapped, mapped_column
 
+from classes.cache import TTLCache
 from database.base import Base
+from settings import settings
+
+
+def _exp_time(
+    exp: int | None, updated_at: datetime | None, expires_at: datetime | None
+):
+    if expires_at:
+        return expires_at
+    if exp and updated_at:
+        return updated_at + timedelta(hours=exp)
+    return None
 
 
 class User(Base):
     chat_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
     token: Mapped[str | None] = mapped_column(String, nullable=True)
     exp: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    refresh_token: Mapped[str | None] = mapped_column(String, nullable=True)
+    # exp из самого access-токена; exp в часах остаётся для токенов без него
+    token_expires_at: Mapped[datetime | None] = mapped_column(
+        DateTime(timezone=True), nullable=True
+    )
     created_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True),
         default=lambda: datetime.now(timezone.utc)
@@ -28,13 +50,16 @@ class User(Base):
         default=lambda: datetime.now(timezone.utc),
         onupdate=lambda: datetime.now(timezone.utc)
     )
+    last_seen_at: Mapped[datetime | None] = mapped_column(
+        DateTime(timezone=True), nullable=True
+    )
+    commands: Mapped[dict | None] = mapped_column(JSONB, nullable=True)
+    funnel_stage: Mapped[int | None] = mapped_column(SmallInteger, nullable=True)
 
     @property
     def exp_time(self):
         """Время истечения токена"""
-        if self.exp and self.updated_at:
-            return self.updated_at + timedelta(hours=self.exp)
-        return None
+        return _exp_time(self.exp, self.updated_at, self.token_expires_at)
 
     @property
     def is_expired(self):
@@ -45,6 +70,94 @@ class User(Base):
         return datetime.now(timezone.utc) > exp_time
 
 
+class FsmState(Base):
+    key: Mapped[str] = mapped_column(String, primary_key=True)
+    state: Mapped[str | None] = mapped_column(String, nullable=True)
+    data: Mapped[dict] = mapped_column(JSONB, default=dict)
+    expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), index=True)
+
+
+class CheckoutSession(Base):
+    session_id: Mapped[str] = mapped_column(String, primary_key=True)
+    chat_id: Mapped[int] = mapped_column(BigInteger)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), default=lambda: datetime.now(timezone.utc)
+    )
+    # Когда пользователю сообщили итог оплаты; сообщают один раз
+    notified_at: Mapped[datetime | None] = mapped_column(
+        DateTime(timezone=True), nullable=True
+    )
+
+
+class CallbackCode(Base):
+    code: Mapped[str] = mapped_column(String, primary_key=True)
+    value: Mapped[str] = mapped_column(String)
+
+
+class Product(Base):
+    """Копия товара из каталога бэкенда, её наполняет services.replica"""
+
+    id: Mapped[str] = mapped_column(String, primary_key=True)
+    # Порядок в списке бэкенда, по нему идёт keyset-пагинация
+    position: Mapped[int] = mapped_column(Integer, index=True)
+    name: Mapped[str] = mapped_column(String)
+    # Элемент списка: по нему видно, изменился ли товар
+    listing: Mapped[dict] = mapped_column(JSONB)
+    # Ответ /api/v1/products/<id>
+    data: Mapped[dict] = mapped_column(JSONB)
+    # Страница списка бэкенда, на которой был товар
+    list_path: Mapped[str] = mapped_column(String)
+    synced_at: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+
+
+class SyncState(Base):
+    name: Mapped[str] = mapped_column(String, primary_key=True)
+    synced_at: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+    rows: Mapped[int] = mapped_column(Integer)
+
+
+class CachedUser(NamedTuple):
+    """Снимок авторизационных данных пользователя"""
+
+    token: str | None
+    exp: int | None
+    updated_at: datetime | None
+    expires_at: datetime | None = None
+
+    @property
+    def exp_time(self):
+        return _exp_time(self.exp, self.updated_at, self.expires_at)
+
+    @property
+    def is_expired(self):
+        exp_time = self.exp_time
+        if not exp_time:
+            return True
+        return datetime.now(timezone.utc) > exp_time
+
+
+user_cache = TTLCache(maxsize=settings.AUTH_CACHE_SIZE, ttl=settings.AUTH_CACHE_TTL)
+
+
+def cache_user(user: User) -> CachedUser:
+    """Положить пользователя в кэш авторизации"""
+    cached = CachedUser(user.token, user.exp, user.updated_at, user.token_expires_at)
+    user_cache.set(user.chat_id, cached)
+    return cached
+
+
+async def get_auth_user(session: AsyncSession, chat_id: int) -> CachedUser | None:
+    """Получить данные авторизации из кэша или из базы"""
+    cached = user_cache.get(chat_id)
+    if cached is not None:
+        return cached
+
+    user = await get_user(session, chat_id)
+    if user is None:
+        return None
+    return cache_user(user)
+
+
 async def get_user(session: AsyncSession, chat_id: int):
     """Получить пользователя"""
     stmt = select(User).where(User.chat_id == chat_id)
@@ -52,28 +165,283 @@ async def get_user(session: AsyncSession, chat_id: int):
     return result.scalar_one_or_none()
 
 
-async def get_or_create_user(session: AsyncSession, chat_id: int):
-    """Получить или создать пользователя без ошибок"""
-    user = await get_user(session, chat_id)
-    if user:
-        return user
-
-    try:
-        user = User(chat_id=chat_id)
-        session.add(user)
-        await session.commit()
-        await session.refresh(user)
-        return user
-    except IntegrityError:
-        await session.rollback()
-        return await get_user(session, chat_id)
-    except Exception as e:
-        await session.rollback()
-        raise e
-
-
-async def update_user_token(session: AsyncSession, chat_id: int, token: str, exp: int):
-    """Обновить токен пользователя"""
-    stmt = update(User).where(User.chat_id == chat_id).values(token=token, exp=exp)
+def _upsert_user(chat_id: int, **values):
+    """INSERT ... ON CONFLICT DO UPDATE, возвращающий данные авторизации
+
+    Без values конфликт обновляет chat_id самим собой: строка не меняется,
+    но RETURNING отдаёт существующего пользователя.
+    """
+    stmt = insert(User).values(chat_id=chat_id, **values)
+    return stmt.on_conflict_do_update(
+        index_elements=[User.chat_id],
+        set_=values or {"chat_id": stmt.excluded.chat_id},
+    ).returning(User.token, User.exp, User.updated_at, User.token_expires_at)
+
+
+async def get_or_create_user(session: AsyncSession, chat_id: int) -> CachedUser:
+    """Получить или создать пользователя одним запросом"""
+    result = await session.execute(_upsert_user(chat_id))
+    cached = CachedUser(*result.one())
+    await session.commit()
+    user_cache.set(chat_id, cached)
+    return cached
+
+
+async def get_login_status(session: AsyncSession, chat_id: int) -> CachedUser:
+    """Данные авторизации из кэша, иначе создать/получить пользователя"""
+    cached = user_cache.get(chat_id)
+    if cached is not None:
+        return cached
+    return await get_or_create_user(session, chat_id)
+
+
+async def update_user_token(
+    session: AsyncSession,
+    chat_id: int,
+    token: str,
+    exp: int | None,
+    refresh_token: str | None = None,
+    expires_at: datetime | None = None,
+) -> CachedUser:
+    """Создать пользователя при необходимости и обновить его токены"""
+    result = await session.execute(
+        _upsert_user(
+            chat_id,
+            token=token,
+            exp=exp,
+            refresh_token=refresh_token,
+            token_expires_at=expires_at,
+            updated_at=datetime.now(timezone.utc),
+        )
+    )
+    cached = CachedUser(*result.one())
+    await session.commit()
+    user_cache.set(chat_id, cached)
+    return cached
+
+
+async def forget_refresh_token(session: AsyncSession, chat_id: int):
+    """Удалить refresh-токен, который бэкенд больше не принимает"""
+    stmt = update(User).where(User.chat_id == chat_id).values(refresh_token=None)
     await session.execute(stmt)
     await session.commit()
+
+
+async def get_expiring_users(
+    session: AsyncSession, before: datetime, limit: int
+) -> list[int]:
+    """chat_id пользователей, чьи токены истекают раньше before"""
+    stmt = (
+        select(User.chat_id)
+        .where(User.refresh_token.is_not(None), User.token_expires_at < before)
+        .order_by(User.token_expires_at)
+        .limit(limit)
+    )
+    result = await session.execute(stmt)
+    return list(result.scalars())
+
+
+# Складывает счётчики команд из таблицы и из новой пачки
+_MERGE_COMMANDS = literal_column(
+    "(SELECT jsonb_object_agg(key, total) FROM ("
+    " SELECT key, sum(value::bigint) AS total FROM ("
+    "  SELECT * FROM jsonb_each_text(coalesce(users.commands, '{}'))"
+    "  UNION ALL SELECT * FROM jsonb_each_text(excluded.commands)"
+    " ) AS counts GROUP BY key"
+    ") AS merged)"
+)
+
+
+async def save_user_activity(session: AsyncSession, rows: list[dict]):
+    """Сохранить пачку активности пользователей одним запросом
+
+    rows: chat_id, last_seen_at, commands ({команда: число}), funnel_stage.
+    Счётчики команд прибавляются, этап воронки только растёт.
+    """
+    stmt = insert(User).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[User.chat_id],
+        set_={
+            "last_seen_at": func.greatest(
+                User.last_seen_at, stmt.excluded.last_seen_at
+            ),
+            "commands": _MERGE_COMMANDS,
+            "funnel_stage": func.greatest(
+                User.funnel_stage, stmt.excluded.funnel_stage
+            ),
+        },
+    )
+    await session.execute(stmt)
+    await session.commit()
+
+
+async def save_checkout_session(session: AsyncSession, session_id: str, chat_id: int):
+    """Запомнить, какому чату принадлежит сессия оплаты Stripe"""
+    stmt = (
+        insert(CheckoutSession)
+        .values(session_id=session_id, chat_id=chat_id)
+        .on_conflict_do_nothing()
+    )
+    await session.execute(stmt)
+    await session.commit()
+
+
+async def get_checkout_chat(session: AsyncSession, session_id: str) -> int | None:
+    """Получить chat_id по сессии оплаты Stripe"""
+    stmt = select(CheckoutSession.chat_id).where(
+        CheckoutSession.session_id == session_id
+    )
+    result = await session.execute(stmt)
+    return result.scalar_one_or_none()
+
+
+async def claim_checkout_notification(
+    session: AsyncSession, session_id: str
+) -> int | None:
+    """Отметить, что итог оплаты сообщён; chat_id, если раньше не сообщали
+
+    Из одновременных вызовов chat_id получает только один.
+    """
+    stmt = (
+        update(CheckoutSession)
+        .where(
+            CheckoutSession.session_id == session_id,
+            CheckoutSession.notified_at.is_(None),
+        )
+        .values(notified_at=func.now())
+        .returning(CheckoutSession.chat_id)
+    )
+    chat_id = (await session.execute(stmt)).scalar_one_or_none()
+    await session.commit()
+    return chat_id
+
+
+async def save_callback_codes(
+    session: AsyncSession, codes: dict[str, str]
+) -> dict[str, str]:
+    """Сохранить короткие коды callback-данных
+
+    Возвращает коды, уже занятые другим значением, с этим значением.
+    """
+    stmt = (
+        insert(CallbackCode)
+        .values([{"code": code, "value": value} for code, value in codes.items()])
+        .on_conflict_do_nothing()
+        .returning(CallbackCode.code)
+    )
+    inserted = set((await session.execute(stmt)).scalars())
+    await session.commit()
+
+    existing = [code for code in codes if code not in inserted]
+    if not existing:
+        return {}
+    stmt = select(CallbackCode.code, CallbackCode.value).where(
+        CallbackCode.code.in_(existing)
+    )
+    return {
+        code: value
+        for code, value in await session.execute(stmt)
+        if value != codes[code]
+    }
+
+
+async def get_callback_value(session: AsyncSession, code: str) -> str | None:
+    """Получить значение по короткому коду callback-данных"""
+    stmt = select(CallbackCode.value).where(CallbackCode.code == code)
+    result = await session.execute(stmt)
+    return result.scalar_one_or_none()
+
+
+async def get_products_page(
+    session: AsyncSession, position: int, before: bool, limit: int
+) -> list[tuple[int, dict]]:
+    """(position, элемент списка) товаров после position или перед ней
+
+    Товары всегда в порядке списка бэкенда.
+    """
+    stmt = select(Product.position, Product.listing).limit(limit)
+    if before:
+        stmt = stmt.where(Product.position < position).order_by(Product.position.desc())
+    else:
+        stmt = stmt.where(Product.position > position).order_by(Product.position)
+    result = await session.execute(stmt)
+    rows = [tuple(row) for row in result]
+    return rows[::-1] if before else rows
+
+
+async def get_product(session: AsyncSession, product_id: str) -> dict | None:
+    """Данные товара из копии каталога"""
+    stmt = select(Product.data).where(Product.id == product_id)
+    result = await session.execute(stmt)
+    return result.scalar_one_or_none()
+
+
+async def get_product_list_path(session: AsyncSession, position: int) -> str | None:
+    """Страница списка бэкенда, на которой был товар с этой позицией"""
+    stmt = select(Product.list_path).where(Product.position == position).limit(1)
+    result = await session.execute(stmt)
+    return result.scalar_one_or_none()
+
+
+async def get_products(session: AsyncSession) -> list[Product]:
+    """Все товары копии каталога в порядке списка"""
+    result = await session.execute(select(Product).order_by(Product.position))
+    return list(result.scalars())
+
+
+async def get_product_listings(session: AsyncSession) -> dict[str, tuple]:
+    """id товара -> (position, listing, list_path, synced_at) для синхронизации"""
+    stmt = select(
+        Product.id,
+        Product.position,
+        Product.listing,
+        Product.list_path,
+        Product.synced_at,
+    )
+    result = await session.execute(stmt)
+    return {row[0]: tuple(row[1:]) for row in result}
+
+
+async def save_products(
+    session: AsyncSession,
+    rows: list[dict],
+    moved: list[dict],
+    removed: list[str],
+    synced_at: datetime,
+) -> int:
+    """Записать изменения каталога и время синхронизации одной транзакцией
+
+    rows: новые и изменившиеся товары целиком; moved: id, position и
+    list_path товаров, которые только сдвинулись в списке. Возвращает
+    число товаров в копии.
+    """
+    # asyncpg принимает не больше 32767 параметров на запрос
+    for start in range(0, len(rows), 1000):
+        stmt = insert(Product).values(rows[start : start + 1000])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Product.id],
+            set_={
+                column: stmt.excluded[column] for column in rows[0] if column != "id"
+            },
+        )
+        await session.execute(stmt)
+    if moved:
+        await session.execute(update(Product), moved)
+    if removed:
+        await session.execute(delete(Product).where(Product.id.in_(removed)))
+
+    count = await session.execute(select(func.count()).select_from(Product))
+    values = {"synced_at": synced_at, "rows": count.scalar_one()}
+    stmt = insert(SyncState).values(name="products", **values)
+    await session.execute(
+        stmt.on_conflict_do_update(index_elements=[SyncState.name], set_=values)
+    )
+    await session.commit()
+    return values["rows"]
+
+
+async def get_sync_state(session: AsyncSession, name: str) -> SyncState | None:
+    """Когда копия была синхронизирована в последний раз и сколько в ней строк"""
+    stmt = select(SyncState).where(SyncState.name == name)
+    result = await session.execute(stmt)
+    return result.scalar_one_or_none()
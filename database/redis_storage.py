@@ -0,0 +1,85 @@
+import asyncio
+from typing import Any, Mapping
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import StateType, StorageKey
+from aiogram.fsm.storage.redis import RedisStorage
+
+
+class PipelinedRedisStorage(RedisStorage):
+    """RedisStorage, отправляющий команды одновременных апдейтов вместе
+
+    Команды, поданные за одну итерацию цикла событий, уходят в Redis одним
+    конвейером без MULTI: N чатов стоят одного обмена с сервером, а не N.
+    Результат и ошибка у каждой команды свои.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._batch: list[tuple[str, tuple, dict, asyncio.Future]] = []
+        self._sending: set[asyncio.Task] = set()
+        self.pipelines = 0
+
+    def _command(self, name: str, *args, **kwargs) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        if not self._batch:
+            loop.call_soon(self._flush)
+        future = loop.create_future()
+        self._batch.append((name, args, kwargs, future))
+        return future
+
+    def _flush(self) -> None:
+        batch, self._batch = self._batch, []
+        task = asyncio.ensure_future(self._send(batch))
+        self._sending.add(task)
+        task.add_done_callback(self._sending.discard)
+
+    async def _send(self, batch: list) -> None:
+        self.pipelines += 1
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for name, args, kwargs, _ in batch:
+                    getattr(pipe, name)(*args, **kwargs)
+                results = await pipe.execute(raise_on_error=False)
+        except Exception as error:
+            results = [error] * len(batch)
+
+        for (*_, future), result in zip(batch, results):
+            # Ожидавший команду апдейт мог быть отменён
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        redis_key = self.key_builder.build(key, "state")
+        if state is None:
+            await self._command("delete", redis_key)
+        else:
+            state = state.state if isinstance(state, State) else state
+            await self._command("set", redis_key, state, ex=self.state_ttl)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        value = await self._command("get", self.key_builder.build(key, "state"))
+        return value.decode() if isinstance(value, bytes) else value
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        redis_key = self.key_builder.build(key, "data")
+        if not data:
+            await self._command("delete", redis_key)
+            return
+        await self._command(
+            "set", redis_key, self.json_dumps(dict(data)), ex=self.data_ttl
+        )
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        value = await self._command("get", self.key_builder.build(key, "data"))
+        if value is None:
+            return {}
+        return self.json_loads(value.decode() if isinstance(value, bytes) else value)
+
+    async def close(self) -> None:
+        await asyncio.gather(*self._sending, return_exceptions=True)
+        await super().close()
@@ -0,0 +1,140 @@
+import json
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from typing import Any, Callable, Mapping
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from sqlalchemy import case, delete, func, literal, select
+from sqlalchemy.dialects.postgresql import insert
+
+from database.base import async_session
+from database.models import FsmState
+from settings import settings
+
+compact_dumps = partial(json.dumps, separators=(",", ":"), ensure_ascii=False)
+
+
+def build_key(key: StorageKey) -> str:
+    """Компактный строковый ключ FSM"""
+    return (
+        f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:"
+        f"{key.business_connection_id or ''}:{key.destiny}"
+    )
+
+
+class PostgresStorage(BaseStorage):
+    """FSM-хранилище в PostgreSQL, общее для всех экземпляров бота
+
+    Состояние и данные хранятся в одной строке, каждая запись - один upsert,
+    update_data объединяет данные на сервере: один запрос на вызов.
+    """
+
+    def __init__(self, session_factory=async_session, ttl: int | None = None):
+        self.session_factory = session_factory
+        self.ttl = timedelta(seconds=ttl) if ttl else timedelta(days=3650)
+
+    def _expires_at(self) -> datetime:
+        return datetime.now(timezone.utc) + self.ttl
+
+    async def _upsert(self, key: StorageKey, values: dict, on_conflict: Callable):
+        live = FsmState.expires_at > func.now()
+        empty = literal({}, FsmState.data.type)
+        stmt = insert(FsmState).values(
+            key=build_key(key), expires_at=self._expires_at(), **values
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[FsmState.key],
+            set_={
+                "expires_at": stmt.excluded.expires_at,
+                "state": case((live, FsmState.state), else_=None),
+                "data": case((live, FsmState.data), else_=empty),
+                **on_conflict(stmt.excluded, live),
+            },
+        ).returning(FsmState.data)
+
+        async with self.session_factory() as session:
+            result = await session.execute(stmt)
+            await session.commit()
+            return result.scalar_one()
+
+    async def _select(self, column, key: StorageKey):
+        stmt = select(column).where(
+            FsmState.key == build_key(key), FsmState.expires_at > func.now()
+        )
+        async with self.session_factory() as session:
+            return (await session.execute(stmt)).scalar_one_or_none()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        await self._upsert(
+            key,
+            {"state": state, "data": {}},
+            lambda excluded, live: {"state": excluded.state},
+        )
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        return await self._select(FsmState.state, key)
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        await self._upsert(
+            key,
+            {"state": None, "data": dict(data)},
+            lambda excluded, live: {"data": excluded.data},
+        )
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        data = await self._select(FsmState.data, key)
+        return dict(data) if data else {}
+
+    async def update_data(
+        self, key: StorageKey, data: Mapping[str, Any]
+    ) -> dict[str, Any]:
+        merged = await self._upsert(
+            key,
+            {"state": None, "data": dict(data)},
+            lambda excluded, live: {
+                "data": case(
+                    (live, FsmState.data.op("||")(excluded.data)),
+                    else_=excluded.data,
+                )
+            },
+        )
+        return dict(merged)
+
+    async def purge_expired(self) -> None:
+        """Удалить просроченные записи"""
+        async with self.session_factory() as session:
+            await session.execute(
+                delete(FsmState).where(FsmState.expires_at <= func.now())
+            )
+            await session.commit()
+
+    async def close(self) -> None:
+        pass
+
+
+def create_storage() -> BaseStorage:
+    """Создать FSM-хранилище согласно настройкам"""
+    if settings.FSM_STORAGE == "postgres":
+        return PostgresStorage(ttl=settings.FSM_STATE_TTL)
+
+    if settings.FSM_STORAGE == "redis":
+        # redis is an optional dependency, only needed for this backend
+        try:
+            from database.redis_storage import PipelinedRedisStorage
+        except ImportError as error:
+            raise RuntimeError(
+                "FSM_STORAGE=redis needs the redis package: "
+                "install the project with its [redis] extra"
+            ) from error
+
+        return PipelinedRedisStorage.from_url(
+            settings.REDIS_URL,
+            state_ttl=settings.FSM_STATE_TTL,
+            data_ttl=settings.FSM_STATE_TTL,
+            json_dumps=compact_dumps,
+        )
+
+    return MemoryStorage()
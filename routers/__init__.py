@@ -2,3 +2,4 @@ from .start import router as start_router
 from .card import router as card_router
 from .user import router as user_router
 from .error import router as error_router
+from .search import router as search_router
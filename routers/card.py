@@ -1,42 +1,108 @@
-import requests
 import stripe
 from aiogram import F, Router
 from aiogram.fsm.context import FSMContext
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, Message
 
-from buttons.inline import create_inline_keyboard
-from buttons.keyboard import create_keyboard
+from buttons.inline import create_inline_keyboard, create_list_keyboard
+from buttons.static import CART_ACTIONS, LOCATION_KEYBOARD, UPDATE_CART_TEXT
 from classes.callback import (
     PageCallback,
     ProductCallback,
+    ReplicaPageCallback,
     ToCardCallback,
     UpdateCardCallback,
+    is_catalog_page,
+    pack_id,
+    page_codes,
+    unpack_id,
 )
 from classes.fsm import ToCard, ToOrder, UpdateCard
 from database.base import async_session
-from database.models import get_user
+from database.models import (
+    CachedUser,
+    claim_checkout_notification,
+    save_checkout_session,
+)
+from services.activity import activity
+from services.cart import carts
+from services.catalog import catalog, prefetcher
+from services.payments import (
+    PAYMENT_EXPIRED_TEXT,
+    PAYMENT_SUCCESS_TEXT,
+    payments,
+)
+from services.replica import replica
 from settings import settings
-from utils import request_delete, request_get, request_post
+from utils import request_delete, request_post
 
 router = Router()
 user_tokens = {}
 
+OUTDATED_BUTTON_TEXT = "❌ This button is outdated, send /products again"
+
+
+async def replica_keyboard(
+    position: int = -1, before: bool = False
+) -> InlineKeyboardMarkup:
+    """Product list keyboard of a catalog replica page"""
+    items, next, previous = await replica.page(position, before)
+    return create_list_keyboard(
+        items,
+        ProductCallback,
+        next=None if next is None else ReplicaPageCallback(position=next),
+        previous=(
+            None
+            if previous is None
+            else ReplicaPageCallback(position=previous, before=True)
+        ),
+    )
+
+
+async def show_backend_page(call, path: str):
+    """Show a product list page of the backend"""
+    response = await catalog.get(path)
+    await call.answer()
+
+    if response.status_code == 200:
+        data = response.json()
+        if prefetcher:
+            prefetcher.schedule(call.from_user.id, data)
+        button = create_list_keyboard(
+            data["results"],
+            ProductCallback,
+            next=data["next"],
+            previous=data["previous"],
+        )
+        await call.message.edit_text(
+            text="🛒 *Product List*:", reply_markup=button, parse_mode="Markdown"
+        )
+    elif response.status_code == 404:
+        await call.message.answer("❌ Page not found!")
+
 
 @router.message(F.text == "/products")
 async def products_handler(message: Message):
     """Show product list"""
-    response = requests.get(f"{settings.HOST}/api/v1/products/")
+    if replica and replica.usable():
+        activity.advance(message.from_user.id, "browsed")
+        await message.answer(
+            text="🛒 *Product List*:",
+            reply_markup=await replica_keyboard(),
+            parse_mode="Markdown",
+        )
+        return
+
+    response = await catalog.get("/api/v1/products/")
     if response.status_code == 200:
         data = response.json()
-        products = [
-            (
-                f"📦 {product['name'][:20]}",
-                ProductCallback(product_id=product["id"]).pack(),
-            )
-            for product in data["results"]
-        ]
-        button = create_inline_keyboard(
-            products, next=data["next"], previous=data["previous"]
+        activity.advance(message.from_user.id, "browsed")
+        if prefetcher:
+            prefetcher.schedule(message.from_user.id, data)
+        button = create_list_keyboard(
+            data["results"],
+            ProductCallback,
+            next=data["next"],
+            previous=data["previous"],
         )
         await message.answer(
             text="🛒 *Product List*:", reply_markup=button, parse_mode="Markdown"
@@ -48,38 +114,50 @@ async def products_handler(message: Message):
 @router.callback_query(PageCallback.filter())
 async def products_callback(call, callback_data: PageCallback):
     """Products pagination"""
-    link_page = callback_data.link_page
-    response = await request_get(f"{settings.HOST}{link_page}")
-    await call.answer()
+    link_page = await page_codes.resolve(callback_data.link_page)
+    if link_page is None or not is_catalog_page(link_page):
+        await call.answer("❌ This list is outdated, send /products again")
+        return
 
-    if response.status_code == 200:
-        data = response.json()
-        products = [
-            (
-                f"📦 {product['name'][:20]}",
-                ProductCallback(product_id=product["id"]).pack(),
-            )
-            for product in data["results"]
-        ]
-        button = create_inline_keyboard(
-            products, next=data["next"], previous=data["previous"]
-        )
+    await show_backend_page(call, link_page)
+
+
+@router.callback_query(ReplicaPageCallback.filter())
+async def replica_products_callback(call, callback_data: ReplicaPageCallback):
+    """Products pagination over the catalog replica"""
+    if replica and replica.usable():
+        button = await replica_keyboard(callback_data.position, callback_data.before)
+        await call.answer()
         await call.message.edit_text(
             text="🛒 *Product List*:", reply_markup=button, parse_mode="Markdown"
         )
-    elif response.status_code == 404:
-        await call.message.answer("❌ Page not found!")
+        return
+
+    # Continue from the backend page of the first product the button leads to
+    position = callback_data.position + (-1 if callback_data.before else 1)
+    path = replica and await replica.list_path(position)
+    await show_backend_page(call, path or "/api/v1/products/")
 
 
 @router.callback_query(ProductCallback.filter())
 async def product_detail(call, callback_data: ProductCallback):
     """Show product details"""
-    product_id = callback_data.product_id
-    response = await request_get(f"{settings.HOST}/api/v1/products/{product_id}")
+    product_id = unpack_id(callback_data.product_id)
+    if product_id is None:
+        await call.answer(OUTDATED_BUTTON_TEXT)
+        return
+
+    data = None
+    if replica and replica.usable():
+        data = await replica.product(product_id)
+    if data is None:
+        # Not synced yet, or the replica is stale
+        response = await catalog.get(f"/api/v1/products/{product_id}")
+        if response.status_code == 200:
+            data = response.json()
     await call.answer()
 
-    if response.status_code == 200:
-        data = response.json()
+    if data is not None:
         text = f"""
 📦 *{data['name']}*
 
@@ -93,7 +171,7 @@ async def product_detail(call, callback_data: ProductCallback):
 🖼 Image: {data['image'] or 'No image available'}
         """
         button = create_inline_keyboard(
-            [[("➕ Add to Cart", ToCardCallback(product_id=product_id).pack())]]
+            [[("➕ Add to Cart", ToCardCallback(product_id=pack_id(product_id)).pack())]]
         )
         await call.message.edit_text(text, parse_mode="Markdown", reply_markup=button)
     else:
@@ -103,14 +181,19 @@ async def product_detail(call, callback_data: ProductCallback):
 @router.callback_query(ToCardCallback.filter())
 async def find_quantity(call, callback_data: ToCardCallback, state: FSMContext):
     """Ask for quantity to add to cart"""
+    product_id = unpack_id(callback_data.product_id)
+    if product_id is None:
+        await call.answer(OUTDATED_BUTTON_TEXT)
+        return
+
     await call.answer()
     await call.message.answer("🔢 Please enter quantity:")
-    await state.set_data({"product_id": callback_data.product_id})
+    await state.set_data({"product_id": product_id})
     await state.set_state(ToCard.quantity)
 
 
 @router.message(ToCard.quantity)
-async def validate_quantity(message: Message, state: FSMContext):
+async def validate_quantity(message: Message, state: FSMContext, user: CachedUser):
     """Validate and add product to cart"""
     if message.text is None or not message.text.isdigit():
         await message.answer("❌ Please enter a valid number!")
@@ -127,14 +210,14 @@ async def validate_quantity(message: Message, state: FSMContext):
         return
 
     url = f"{settings.HOST}/api/v1/to_card/"
-    async with async_session() as session:
-        user = await get_user(session, message.from_user.id)
 
     data = await state.get_data()
     response = await request_post(url, auth_token=user.token, **data)
     res = response.json()
 
     if response.status_code == 200:
+        carts.invalidate(message.from_user.id)
+        activity.advance(message.from_user.id, "added_to_cart")
         await message.answer("✅ Product added to cart!")
         await state.clear()
     else:
@@ -148,19 +231,14 @@ async def validate_quantity(message: Message, state: FSMContext):
 
 
 @router.message(F.text == "/my_cart")
-async def users_card(message: Message):
+async def users_card(message: Message, user: CachedUser):
     """Show user's shopping cart"""
-    async with async_session() as session:
-        user = await get_user(session, message.from_user.id)
-
-    url = f"{settings.HOST}/api/v1/card/"
-    response = await request_get(url, auth_token=user.token)
+    data = await carts.get(message.from_user.id, user.token)
 
-    if response.status_code != 200:
+    if data is None:
         await message.answer("❌ Error loading cart")
         return
 
-    data = response.json()
     if not data["products"]:
         await message.answer("🛒 Your cart is empty!")
         return
@@ -172,44 +250,28 @@ async def users_card(message: Message):
     )
     total = f"\n\n💰 *Total: {round(data['total_price'], 2)}$*"
 
-    button = create_inline_keyboard(
-        [[("✏️ Update Cart", "update_card")], [("✅ Place Order", "to_order")]]
-    )
-
     await message.answer(
         f"🛒 *Your Cart:*\n{cart_items}{total}",
-        reply_markup=button,
+        reply_markup=CART_ACTIONS,
         parse_mode="Markdown",
     )
 
 
 @router.callback_query(F.data == "update_card")
-async def update_card(call):
+async def update_card(call, user: CachedUser):
     """Show cart items for updating"""
-    async with async_session() as session:
-        user = await get_user(session, call.from_user.id)
-
-    url = f"{settings.HOST}/api/v1/card/"
-    response = await request_get(url, auth_token=user.token)
+    data = await carts.get(call.from_user.id, user.token)
     await call.answer()
 
-    if response.status_code != 200:
+    if data is None:
         await call.message.answer("❌ Error loading cart")
         return
 
-    data = response.json()
     if not data["products"]:
         await call.message.edit_text("🛒 Your cart is empty!")
         return
 
-    buttons = [
-        (
-            f"📦 {product['name'][:20]}",
-            UpdateCardCallback(product_id=product["id"]).pack(),
-        )
-        for product in data["products"]
-    ]
-    button = create_inline_keyboard(buttons)
+    button = create_list_keyboard(data["products"], UpdateCardCallback)
 
     await call.message.edit_text("✏️ Select product to update:", reply_markup=button)
 
@@ -217,24 +279,20 @@ async def update_card(call):
 @router.callback_query(UpdateCardCallback.filter())
 async def update_card_next(call, callback_data: UpdateCardCallback, state: FSMContext):
     """Ask for new quantity or deletion"""
+    product_id = unpack_id(callback_data.product_id)
+    if product_id is None:
+        await call.answer(OUTDATED_BUTTON_TEXT)
+        return
+
     await call.answer()
-    instructions = """
-✏️ *Update Product:*
-Enter new quantity (number)
-Or type 'delete' to remove from cart
-Or type 'cancel' to cancel
-    """
-    await call.message.answer(instructions, parse_mode="Markdown")
-    await state.set_data({"card_product_id": callback_data.product_id})
+    await call.message.answer(UPDATE_CART_TEXT, parse_mode="Markdown")
+    await state.set_data({"card_product_id": product_id})
     await state.set_state(UpdateCard.count_or_delete)
 
 
 @router.message(UpdateCard.count_or_delete)
-async def count_or_delete(message: Message, state: FSMContext):
+async def count_or_delete(message: Message, state: FSMContext, user: CachedUser):
     """Process cart update"""
-    async with async_session() as session:
-        user = await get_user(session, message.from_user.id)
-
     data = await state.get_data()
     user_input = message.text.lower().strip()
 
@@ -247,6 +305,7 @@ async def count_or_delete(message: Message, state: FSMContext):
         url = f"{settings.HOST}/api/v1/remove_card/{data['card_product_id']}"
         response = await request_delete(url, auth_token=user.token)
         if response.status_code == 204:
+            carts.remove(message.from_user.id, data["card_product_id"])
             await message.answer("✅ Product removed from cart")
         else:
             await message.answer("❌ Error removing product")
@@ -258,6 +317,9 @@ async def count_or_delete(message: Message, state: FSMContext):
         url = f"{settings.HOST}/api/v1/update_card/"
         response = await request_post(url, auth_token=user.token, **data)
         if response.status_code == 200:
+            carts.set_quantity(
+                message.from_user.id, data["card_product_id"], data["quantity"]
+            )
             await message.answer("✅ Cart updated successfully")
         else:
             await message.answer(f"❌ {response.json().get('message', 'Update error')}")
@@ -273,28 +335,26 @@ async def count_or_delete(message: Message, state: FSMContext):
 async def to_order(call, state: FSMContext):
     """Start order process"""
     await call.answer()
-    button = create_keyboard([("📍 Send Location", "location")])
     await call.message.answer(
-        "📍 Please send your delivery location:", reply_markup=button
+        "📍 Please send your delivery location:", reply_markup=LOCATION_KEYBOARD
     )
     await state.set_state(ToOrder.location)
 
 
 @router.message(F.location)
-async def get_location(message: Message, state: FSMContext):
+async def get_location(message: Message, state: FSMContext, user: CachedUser):
     """Process location and create order"""
     locate = {
         "latitude": message.location.latitude,
         "longitude": message.location.longitude,
     }
 
-    async with async_session() as session:
-        user = await get_user(session, message.from_user.id)
-
     url = f"{settings.HOST}/api/v1/to_order/"
     response = await request_post(url, auth_token=user.token, **locate)
 
     if response.status_code == 200:
+        carts.invalidate(message.from_user.id)
+        activity.advance(message.from_user.id, "ordered")
         try:
             data = response.json()
         except Exception:
@@ -314,6 +374,10 @@ async def get_location(message: Message, state: FSMContext):
         )
 
         await state.update_data(session_id=data["session_id"], checkout_url=payment_url)
+        async with async_session() as session:
+            await save_checkout_session(
+                session, data["session_id"], message.from_user.id
+            )
 
         await message.answer(
             "✅ *Order Created!*\n\n"
@@ -339,27 +403,30 @@ async def check_payment(call, state: FSMContext):
         await call.message.answer("❌ No active order session found")
         return
 
-    stripe.api_key = settings.STRIPE_SECRET_KEY
-
     try:
-        session = stripe.checkout.Session.retrieve(session_id)
+        payment = await payments.get_status(session_id)
+        if payment.is_terminal:
+            # The Stripe webhook must not send the same result again
+            async with async_session() as session:
+                await claim_checkout_notification(session, session_id)
+
+        if payment.payment_status == "paid":
+            activity.advance(call.from_user.id, "paid")
+            await call.message.answer(PAYMENT_SUCCESS_TEXT)
+            await state.clear()
 
-        if session.payment_status == "paid":
-            await call.message.answer(
-                "✅ *Payment Successful!*\n\n"
-                "Your order has been confirmed and is being processed.\n"
-                "We'll contact you with delivery details soon."
-            )
+        elif payment.status == "expired":
+            await call.message.answer(PAYMENT_EXPIRED_TEXT)
             await state.clear()
 
-        elif session.payment_status == "unpaid":
+        elif payment.payment_status == "unpaid":
             await call.message.answer(
                 "❌ *Payment Not Completed*\n\n"
                 "Please complete the payment or try again."
             )
 
         else:
-            await call.message.answer(f"⏳ Payment status: {session.payment_status}")
+            await call.message.answer(f"⏳ Payment status: {payment.payment_status}")
 
     except stripe.error.StripeError as e:
         await call.message.answer(f"❌ Stripe error: {str(e)}")
@@ -1,19 +1,41 @@
+import asyncio
+import logging
+
+import aiohttp
 from aiogram import Router
 from aiogram.types import ErrorEvent
 
+from buttons.static import UNAVAILABLE_TEXT
+from services.metrics import errors_total
+from utils import BackendUnavailable
+
 router = Router()
+logger = logging.getLogger(__name__)
+
+# The backend is down or too slow: the user gets a "try again later"
+BACKEND_ERRORS = (BackendUnavailable, asyncio.TimeoutError, aiohttp.ClientError)
 
 
 @router.error()
 async def error_handler(event: ErrorEvent):
     error = event.exception
+    errors_total.inc(type(error).__name__)
 
-    print(f"⚠️ Error: {type(error).__name__}: {error}")
+    if isinstance(error, BACKEND_ERRORS):
+        # Expected while the backend is down, a traceback adds nothing
+        logger.warning("Update id=%s: %r", event.update.update_id, error)
+        text = UNAVAILABLE_TEXT
+    else:
+        logger.error(
+            "Error while handling update id=%s",
+            event.update.update_id,
+            exc_info=error,
+        )
+        text = "😕 An error occurred. Please try again."
 
-    if hasattr(event.update, 'message'):
-        await event.update.message.answer("😕 An error occurred. Please try again.")
-    elif hasattr(event.update, 'callback_query'):
-        await event.update.callback_query.message.answer("😕 An error occurred. "
-                                                         "Please try again.")
+    if event.update.message:
+        await event.update.message.answer(text)
+    elif event.update.callback_query:
+        await event.update.callback_query.message.answer(text)
 
     return True
@@ -0,0 +1,47 @@
+from html import escape
+
+from aiogram import Router
+from aiogram.types import (
+    InlineQuery,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
+)
+
+from services.search import SearchEntry, search
+
+router = Router()
+
+
+def product_article(entry: SearchEntry) -> InlineQueryResultArticle:
+    """Inline result that sends the product card to the chat"""
+    text = (
+        f"📦 <b>{escape(entry.name)}</b>\n\n"
+        f"💰 Price: {entry.price} USD\n"
+        f"🎯 Discount: {entry.discount_percent or 0}%\n"
+        f"📊 Stock: {entry.stock}\n"
+    )
+    if entry.description:
+        text += f"\n📝 {escape(entry.description[:1000])}"
+    image = entry.image if entry.image and entry.image.startswith("http") else None
+    return InlineQueryResultArticle(
+        id=str(entry.id),
+        title=entry.name,
+        description=f"{entry.price} USD · {entry.stock} in stock",
+        thumbnail_url=image,
+        input_message_content=InputTextMessageContent(
+            message_text=text, parse_mode="HTML"
+        ),
+    )
+
+
+@router.inline_query()
+async def search_products(query: InlineQuery):
+    """Answer @bot queries from the local search index"""
+    offset = int(query.offset) if query.offset.isdigit() else 0
+    entries, next_offset = search.search(query.query, offset)
+    await query.answer(
+        [product_article(entry) for entry in entries],
+        # Telegram must not keep the empty answers of an index being built
+        cache_time=0 if search.built_at is None else 60,
+        next_offset="" if next_offset is None else str(next_offset),
+    )
@@ -1,11 +1,15 @@
+import re
+
 from aiogram import F, Router
 from aiogram.types import Message
 
-from database.base import async_session
+from buttons.static import UNAVAILABLE_TEXT
+from database.base import autocommit_session
 from database.models import get_or_create_user, update_user_token
+from services.cart import carts
+from services.tokens import token_fields
 from settings import settings
-from utils import request_post
-import re
+from utils import BackendUnavailable, request_post
 
 router = Router()
 
@@ -50,7 +54,7 @@ async def register(message: Message):
             return
 
         user_id = message.from_user.id
-        async with async_session() as session:
+        async with autocommit_session() as session:
             await get_or_create_user(session, user_id)  # ← No duplicate errors
 
         url = f"{settings.HOST}/api/v1/register/"
@@ -59,6 +63,7 @@ async def register(message: Message):
         )
 
         if response.status_code == 201:
+            carts.invalidate(user_id)
             await message.answer(
                 "✅ Registration successful!\n\n"
                 "You can now login with:\n"
@@ -79,6 +84,8 @@ async def register(message: Message):
             else:
                 await message.answer("❌ Registration failed")
 
+    except BackendUnavailable:
+        await message.answer(UNAVAILABLE_TEXT)
     except Exception as e:
         error = str(e)
         if len(error) > 100:
@@ -107,13 +114,13 @@ async def login(message: Message):
         response = await request_post(url, identifier=identifier, password=password)
 
         if response.status_code == 200:
-            data = response.json()
-            access_token = data["access"]
+            fields = token_fields(response.json())
 
             user_id = message.from_user.id
-            async with async_session() as session:
-                await get_or_create_user(session, user_id)
-                await update_user_token(session, user_id, access_token, 50)
+            async with autocommit_session() as session:
+                await update_user_token(session, user_id, **fields)
+            # The cached cart belongs to the account the chat used before
+            carts.invalidate(user_id)
 
             await message.answer(
                 "✅ Login successful!\n\n"
@@ -132,6 +139,8 @@ async def login(message: Message):
             else:
                 await message.answer(f"❌ {error_msg}")
 
+    except BackendUnavailable:
+        await message.answer(UNAVAILABLE_TEXT)
     except Exception as e:
         error = str(e)
         if len(error) > 100:
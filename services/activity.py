@@ -0,0 +1,146 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+from time import perf_counter
+
+from database.base import autocommit_session
+from database.models import save_user_activity
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Funnel stages in order, stored as their position (1 = browsed)
+FUNNEL_STAGES = ("browsed", "added_to_cart", "ordered", "paid")
+TRACKED_COMMANDS = frozenset(
+    ("/start", "/register", "/login", "/products", "/my_cart")
+)
+
+
+class _Activity:
+    __slots__ = ("last_seen_at", "commands", "funnel_stage")
+
+    def __init__(self):
+        self.last_seen_at = datetime.now(timezone.utc)
+        self.commands: dict[str, int] = {}
+        self.funnel_stage = 0
+
+
+class ActivityTracker:
+    """Write-behind buffer of user activity
+
+    Updates only touch memory. A background task writes everything
+    collected since the previous flush as batched upserts every
+    `interval` seconds. The buffer holds at most `max_users` chats;
+    reaching that flushes early and activity of further chats is
+    dropped until the flush is done.
+    """
+
+    def __init__(self, interval: float, max_users: int, batch_size: int):
+        self.interval = interval
+        self.max_users = max_users
+        self.batch_size = batch_size
+        self._pending: dict[int, _Activity] = {}
+        self._task: asyncio.Task | None = None
+        self._flushing: asyncio.Task | None = None
+
+        self.dropped = 0
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.failed_rows = 0
+        self.last_batch_size = 0
+        self.flush_time_total = 0.0
+        self.flush_time_max = 0.0
+
+    def _entry(self, chat_id: int) -> _Activity | None:
+        entry = self._pending.get(chat_id)
+        if entry is not None:
+            return entry
+
+        if len(self._pending) >= self.max_users:
+            self.dropped += 1
+            self._flush_soon()
+            return None
+
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        entry = self._pending[chat_id] = _Activity()
+        return entry
+
+    def touch(self, chat_id: int, command: str | None = None) -> None:
+        """Record that the chat sent an update, optionally a command"""
+        entry = self._entry(chat_id)
+        if entry is None:
+            return
+        entry.last_seen_at = datetime.now(timezone.utc)
+        if command in TRACKED_COMMANDS:
+            entry.commands[command] = entry.commands.get(command, 0) + 1
+
+    def advance(self, chat_id: int, stage: str) -> None:
+        """Move the chat to a funnel stage; earlier stages never win"""
+        entry = self._entry(chat_id)
+        if entry is not None:
+            entry.funnel_stage = max(
+                entry.funnel_stage, FUNNEL_STAGES.index(stage) + 1
+            )
+
+    def _flush_soon(self) -> None:
+        if self._flushing is None or self._flushing.done():
+            self._flushing = asyncio.get_running_loop().create_task(self.flush())
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            self._flush_soon()
+            # Stopping the loop must not abort a flush that is writing
+            await asyncio.shield(self._flushing)
+
+    async def flush(self) -> None:
+        """Write buffered activity, one upsert per batch_size chats"""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        rows = [
+            {
+                "chat_id": chat_id,
+                "last_seen_at": entry.last_seen_at,
+                "commands": entry.commands,
+                "funnel_stage": entry.funnel_stage or None,
+            }
+            for chat_id, entry in pending.items()
+        ]
+
+        started = perf_counter()
+        for i in range(0, len(rows), self.batch_size):
+            batch = rows[i : i + self.batch_size]
+            try:
+                async with autocommit_session() as session:
+                    await save_user_activity(session, batch)
+            except Exception:
+                # Activity is best effort, a failed batch is not retried
+                logger.exception("Failed to save activity of %d users", len(batch))
+                self.failed_rows += len(batch)
+            else:
+                self.flushed_rows += len(batch)
+
+        elapsed = perf_counter() - started
+        self.flushes += 1
+        self.last_batch_size = len(rows)
+        self.flush_time_total += elapsed
+        self.flush_time_max = max(self.flush_time_max, elapsed)
+
+    async def close(self) -> None:
+        """Stop the flush loop and write what is left"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        if self._flushing is not None:
+            await self._flushing
+        self._task = self._flushing = None
+        await self.flush()
+
+
+activity = ActivityTracker(
+    interval=settings.ACTIVITY_FLUSH_INTERVAL,
+    max_users=settings.ACTIVITY_MAX_USERS,
+    batch_size=settings.ACTIVITY_BATCH_SIZE,
+)
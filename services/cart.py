@@ -0,0 +1,74 @@
+from classes.cache import TTLCache
+from settings import settings
+from utils import request_get
+
+
+class CartCache:
+    """Per-chat cart snapshots, patched in place by cart edits
+
+    A patch keeps the snapshot's expiry, so the backend is asked again at
+    least every `ttl` seconds. A snapshot the edit cannot be applied to is
+    dropped.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._carts = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    @property
+    def hits(self) -> int:
+        return self._carts.hits
+
+    @property
+    def misses(self) -> int:
+        return self._carts.misses
+
+    async def get(self, chat_id: int, token: str) -> dict | None:
+        """Cart of the chat, None if the backend could not load it"""
+        cart = self._carts.get(chat_id)
+        if cart is not None:
+            return cart
+
+        response = await request_get(f"{settings.HOST}/api/v1/card/", auth_token=token)
+        if response.status_code != 200:
+            return None
+
+        cart = response.json()
+        self._carts.set(chat_id, cart)
+        return cart
+
+    def invalidate(self, chat_id: int) -> None:
+        self._carts.pop(chat_id)
+
+    def set_quantity(self, chat_id: int, product_id: str, quantity: int) -> None:
+        cart = self._carts.get(chat_id)
+        product = self._find(cart, product_id)
+        if product is None or not product["quantity"]:
+            self.invalidate(chat_id)
+            return
+
+        total = product["total_price"] / product["quantity"] * quantity
+        cart["total_price"] += total - product["total_price"]
+        product["quantity"] = quantity
+        product["total_price"] = total
+
+    def remove(self, chat_id: int, product_id: str) -> None:
+        cart = self._carts.get(chat_id)
+        product = self._find(cart, product_id)
+        if product is None:
+            self.invalidate(chat_id)
+            return
+
+        cart["products"].remove(product)
+        cart["total_price"] -= product["total_price"]
+
+    @staticmethod
+    def _find(cart: dict | None, product_id: str) -> dict | None:
+        if cart is None:
+            return None
+        for product in cart["products"]:
+            if str(product["id"]) == str(product_id):
+                return product
+        return None
+
+
+carts = CartCache(maxsize=settings.CART_CACHE_SIZE, ttl=settings.CART_CACHE_TTL)
@@ -0,0 +1,274 @@
+import asyncio
+import logging
+import re
+import sys
+from collections import OrderedDict
+from functools import partial
+from time import monotonic
+
+from aiogram import BaseMiddleware
+
+from settings import settings
+from utils import Response, request_get
+
+logger = logging.getLogger(__name__)
+
+_MAX_AGE = re.compile(r"max-age=(\d+)")
+_ENTRY_OVERHEAD = 256
+
+
+def _parsed_size(value) -> int:
+    """Approximate memory held by a parsed JSON value"""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for key, item in value.items():
+            size += sys.getsizeof(key) + _parsed_size(item)
+    elif isinstance(value, list):
+        for item in value:
+            size += _parsed_size(item)
+    return size
+
+
+def _response_size(response: Response) -> int:
+    # Callers parse cached responses and the parsed JSON stays memoized on
+    # them, so it is counted together with the raw bytes
+    try:
+        parsed = _parsed_size(response.json())
+    except ValueError:
+        parsed = 0
+    return len(response.content) + parsed + _ENTRY_OVERHEAD
+
+
+class CatalogEntry:
+    """Cached catalog response with its revalidation data"""
+
+    __slots__ = (
+        "response",
+        "etag",
+        "last_modified",
+        "fresh_until",
+        "size",
+        "prefetched",
+    )
+
+    def __init__(self, response: Response, ttl: float, prefetched: bool = False):
+        self.response = response
+        self.prefetched = prefetched
+        self.etag = response.headers.get("ETag")
+        self.last_modified = response.headers.get("Last-Modified")
+        self.fresh_until = monotonic() + ttl
+        self.size = _response_size(response)
+
+    @property
+    def validators(self) -> dict:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class CatalogCache:
+    """Stale-while-revalidate cache for catalog GETs, keyed by request path"""
+
+    def __init__(self, ttl: float, stale_ttl: float, max_bytes: int):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_bytes = max_bytes
+        self.size = 0
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.prefetched = 0
+        self.prefetch_hits = 0
+
+        self._entries: OrderedDict[str, CatalogEntry] = OrderedDict()
+        self._pending: dict[str, asyncio.Task] = {}
+
+    async def get(self, path: str) -> Response:
+        entry = self._entries.get(path)
+        if entry is None:
+            self.misses += 1
+            return await asyncio.shield(self._refresh(path))
+
+        self._entries.move_to_end(path)
+        if entry.prefetched:
+            entry.prefetched = False
+            self.prefetch_hits += 1
+
+        age = monotonic() - entry.fresh_until
+        if age <= 0:
+            self.hits += 1
+            return entry.response
+
+        if age > self.stale_ttl:
+            self.misses += 1
+            return await asyncio.shield(self._refresh(path))
+
+        self.stale_hits += 1
+        self._refresh(path)
+        return entry.response
+
+    @property
+    def prefetch_hit_rate(self) -> float:
+        """Share of prefetched entries that were opened afterwards"""
+        return self.prefetch_hits / self.prefetched if self.prefetched else 0.0
+
+    def is_fresh(self, path: str) -> bool:
+        entry = self._entries.get(path)
+        return entry is not None and entry.fresh_until > monotonic()
+
+    async def prefetch(self, path: str) -> None:
+        """Warm the cache for a path the user is likely to open next"""
+        if path in self._pending or self.is_fresh(path):
+            return
+        await asyncio.shield(self._refresh(path, prefetch=True))
+
+    def _refresh(self, path: str, prefetch: bool = False) -> asyncio.Task:
+        task = self._pending.get(path)
+        if task is None:
+            task = asyncio.create_task(self._fetch(path, prefetch))
+            self._pending[path] = task
+            task.add_done_callback(partial(self._done, path))
+        return task
+
+    def _done(self, path: str, task: asyncio.Task) -> None:
+        if self._pending.get(path) is task:
+            del self._pending[path]
+        if not task.cancelled():
+            task.exception()
+
+    async def _fetch(self, path: str, prefetch: bool = False) -> Response:
+        entry = self._entries.get(path)
+        headers = entry.validators if entry else None
+
+        try:
+            response = await request_get(f"{settings.HOST}{path}", headers=headers)
+        except Exception:
+            if entry is None:
+                raise
+            return entry.response
+
+        if response.status_code == 304 and entry is not None:
+            self.revalidated += 1
+            entry.fresh_until = monotonic() + self._ttl_for(response)
+            return entry.response
+
+        if response.status_code == 200:
+            ttl = self._ttl_for(response)
+            self._store(path, CatalogEntry(response, ttl, prefetched=prefetch))
+            self.prefetched += prefetch
+        elif entry is not None and response.status_code >= 500:
+            return entry.response
+        else:
+            self._discard(path)
+
+        return response
+
+    def _ttl_for(self, response: Response) -> float:
+        match = _MAX_AGE.search(response.headers.get("Cache-Control", ""))
+        return int(match.group(1)) if match else self.ttl
+
+    def _store(self, path: str, entry: CatalogEntry) -> None:
+        self._discard(path)
+        if entry.size > self.max_bytes:
+            return
+
+        self._entries[path] = entry
+        self.size += entry.size
+        while self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= evicted.size
+
+    def _discard(self, path: str) -> None:
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            self.size -= entry.size
+
+    async def close(self) -> None:
+        """Cancel background refreshes"""
+        tasks = list(self._pending.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class Prefetcher:
+    """Background warm-up of the next page and top products of a list page"""
+
+    def __init__(self, cache: CatalogCache, top_n: int, concurrency: int):
+        self.cache = cache
+        self.top_n = top_n
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tasks: dict[int, set[asyncio.Task]] = {}
+
+    def schedule(self, chat_id: int, page: dict) -> None:
+        self.cancel(chat_id)
+
+        paths = [
+            f"/api/v1/products/{product['id']}"
+            for product in page["results"][: self.top_n]
+        ]
+        if page.get("next"):
+            paths.insert(0, page["next"].replace(settings.HOST, ""))
+
+        tasks = self._tasks[chat_id] = set()
+        for path in paths:
+            task = asyncio.create_task(self._prefetch(path))
+            tasks.add(task)
+            task.add_done_callback(partial(self._done, chat_id))
+
+    async def _prefetch(self, path: str) -> None:
+        async with self._semaphore:
+            try:
+                await self.cache.prefetch(path)
+            except Exception:
+                logger.debug("Prefetch of %s failed", path, exc_info=True)
+
+    def _done(self, chat_id: int, task: asyncio.Task) -> None:
+        tasks = self._tasks.get(chat_id)
+        if tasks is not None:
+            tasks.discard(task)
+            if not tasks:
+                del self._tasks[chat_id]
+
+    def cancel(self, chat_id: int) -> None:
+        """Drop queued prefetches of a chat that left the product list"""
+        for task in self._tasks.pop(chat_id, ()):
+            task.cancel()
+
+    async def close(self) -> None:
+        for chat_id in list(self._tasks):
+            self.cancel(chat_id)
+
+
+class PrefetchMiddleware(BaseMiddleware):
+    """Cancel a chat's prefetches as soon as it sends anything new"""
+
+    def __init__(self, prefetcher: Prefetcher):
+        self.prefetcher = prefetcher
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is not None:
+            self.prefetcher.cancel(user.id)
+        return await handler(event, data)
+
+
+catalog = CatalogCache(
+    ttl=settings.CATALOG_CACHE_TTL,
+    stale_ttl=settings.CATALOG_CACHE_STALE_TTL,
+    max_bytes=settings.CATALOG_CACHE_MAX_BYTES,
+)
+prefetcher = (
+    Prefetcher(
+        catalog,
+        top_n=settings.CATALOG_PREFETCH_TOP_N,
+        concurrency=settings.CATALOG_PREFETCH_CONCURRENCY,
+    )
+    if settings.CATALOG_PREFETCH
+    else None
+)
@@ -0,0 +1,229 @@
+from time import perf_counter
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiohttp import web
+
+from classes.metrics import Counter, Gauge, Histogram, registry
+from database.base import pool_stats
+from database.models import user_cache
+from services.activity import activity
+from services.cart import carts
+from services.catalog import catalog
+from services.replica import replica
+from services.search import search
+from services.sender import SendScheduler
+
+update_seconds = Histogram(
+    "bot_update_seconds",
+    "Time to process an update, middlewares included",
+    labels=("update_type",),
+)
+updates_total = Counter(
+    "bot_updates_total",
+    "Processed updates by type and outcome",
+    labels=("update_type", "outcome"),
+)
+handler_seconds = Histogram(
+    "bot_handler_seconds",
+    "Handler latency",
+    labels=("router", "handler"),
+)
+errors_total = Counter(
+    "bot_errors_total",
+    "Exceptions that reached the error router",
+    labels=("exception",),
+)
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Count updates and time them; register before other update middlewares"""
+
+    async def __call__(self, handler, event, data):
+        update_type = event.event_type
+        started = perf_counter()
+        outcome = "error"
+        try:
+            result = await handler(event, data)
+            outcome = "unhandled" if result is UNHANDLED else "handled"
+            return result
+        finally:
+            update_seconds.observe(perf_counter() - started, update_type)
+            updates_total.inc(update_type, outcome)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Time the handler that processes the event"""
+
+    async def __call__(self, handler, event, data):
+        callback = data["handler"].callback
+        started = perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            handler_seconds.observe(
+                perf_counter() - started, callback.__module__, callback.__name__
+            )
+
+
+def instrument_handlers(dp: Dispatcher) -> None:
+    """Time every handler of dp and its routers; call after including routers"""
+    middleware = HandlerMetricsMiddleware()
+    for router in dp.chain_tail:
+        for name, observer in router.observers.items():
+            if name != "update":
+                observer.middleware(middleware)
+
+
+_senders: list[SendScheduler] = []
+
+
+def instrument_sender(scheduler: SendScheduler) -> None:
+    """Export the send scheduler's counters, summed over the process's bots"""
+    _senders.append(scheduler)
+
+
+Counter(
+    "bot_sent_messages_total",
+    "Chat methods sent through the rate limiter",
+    collect=lambda: sum(scheduler.sent for scheduler in _senders),
+)
+Counter(
+    "bot_send_retries_total",
+    "Requests retried after a flood wait",
+    collect=lambda: sum(scheduler.retries for scheduler in _senders),
+)
+Counter(
+    "bot_send_global_pauses_total",
+    "Flood waits that paused every chat",
+    collect=lambda: sum(scheduler.global_pauses for scheduler in _senders),
+)
+Counter(
+    "bot_send_wait_seconds_total",
+    "Time spent waiting for send slots",
+    collect=lambda: sum(scheduler.wait_total for scheduler in _senders),
+)
+
+Counter(
+    "bot_cache_hits_total",
+    "In-process cache hits",
+    labels=("cache",),
+    collect=lambda: {
+        ("catalog",): catalog.hits,
+        ("catalog_stale",): catalog.stale_hits,
+        ("cart",): carts.hits,
+        ("auth",): user_cache.hits,
+    },
+)
+Counter(
+    "bot_cache_misses_total",
+    "In-process cache misses",
+    labels=("cache",),
+    collect=lambda: {
+        ("catalog",): catalog.misses,
+        ("cart",): carts.misses,
+        ("auth",): user_cache.misses,
+    },
+)
+Counter(
+    "bot_catalog_revalidated_total",
+    "Catalog entries confirmed by a 304",
+    collect=lambda: catalog.revalidated,
+)
+Counter(
+    "bot_catalog_prefetched_total",
+    "Catalog pages and products prefetched",
+    collect=lambda: catalog.prefetched,
+)
+Counter(
+    "bot_catalog_prefetch_hits_total",
+    "Prefetched catalog entries that were used",
+    collect=lambda: catalog.prefetch_hits,
+)
+
+
+def _pool_connections() -> dict:
+    stats = pool_stats()
+    return {(state,): stats[state] for state in ("checked_out", "idle", "overflow")}
+
+
+Gauge(
+    "bot_db_pool_connections",
+    "Database pool connections by state",
+    labels=("state",),
+    collect=_pool_connections,
+)
+Gauge(
+    "bot_db_pool_overflow_max",
+    "Highest pool overflow seen",
+    collect=lambda: pool_stats()["overflow_max"],
+)
+Counter(
+    "bot_db_pool_checkouts_total",
+    "Connection checkouts",
+    collect=lambda: pool_stats()["checkouts"],
+)
+Counter(
+    "bot_db_pool_checkout_timeouts_total",
+    "Checkouts that timed out waiting for a connection",
+    collect=lambda: pool_stats()["checkout_timeouts"],
+)
+Gauge(
+    "bot_db_pool_checkout_wait_max_seconds",
+    "Longest wait for a pooled connection",
+    collect=lambda: pool_stats()["checkout_wait_max"],
+)
+
+Counter(
+    "bot_activity_rows_total",
+    "User activity rows by flush result",
+    labels=("result",),
+    collect=lambda: {
+        ("flushed",): activity.flushed_rows,
+        ("failed",): activity.failed_rows,
+        ("dropped",): activity.dropped,
+    },
+)
+Counter(
+    "bot_activity_flush_seconds_total",
+    "Time spent flushing user activity",
+    collect=lambda: activity.flush_time_total,
+)
+Counter(
+    "bot_activity_flushes_total",
+    "User activity flushes",
+    collect=lambda: activity.flushes,
+)
+Gauge(
+    "bot_activity_last_batch_size",
+    "Users written by the last activity flush",
+    collect=lambda: activity.last_batch_size,
+)
+
+if replica:
+    Gauge(
+        "bot_catalog_replica_rows",
+        "Products in the catalog replica",
+        collect=lambda: replica.rows,
+    )
+    Gauge(
+        "bot_catalog_replica_lag_seconds",
+        "Time since the catalog replica was synced, -1 before the first sync",
+        collect=lambda: -1 if replica.lag is None else replica.lag,
+    )
+
+if search:
+    Gauge(
+        "bot_search_products",
+        "Products in the inline search index",
+        collect=lambda: len(search.index),
+    )
+    Gauge(
+        "bot_search_index_age_seconds",
+        "Time since the search index was built, -1 before the first build",
+        collect=lambda: -1 if search.age is None else search.age,
+    )
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(text=registry.render(), content_type="text/plain")
@@ -0,0 +1,190 @@
+import asyncio
+import logging
+from time import perf_counter
+from typing import NamedTuple
+
+import stripe
+from aiogram import Bot, Dispatcher
+from aiohttp import web
+
+from classes.cache import TTLCache
+from classes.metrics import Histogram
+from database.base import async_session
+from database.models import claim_checkout_notification
+from services.activity import activity
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+stripe_seconds = Histogram(
+    "bot_stripe_request_seconds",
+    "Stripe API call latency",
+    labels=("operation", "outcome"),
+)
+
+PAYMENT_SUCCESS_TEXT = (
+    "✅ *Payment Successful!*\n\n"
+    "Your order has been confirmed and is being processed.\n"
+    "We'll contact you with delivery details soon."
+)
+PAYMENT_EXPIRED_TEXT = (
+    "⌛ *Payment Session Expired*\n\nPlease place the order again from /my_cart."
+)
+
+
+class PaymentStatus(NamedTuple):
+    status: str
+    payment_status: str
+
+    @property
+    def is_terminal(self) -> bool:
+        return self.status == "expired" or self.payment_status in (
+            "paid",
+            "no_payment_required",
+        )
+
+
+class PaymentChecker:
+    """Non-blocking Stripe Checkout status lookups
+
+    Concurrent checks of one session share a single request, terminal
+    statuses are kept for a long time and others for a few seconds.
+    """
+
+    def __init__(self, terminal_ttl: float, pending_ttl: float):
+        self.pending_ttl = pending_ttl
+        self._statuses = TTLCache(maxsize=100_000, ttl=terminal_ttl)
+        self._inflight: dict[str, asyncio.Task] = {}
+        self._http_client = None
+        self._client = None
+
+        self.requests = 0
+
+    @property
+    def client(self) -> stripe.StripeClient:
+        if self._client is None:
+            self._http_client = stripe.AIOHTTPClient()
+            base_addresses = {}
+            if settings.STRIPE_API_BASE:
+                base_addresses["api"] = settings.STRIPE_API_BASE
+            self._client = stripe.StripeClient(
+                settings.STRIPE_SECRET_KEY,
+                http_client=self._http_client,
+                base_addresses=base_addresses,
+            )
+        return self._client
+
+    async def get_status(self, session_id: str) -> PaymentStatus:
+        status = self._statuses.get(session_id)
+        if status is not None:
+            return status
+
+        task = self._inflight.get(session_id)
+        if task is None:
+            task = asyncio.create_task(self._retrieve(session_id))
+            self._inflight[session_id] = task
+            task.add_done_callback(lambda _: self._inflight.pop(session_id, None))
+        return await asyncio.shield(task)
+
+    async def _retrieve(self, session_id: str) -> PaymentStatus:
+        self.requests += 1
+        started = perf_counter()
+        outcome = "error"
+        try:
+            session = await self.client.v1.checkout.sessions.retrieve_async(session_id)
+            outcome = "ok"
+        finally:
+            stripe_seconds.observe(
+                perf_counter() - started, "checkout.sessions.retrieve", outcome
+            )
+        status = PaymentStatus(session.status, session.payment_status)
+        self.remember(session_id, status)
+        return status
+
+    def remember(self, session_id: str, status: PaymentStatus) -> None:
+        ttl = None if status.is_terminal else self.pending_ttl
+        self._statuses.set(session_id, status, ttl=ttl)
+
+    async def close(self) -> None:
+        if self._http_client is not None:
+            await self._http_client.close_async()
+
+
+class StripeWebhook:
+    """Receive Stripe Checkout events and notify the user proactively"""
+
+    EVENTS = (
+        "checkout.session.completed",
+        "checkout.session.async_payment_succeeded",
+        "checkout.session.expired",
+    )
+
+    def __init__(self, secret: str):
+        self.secret = secret
+        self.dp: Dispatcher | None = None
+        self.bot: Bot | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    def bind(self, dp: Dispatcher, bot: Bot) -> None:
+        """Notify users through this dispatcher's storage and bot"""
+        self.dp = dp
+        self.bot = bot
+
+    async def handle(self, request: web.Request) -> web.Response:
+        payload = await request.read()
+        try:
+            event = stripe.Webhook.construct_event(
+                payload, request.headers.get("Stripe-Signature", ""), self.secret
+            )
+        except (ValueError, stripe.SignatureVerificationError):
+            return web.Response(status=400)
+
+        if event.type in self.EVENTS:
+            task = asyncio.create_task(self._notify(event.data.object))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _notify(self, checkout) -> None:
+        payment = PaymentStatus(checkout.status, checkout.payment_status)
+        payments.remember(checkout.id, payment)
+
+        if payment.payment_status == "paid":
+            text = PAYMENT_SUCCESS_TEXT
+        elif payment.status == "expired":
+            text = PAYMENT_EXPIRED_TEXT
+        else:
+            return
+
+        # The row, not the FSM data, tells whether the user already got the
+        # result: with WORKERS>1 this process does not share a memory storage
+        async with async_session() as session:
+            chat_id = await claim_checkout_notification(session, checkout.id)
+        if chat_id is None:
+            logger.info("Checkout session %s is unknown or notified", checkout.id)
+            return
+        if payment.payment_status == "paid":
+            activity.advance(chat_id, "paid")
+
+        try:
+            await self.bot.send_message(chat_id, text)
+            state = self.dp.fsm.get_context(self.bot, chat_id=chat_id, user_id=chat_id)
+            if (await state.get_data()).get("session_id") == checkout.id:
+                await state.clear()
+        except Exception:
+            logger.exception("Failed to notify chat %s about payment", chat_id)
+
+    async def close(self) -> None:
+        """Wait for notifications of events already received"""
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+payments = PaymentChecker(
+    terminal_ttl=settings.STRIPE_TERMINAL_TTL,
+    pending_ttl=settings.STRIPE_PENDING_TTL,
+)
+stripe_webhook = (
+    StripeWebhook(settings.STRIPE_WEBHOOK_SECRET)
+    if settings.STRIPE_WEBHOOK_SECRET
+    else None
+)
@@ -0,0 +1,157 @@
+import asyncio
+import gzip
+import json
+import logging
+import os
+import time
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+
+from aiogram import BaseMiddleware
+
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Credentials in these commands are replaced by placeholders that still
+# pass the handlers' validation, so recordings replay the same code paths
+SCRUBBED_COMMANDS = {
+    "/login": "/login redacted@example.com ********",
+    "/register": "/register redacted@example.com ******** ********",
+}
+
+
+def scrub(update: dict) -> dict:
+    """Replace secrets in a raw update, in place"""
+    for key in ("message", "edited_message"):
+        message = update.get(key)
+        if not message or not message.get("text"):
+            continue
+        command = message["text"].split(maxsplit=1)[0].split("@")[0]
+        placeholder = SCRUBBED_COMMANDS.get(command)
+        if placeholder is not None:
+            message["text"] = placeholder
+            message.pop("entities", None)
+    return update
+
+
+class RotatingWriter:
+    """gzip-compressed JSONL files, rotated by size, oldest deleted"""
+
+    def __init__(self, directory: str, max_bytes: int, keep_files: int):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.keep_files = keep_files
+        self._file = None
+        self._written = 0
+
+    def _open(self) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        # The pid keeps files of worker processes apart
+        path = self.directory / f"updates-{stamp}-{os.getpid()}.jsonl.gz"
+        self._file = gzip.open(path, "wt", encoding="utf-8")
+        self._written = 0
+
+        files = sorted(self.directory.glob("updates-*.jsonl.gz"))
+        for old in files[: max(len(files) - self.keep_files, 0)]:
+            old.unlink(missing_ok=True)
+
+    def write(self, lines: list[str]) -> None:
+        for line in lines:
+            if self._file is None or self._written >= self.max_bytes:
+                self.close()
+                self._open()
+            self._file.write(line)
+            self._written += len(line)
+        self._file.flush()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class UpdateRecorder(BaseMiddleware):
+    """Record incoming updates with their arrival time for later replay
+
+    The middleware only serializes the update into a bounded buffer; a
+    background task compresses and writes the buffer in a thread.
+    Updates that arrive while the buffer is full are counted as dropped.
+    """
+
+    def __init__(self, writer: RotatingWriter, interval: float, buffer_size: int):
+        self.writer = writer
+        self.interval = interval
+        self.buffer_size = buffer_size
+        self._buffer: deque[str] = deque()
+        self._task: asyncio.Task | None = None
+        self._flushing: asyncio.Task | None = None
+
+        self.recorded = 0
+        self.dropped = 0
+
+    async def __call__(self, handler, event, data):
+        if len(self._buffer) < self.buffer_size:
+            update = scrub(event.model_dump(mode="json", exclude_none=True))
+            record = {"t": time.time(), "update": update}
+            self._buffer.append(json.dumps(record, ensure_ascii=False) + "\n")
+            if self._task is None:
+                self._task = asyncio.create_task(self._run())
+        else:
+            self.dropped += 1
+        return await handler(event, data)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            self._flushing = asyncio.create_task(self.flush())
+            # Stopping the loop must not abort a write in progress
+            await asyncio.shield(self._flushing)
+
+    async def flush(self) -> None:
+        if not self._buffer:
+            return
+        lines = list(self._buffer)
+        self._buffer.clear()
+        try:
+            await asyncio.to_thread(self.writer.write, lines)
+        except Exception:
+            logger.exception("Failed to write %d recorded updates", len(lines))
+        else:
+            self.recorded += len(lines)
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._flushing is not None:
+            await self._flushing
+            self._flushing = None
+        await self.flush()
+        await asyncio.to_thread(self.writer.close)
+
+
+def read_recording(path: str):
+    """Yield (arrival time, raw update) from a recorded file"""
+    with gzip.open(path, "rt", encoding="utf-8") as file:
+        try:
+            for line in file:
+                record = json.loads(line)
+                yield record["t"], record["update"]
+        except (EOFError, json.JSONDecodeError):
+            # The file of a process that was killed ends mid-record
+            logger.warning("%s is truncated, replaying what was read", path)
+
+
+recorder = None
+if settings.RECORD_UPDATES:
+    recorder = UpdateRecorder(
+        RotatingWriter(
+            settings.RECORD_DIR, settings.RECORD_MAX_BYTES, settings.RECORD_KEEP_FILES
+        ),
+        interval=settings.RECORD_FLUSH_INTERVAL,
+        buffer_size=settings.RECORD_BUFFER_SIZE,
+    )
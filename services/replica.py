@@ -0,0 +1,270 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+
+from classes.metrics import Counter
+from database.base import async_session, autocommit_session
+from database.models import (
+    Product,
+    get_product,
+    get_product_list_path,
+    get_product_listings,
+    get_products,
+    get_products_page,
+    get_sync_state,
+    save_products,
+)
+from settings import settings
+from utils import request_get
+
+logger = logging.getLogger(__name__)
+
+replica_syncs = Counter(
+    "bot_catalog_replica_syncs_total",
+    "Catalog replica syncs by result",
+    labels=("result",),
+)
+replica_changes = Counter(
+    "bot_catalog_replica_changes_total",
+    "Products written by replica syncs, by change",
+    labels=("change",),
+)
+replica_bypassed = Counter(
+    "bot_catalog_replica_bypassed_total",
+    "Catalog reads sent to the backend because the replica was stale",
+)
+
+# Fields a product needs; fetched from the detail endpoint when the list
+# endpoint does not return them
+DETAIL_FIELDS = ("price", "discount_percent", "stock", "description")
+
+
+async def list_pages():
+    """Walk /api/v1/products/, yielding (path, items) of every page"""
+    path = "/api/v1/products/"
+    while path:
+        response = await request_get(f"{settings.HOST}{path}")
+        if response.status_code != 200:
+            raise RuntimeError(f"{path} answered {response.status_code}")
+        page = response.json()
+        yield path, page["results"]
+        path = (page.get("next") or "").replace(settings.HOST, "")
+
+
+class CatalogReplica:
+    """Copy of the catalog in Postgres, browsed without the backend
+
+    The syncing process walks /api/v1/products/ every `interval` seconds
+    and writes only what changed: new and changed products with their
+    details (at most `concurrency` detail requests at a time, unchanged
+    ones again after `detail_ttl`), positions of products that moved and
+    products that are gone. Other processes read the sync state at the
+    same interval. A replica synced more than `max_lag` seconds ago is
+    stale and handlers go to the backend instead.
+    """
+
+    def __init__(
+        self,
+        interval: float,
+        max_lag: float,
+        detail_ttl: float,
+        concurrency: int,
+        page_size: int,
+    ):
+        self.interval = interval
+        self.max_lag = max_lag
+        self.detail_ttl = detail_ttl
+        self.page_size = page_size
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._task: asyncio.Task | None = None
+        self.synced_at: datetime | None = None
+        self.rows = 0
+
+    def start(self, sync: bool) -> None:
+        """Sync the replica in this process, or only follow its state"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(sync))
+
+    async def _run(self, sync: bool) -> None:
+        while True:
+            try:
+                if sync:
+                    await self.sync()
+                else:
+                    await self.load_state()
+            except Exception:
+                if sync:
+                    replica_syncs.inc("failed")
+                logger.exception(
+                    "Catalog replica %s failed", "sync" if sync else "check"
+                )
+            await asyncio.sleep(self.interval)
+
+    @property
+    def lag(self) -> float | None:
+        """Seconds since the last sync, None if there was none"""
+        if self.synced_at is None:
+            return None
+        return (datetime.now(timezone.utc) - self.synced_at).total_seconds()
+
+    @property
+    def fresh(self) -> bool:
+        lag = self.lag
+        return lag is not None and lag < self.max_lag
+
+    def usable(self) -> bool:
+        """Whether reads can go to the replica; counts the ones that cannot"""
+        if self.fresh:
+            return True
+        replica_bypassed.inc()
+        return False
+
+    async def load_state(self) -> None:
+        async with autocommit_session() as session:
+            state = await get_sync_state(session, "products")
+        if state is not None:
+            self.synced_at, self.rows = state.synced_at, state.rows
+
+    async def _detail(self, item: dict) -> dict | None:
+        if all(field in item for field in DETAIL_FIELDS):
+            return item
+        async with self._semaphore:
+            response = await request_get(
+                f"{settings.HOST}/api/v1/products/{item['id']}"
+            )
+        if response.status_code != 200:
+            logger.warning(
+                "Product %s answered %s during sync", item["id"], response.status_code
+            )
+            return None
+        return response.json()
+
+    async def sync(self) -> None:
+        started = datetime.now(timezone.utc)
+        async with autocommit_session() as session:
+            known = await get_product_listings(session)
+
+        changed, moved, seen = [], [], set()
+        position = 0
+        async for path, items in list_pages():
+            for item in items:
+                product_id = str(item["id"])
+                # A product can move to the next page while the walk is on it
+                if product_id in seen:
+                    continue
+                seen.add(product_id)
+                row = known.pop(product_id, None)
+                if (
+                    row is None
+                    or row[1] != item
+                    or (started - row[3]).total_seconds() >= self.detail_ttl
+                ):
+                    changed.append((product_id, position, path, item, row))
+                elif row[0] != position or row[2] != path:
+                    moved.append(
+                        {"id": product_id, "position": position, "list_path": path}
+                    )
+                position += 1
+
+        details = await asyncio.gather(
+            *(self._detail(item) for _, _, _, item, _ in changed)
+        )
+        rows = []
+        for (product_id, position, path, item, row), data in zip(changed, details):
+            if data is not None:
+                rows.append(
+                    {
+                        "id": product_id,
+                        "position": position,
+                        "name": item["name"],
+                        "listing": item,
+                        "data": data,
+                        "list_path": path,
+                        "synced_at": started,
+                    }
+                )
+            elif row is not None:
+                # Keep the old details, the next sync fetches them again
+                moved.append(
+                    {"id": product_id, "position": position, "list_path": path}
+                )
+
+        if not seen and known:
+            # An empty list is far likelier a backend fault than an empty shop
+            raise RuntimeError(
+                f"/api/v1/products/ listed nothing, keeping {len(known)} products"
+            )
+
+        removed = list(known)
+        async with async_session() as session:
+            self.rows = await save_products(session, rows, moved, removed, started)
+        self.synced_at = started
+        replica_changes.inc("saved", amount=len(rows))
+        replica_changes.inc("moved", amount=len(moved))
+        replica_changes.inc("removed", amount=len(removed))
+        replica_syncs.inc("ok")
+
+    async def page(
+        self, position: int = -1, before: bool = False
+    ) -> tuple[list[dict], int | None, int | None]:
+        """List items of a page, and positions for its next and previous buttons
+
+        A page starts after `position`, or ends before it with `before`.
+        """
+        async with autocommit_session() as session:
+            rows = await get_products_page(
+                session, position, before, self.page_size + 1
+            )
+            if (before and len(rows) <= self.page_size) or (not rows and position >= 0):
+                # Back at the start of the list, or past its end after removals
+                position, before = -1, False
+                rows = await get_products_page(
+                    session, position, before, self.page_size + 1
+                )
+
+        more = len(rows) > self.page_size
+        if before:
+            rows = rows[1:] if more else rows
+            has_previous, has_next = more, True
+        else:
+            rows = rows[: self.page_size]
+            has_previous, has_next = position >= 0, more
+        if not rows:
+            return [], None, None
+        return (
+            [listing for _, listing in rows],
+            rows[-1][0] if has_next else None,
+            rows[0][0] if has_previous else None,
+        )
+
+    async def product(self, product_id: str) -> dict | None:
+        async with autocommit_session() as session:
+            return await get_product(session, product_id)
+
+    async def list_path(self, position: int) -> str | None:
+        """Backend list page the product at `position` was on"""
+        async with autocommit_session() as session:
+            return await get_product_list_path(session, position)
+
+    async def products(self) -> list[Product]:
+        async with autocommit_session() as session:
+            return await get_products(session)
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+replica = (
+    CatalogReplica(
+        interval=settings.CATALOG_REPLICA_SYNC_INTERVAL,
+        max_lag=settings.CATALOG_REPLICA_MAX_LAG,
+        detail_ttl=settings.CATALOG_REPLICA_DETAIL_TTL,
+        concurrency=settings.CATALOG_REPLICA_FETCH_CONCURRENCY,
+        page_size=settings.CATALOG_REPLICA_PAGE_SIZE,
+    )
+    if settings.CATALOG_REPLICA
+    else None
+)
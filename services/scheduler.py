@@ -0,0 +1,193 @@
+import asyncio
+import logging
+from collections import deque
+from time import perf_counter
+from typing import Awaitable, Callable, Hashable
+
+from aiogram import Bot
+
+from classes.metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+queue_wait_seconds = Histogram(
+    "bot_update_queue_wait_seconds", "Time updates waited for their turn"
+)
+queued_updates = Gauge(
+    "bot_update_queued", "Updates accepted and not yet processed, running included"
+)
+running_updates = Gauge("bot_update_running", "Updates being processed")
+backpressure_waits = Counter(
+    "bot_update_backpressure_total", "Updates the intake held back: the queue was full"
+)
+dropped_updates = Counter(
+    "bot_update_dropped_total", "Updates dropped: their chat had too many queued"
+)
+
+SLOW_DOWN_TEXT = "⏳ Too many requests, please slow down and try again in a moment."
+
+
+def shard_key(update: dict) -> int:
+    """chat_id (or user id) an update belongs to, 0 if it has none"""
+    for event in update.values():
+        if not isinstance(event, dict):
+            continue
+        chat = event.get("chat") or (event.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+        user = event.get("from") or event.get("user")
+        if user:
+            return user["id"]
+    return 0
+
+
+class UpdateScheduler:
+    """Process raw updates with bounded concurrency, one at a time per chat
+
+    `concurrency` workers take chats in turn and handle the oldest update
+    of each, so two updates of one chat never overlap and a busy chat
+    does not hold up the others. At most `max_queued` updates are
+    accepted; submit() waits beyond that, which stops the intake (the
+    polling loop, or the webhook response Telegram waits for). A chat
+    holds at most `max_per_chat` of them, further updates of a chat that
+    floods the bot are dropped instead of stopping everyone's intake.
+    `on_drop` is called in the background with every dropped callback
+    query, so its button stops spinning, and with the first other update
+    dropped while a chat is full.
+    """
+
+    def __init__(
+        self,
+        dispatch: Callable[[dict], Awaitable],
+        concurrency: int,
+        max_queued: int,
+        max_per_chat: int,
+        on_drop: Callable[[dict], Awaitable] | None = None,
+    ):
+        self.dispatch = dispatch
+        self.on_drop = on_drop
+        self.concurrency = concurrency
+        self.max_per_chat = max_per_chat
+        self._slots = asyncio.Semaphore(max_queued)
+        # Chats with updates to process; a chat is in _ready while it waits
+        # for a worker, and in neither while a worker holds it
+        self._chats: dict[Hashable, deque] = {}
+        self._ready: asyncio.Queue = asyncio.Queue()
+        self._workers: list[asyncio.Task] = []
+        self._idle = asyncio.Event()
+        self._idle.set()
+        # Chats told about dropped updates since they last filled up
+        self._warned: set[Hashable] = set()
+        self._notices: set[asyncio.Task] = set()
+
+        self.queued = 0
+        self.running = 0
+        self.dropped = 0
+
+    def _chat_full(self, key: Hashable, update: dict) -> bool:
+        pending = self._chats.get(key)
+        if pending is None or len(pending) < self.max_per_chat:
+            return False
+        self.dropped += 1
+        dropped_updates.inc()
+        logger.warning("Dropped update id=%s of busy chat %s", update["update_id"], key)
+        if self.on_drop is not None and (
+            "callback_query" in update or key not in self._warned
+        ):
+            self._warned.add(key)
+            notice = asyncio.create_task(self._notify(update))
+            self._notices.add(notice)
+            notice.add_done_callback(self._notices.discard)
+        return True
+
+    async def _notify(self, update: dict) -> None:
+        try:
+            await self.on_drop(update)
+        except Exception:
+            logger.exception(
+                "Failed to report dropped update id=%s", update["update_id"]
+            )
+
+    async def submit(self, update: dict) -> None:
+        """Queue an update, waiting while the queue is full
+
+        The update is dropped if its chat already has max_per_chat queued.
+        """
+        # Updates without a chat or user are independent of each other
+        key = shard_key(update) or ("update", update.get("update_id"))
+        if self._chat_full(key, update):
+            return
+        if self._slots.locked():
+            backpressure_waits.inc()
+        await self._slots.acquire()
+        # The chat may have filled up while this update waited for a slot
+        if self._chat_full(key, update):
+            self._slots.release()
+            return
+        if not self._workers:
+            self._workers = [
+                asyncio.create_task(self._work()) for _ in range(self.concurrency)
+            ]
+
+        pending = self._chats.get(key)
+        if pending is None:
+            pending = self._chats[key] = deque()
+            self._ready.put_nowait(key)
+        pending.append((perf_counter(), update))
+
+        self.queued += 1
+        queued_updates.set(self.queued)
+        self._idle.clear()
+
+    async def _work(self) -> None:
+        while True:
+            key = await self._ready.get()
+            pending = self._chats[key]
+            queued_at, update = pending.popleft()
+            queue_wait_seconds.observe(perf_counter() - queued_at)
+
+            self.running += 1
+            running_updates.set(self.running)
+            try:
+                await self.dispatch(update)
+            except Exception:
+                logger.exception("Failed to process update id=%s", update["update_id"])
+            finally:
+                self.running -= 1
+                self.queued -= 1
+                running_updates.set(self.running)
+                queued_updates.set(self.queued)
+                self._slots.release()
+                # Back of the line, so chats take turns
+                if pending:
+                    self._ready.put_nowait(key)
+                else:
+                    del self._chats[key]
+                    self._warned.discard(key)
+                if not self.queued:
+                    self._idle.set()
+
+    async def close(self, timeout: float) -> None:
+        """Wait for queued updates, cancelling whatever is left after timeout"""
+        if self.queued:
+            logger.info("Draining %d queued updates", self.queued)
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Dropped %d updates after drain timeout", self.queued)
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, *self._notices, return_exceptions=True)
+        self._workers = []
+
+
+def slow_down(bot: Bot) -> Callable[[dict], Awaitable]:
+    """on_drop hook asking the user of a flooded chat to slow down"""
+
+    async def notify(update: dict) -> None:
+        if callback := update.get("callback_query"):
+            await bot.answer_callback_query(callback["id"], text=SLOW_DOWN_TEXT)
+        elif message := update.get("message"):
+            await bot.send_message(message["chat"]["id"], SLOW_DOWN_TEXT)
+
+    return notify
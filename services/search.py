@@ -0,0 +1,252 @@
+import asyncio
+import logging
+import re
+from time import monotonic, perf_counter
+
+from classes.cache import TTLCache
+from classes.metrics import Counter, Histogram
+from services.replica import DETAIL_FIELDS, list_pages, replica
+from settings import settings
+from utils import request_get
+
+logger = logging.getLogger(__name__)
+
+search_seconds = Histogram(
+    "bot_search_query_seconds",
+    "Inline search latency",
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01),
+)
+search_rebuilds = Counter(
+    "bot_search_rebuilds_total", "Search index rebuilds by result", labels=("result",)
+)
+
+_NON_WORD = re.compile(r"[\W_]+")
+
+
+def normalize(text: str) -> str:
+    return _NON_WORD.sub(" ", text.casefold()).strip()
+
+
+def trigrams(word: str) -> set[str]:
+    return {word[i : i + 3] for i in range(len(word) - 2)}
+
+
+class SearchEntry:
+    """A product as the index sees it"""
+
+    __slots__ = (
+        "id",
+        "name",
+        "description",
+        "price",
+        "discount_percent",
+        "stock",
+        "image",
+        "listing",
+        "fetched_at",
+    )
+
+    def __init__(self, product: dict, listing: dict, fetched_at: float):
+        self.id = product["id"]
+        self.name = product["name"]
+        self.description = product.get("description") or ""
+        self.price = product.get("price")
+        self.discount_percent = product.get("discount_percent")
+        self.stock = product.get("stock")
+        self.image = product.get("image")
+        # The list item it was built from, to notice changes on rebuild
+        self.listing = listing
+        self.fetched_at = fetched_at
+
+
+class SearchIndex:
+    """Immutable word index over product names and descriptions
+
+    A query term matches a word containing it, or starting with it if the
+    term is shorter than three characters. Words are found through a
+    trigram index over the vocabulary, which is much smaller than the
+    catalog, so only a few words are ever checked as substrings. All
+    terms have to match; products matching in the name come first, each
+    group in catalog order.
+    """
+
+    def __init__(self, entries: list[SearchEntry]):
+        self.entries = entries
+        self._names = self._postings(normalize(entry.name) for entry in entries)
+        self._texts = self._postings(
+            normalize(f"{entry.name} {entry.description}") for entry in entries
+        )
+        self._grams: dict[str, set[str]] = {}
+        for word in self._texts[0]:
+            for gram in trigrams(word):
+                self._grams.setdefault(gram, set()).add(word)
+        # Pages of one query repeat it with a growing offset
+        self._results = TTLCache(maxsize=1024, ttl=float("inf"))
+
+    @staticmethod
+    def _postings(texts) -> tuple[dict, dict]:
+        """Positions of the entries each word and word prefix occurs in"""
+        words: dict[str, set[int]] = {}
+        prefixes: dict[str, set[int]] = {}
+        for position, text in enumerate(texts):
+            for word in text.split():
+                words.setdefault(word, set()).add(position)
+                for prefix in {word[:1], word[:2]}:
+                    prefixes.setdefault(prefix, set()).add(position)
+        return words, prefixes
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _words(self, term: str) -> set[str]:
+        """Words of the catalog containing a term of three or more characters"""
+        sets = [self._grams.get(gram) for gram in trigrams(term)]
+        if not all(sets):
+            return set()
+        words = set.intersection(*sets)
+        # All trigrams of a longer term can occur in a word without the term
+        return words if len(term) == 3 else {word for word in words if term in word}
+
+    @staticmethod
+    def _lookup(postings: tuple[dict, dict], terms: list) -> set[int]:
+        """Positions that match every term"""
+        words, prefixes = postings
+        matches = None
+        for term in terms:
+            if isinstance(term, str):
+                found = prefixes.get(term, set())
+            else:
+                found = set().union(*(words.get(word, ()) for word in term))
+            matches = found if matches is None else matches & found
+            if not matches:
+                return set()
+        return matches
+
+    def _match(self, query: str) -> list[int]:
+        # Short terms stay strings and match word prefixes
+        terms = [
+            term if len(term) < 3 else self._words(term)
+            for term in normalize(query).split()
+        ]
+        if not terms:
+            return list(range(len(self.entries)))
+        matches = self._lookup(self._texts, terms)
+        if not matches:
+            return []
+        in_names = self._lookup(self._names, terms)
+        return sorted(in_names) + sorted(matches - in_names)
+
+    def search(self, query: str) -> list[int]:
+        """Positions of matching entries, best first"""
+        matches = self._results.get(query)
+        if matches is None:
+            matches = self._match(query)
+            self._results.set(query, matches)
+        return matches
+
+
+class ProductSearch:
+    """Inline search over a local index of the whole catalog
+
+    A background loop builds a new index every `interval` seconds, which
+    replaces the old one in one assignment. It reads the catalog replica
+    while that is fresh, otherwise it walks /api/v1/products/: products
+    whose list item did not change keep their details for up to
+    `detail_ttl` seconds, others are fetched again, at most `concurrency`
+    at a time. A failed rebuild keeps the current index.
+    """
+
+    def __init__(
+        self, interval: float, detail_ttl: float, concurrency: int, page_size: int
+    ):
+        self.interval = interval
+        self.detail_ttl = detail_ttl
+        self.page_size = page_size
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._task: asyncio.Task | None = None
+        self.index = SearchIndex([])
+        self.built_at: float | None = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.rebuild()
+            except Exception:
+                search_rebuilds.inc("failed")
+                logger.exception("Search index rebuild failed")
+            await asyncio.sleep(self.interval)
+
+    async def _entry(self, item: dict, previous: SearchEntry | None) -> SearchEntry:
+        now = monotonic()
+        if (
+            previous is not None
+            and previous.listing == item
+            and now - previous.fetched_at < self.detail_ttl
+        ):
+            return previous
+        if all(field in item for field in DETAIL_FIELDS):
+            return SearchEntry(item, item, now)
+
+        async with self._semaphore:
+            response = await request_get(
+                f"{settings.HOST}/api/v1/products/{item['id']}"
+            )
+        if response.status_code != 200:
+            # Still findable by name, and kept for the next rebuild to retry
+            return previous or SearchEntry(item, {}, now)
+        return SearchEntry(response.json(), item, now)
+
+    async def rebuild(self) -> None:
+        if replica and replica.fresh:
+            now = monotonic()
+            entries = [
+                SearchEntry(product.data, product.listing, now)
+                for product in await replica.products()
+            ]
+        else:
+            items = [item async for _, page in list_pages() for item in page]
+            previous = {entry.id: entry for entry in self.index.entries}
+            entries = await asyncio.gather(
+                *(self._entry(item, previous.get(item["id"])) for item in items)
+            )
+        # Building takes a while for a large catalog, keep the loop responsive
+        self.index = await asyncio.to_thread(SearchIndex, list(entries))
+        self.built_at = monotonic()
+        search_rebuilds.inc("ok")
+
+    @property
+    def age(self) -> float | None:
+        """Seconds since the index was built, None before the first build"""
+        return None if self.built_at is None else monotonic() - self.built_at
+
+    def search(self, query: str, offset: int) -> tuple[list[SearchEntry], int | None]:
+        """A page of results and the offset of the next page, if any"""
+        started = perf_counter()
+        index = self.index
+        matches = index.search(query)
+        page = [index.entries[p] for p in matches[offset : offset + self.page_size]]
+        search_seconds.observe(perf_counter() - started)
+        next_offset = offset + self.page_size
+        return page, next_offset if next_offset < len(matches) else None
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+search = (
+    ProductSearch(
+        interval=settings.SEARCH_REFRESH_INTERVAL,
+        detail_ttl=settings.SEARCH_DETAIL_TTL,
+        concurrency=settings.SEARCH_FETCH_CONCURRENCY,
+        page_size=settings.SEARCH_PAGE_SIZE,
+    )
+    if settings.SEARCH_INLINE
+    else None
+)
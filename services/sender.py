@@ -0,0 +1,133 @@
+import asyncio
+from time import monotonic
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import (
+    BaseRequestMiddleware,
+    NextRequestMiddlewareType,
+)
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+
+from classes.cache import TTLCache
+
+
+class TokenBucket:
+    """Token bucket that hands out send slots in arrival order"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+
+    def _refill(self) -> None:
+        now = monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        """Take a token, return how long to wait until it is usable"""
+        self._refill()
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def pause(self, seconds: float) -> None:
+        """Push the next free slot at least `seconds` into the future"""
+        self._refill()
+        self.tokens = min(self.tokens, 1) - seconds * self.rate
+
+
+class SendScheduler(BaseRequestMiddleware):
+    """Rate-limit outgoing chat methods to Telegram's flood limits
+
+    Every method addressed to a chat waits for a slot in its per-chat
+    bucket, then in the global one. Callback answers (and other methods
+    without a chat_id) are not subject to these limits and go out
+    immediately, ahead of any queued messages. Flood-wait errors pause
+    the chat for retry_after seconds and the request is retried. Unless
+    the chat was over its own limit, the wait is taken for the bot-wide
+    one and pauses every chat.
+    """
+
+    def __init__(
+        self,
+        global_rate: float,
+        global_burst: float,
+        chat_rate: float,
+        chat_burst: float,
+        max_retries: int,
+        chat_buckets_size: int,
+        chat_buckets_ttl: float,
+    ):
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._chat_buckets = TTLCache(maxsize=chat_buckets_size, ttl=chat_buckets_ttl)
+
+        self.sent = 0
+        self.retries = 0
+        self.global_pauses = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.chat_rate, self.chat_burst)
+        self._chat_buckets.set(chat_id, bucket)
+        return bucket
+
+    async def _acquire(self, chat_id) -> bool:
+        """Wait for a send slot, return whether the chat's own limit held it"""
+        started = monotonic()
+        chat_delay = self._chat_bucket(chat_id).reserve()
+        if chat_delay:
+            await asyncio.sleep(chat_delay)
+        delay = self.global_bucket.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+        waited = monotonic() - started
+        self.sent += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        return chat_delay > 0
+
+    @staticmethod
+    def _chat_specific(chat_id, throttled: bool) -> bool:
+        """Whether a flood wait is likely the chat's own limit, not the bot's
+
+        Groups and channels (negative ids, @usernames) have stricter limits
+        than the chat bucket models; a private chat only hits its own if
+        it was already being throttled.
+        """
+        if isinstance(chat_id, str) and not chat_id.lstrip("-").isdigit():
+            return True
+        return throttled or int(chat_id) < 0
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType,
+        bot: Bot,
+        method: TelegramMethod,
+    ) -> Response:
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await make_request(bot, method)
+
+        for attempt in range(self.max_retries + 1):
+            throttled = await self._acquire(chat_id)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                self.retries += 1
+                self._chat_bucket(chat_id).pause(e.retry_after)
+                if not self._chat_specific(chat_id, throttled):
+                    self.global_pauses += 1
+                    self.global_bucket.pause(e.retry_after)
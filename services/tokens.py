@@ -0,0 +1,208 @@
+import asyncio
+import base64
+import json
+import logging
+from contextvars import ContextVar
+from datetime import datetime, timedelta, timezone
+from functools import partial
+
+from classes.metrics import Counter
+from database.base import autocommit_session
+from database.models import (
+    CachedUser,
+    cache_user,
+    forget_refresh_token,
+    get_expiring_users,
+    get_user,
+    update_user_token,
+    user_cache,
+)
+from settings import settings
+from utils import on_unauthorized, request_post
+
+logger = logging.getLogger(__name__)
+
+# Chat of the update being handled, set by AuthMiddleware
+current_chat: ContextVar[int | None] = ContextVar("current_chat", default=None)
+
+token_refreshes = Counter(
+    "bot_token_refreshes_total",
+    "Access token refreshes by trigger and result",
+    labels=("trigger", "result"),
+)
+
+
+def token_expiry(token: str) -> datetime | None:
+    """exp claim of a JWT, read without verifying the signature
+
+    The bot only uses it to know when to refresh; the backend still
+    validates the token on every request.
+    """
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(payload))
+        return datetime.fromtimestamp(claims["exp"], timezone.utc)
+    except (IndexError, KeyError, TypeError, ValueError, OverflowError):
+        return None
+
+
+def token_fields(data: dict) -> dict:
+    """update_user_token arguments for a /token/ or /token/refresh/ response"""
+    access = data["access"]
+    expires_at = token_expiry(access)
+    return {
+        "token": access,
+        # Hours, only for backends whose tokens carry no exp
+        "exp": None if expires_at else settings.TOKEN_DEFAULT_TTL_HOURS,
+        "refresh_token": data.get("refresh"),
+        "expires_at": expires_at,
+    }
+
+
+class TokenRefresher:
+    """Keep access tokens fresh with the refresh tokens from /login
+
+    A background loop refreshes tokens that expire within `ahead` seconds,
+    `batch_size` users per round with at most `concurrency` requests at a
+    time. refresh() does the same on demand for one chat, when the
+    backend answered 401 or the cached token has already expired;
+    concurrent calls for a chat share one request.
+    """
+
+    def __init__(
+        self, interval: float, ahead: float, batch_size: int, concurrency: int
+    ):
+        self.interval = interval
+        self.ahead = ahead
+        self.batch_size = batch_size
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._pending: dict[int, asyncio.Task] = {}
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def refresh(
+        self, chat_id: int, stale_token: str | None = None, trigger: str = "demand"
+    ) -> CachedUser | None:
+        """Fresh credentials of the chat, None if the user has to log in"""
+        task = self._pending.get(chat_id)
+        if task is None:
+            task = asyncio.create_task(self._refresh(chat_id, stale_token, trigger))
+            self._pending[chat_id] = task
+            task.add_done_callback(partial(self._done, chat_id))
+        return await asyncio.shield(task)
+
+    def _done(self, chat_id: int, task: asyncio.Task) -> None:
+        if self._pending.get(chat_id) is task:
+            del self._pending[chat_id]
+        if not task.cancelled():
+            task.exception()
+
+    async def _refresh(
+        self, chat_id: int, stale_token: str | None, trigger: str
+    ) -> CachedUser | None:
+        async with autocommit_session() as session:
+            user = await get_user(session, chat_id)
+        if user is None:
+            return None
+
+        # Another worker or an earlier call may have refreshed it already
+        deadline = datetime.now(timezone.utc) + timedelta(seconds=self.ahead)
+        exp_time = user.exp_time
+        if user.token != stale_token and exp_time and exp_time > deadline:
+            token_refreshes.inc(trigger, "reused")
+            return cache_user(user)
+
+        if not user.refresh_token:
+            token_refreshes.inc(trigger, "no_refresh_token")
+            return None
+
+        try:
+            async with self._semaphore:
+                response = await request_post(
+                    f"{settings.HOST}/api/v1/token/refresh/",
+                    refresh=user.refresh_token,
+                )
+        except Exception as error:
+            logger.warning("Token refresh for chat %s failed: %r", chat_id, error)
+            token_refreshes.inc(trigger, "failed")
+            return None
+
+        if response.status_code == 200:
+            fields = token_fields(response.json())
+            # Without rotation the backend does not send a new refresh token
+            fields["refresh_token"] = fields["refresh_token"] or user.refresh_token
+            async with autocommit_session() as session:
+                cached = await update_user_token(session, chat_id, **fields)
+            token_refreshes.inc(trigger, "refreshed")
+            return cached
+
+        if response.status_code in (400, 401):
+            # The refresh token expired or was revoked: the user logs in again
+            async with autocommit_session() as session:
+                await forget_refresh_token(session, chat_id)
+            user_cache.pop(chat_id)
+            token_refreshes.inc(trigger, "rejected")
+            return None
+
+        logger.warning(
+            "Token refresh for chat %s failed with %s", chat_id, response.status_code
+        )
+        token_refreshes.inc(trigger, "failed")
+        return None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.refresh_expiring()
+            except Exception:
+                logger.exception("Scheduled token refresh failed")
+            await asyncio.sleep(self.interval)
+
+    async def refresh_expiring(self) -> int:
+        """Refresh tokens expiring within `ahead` seconds, return their number"""
+        before = datetime.now(timezone.utc) + timedelta(seconds=self.ahead)
+        async with autocommit_session() as session:
+            chat_ids = await get_expiring_users(session, before, self.batch_size)
+        results = await asyncio.gather(
+            *(self.refresh(chat_id, trigger="scheduled") for chat_id in chat_ids),
+            return_exceptions=True,
+        )
+        for chat_id, result in zip(chat_ids, results):
+            if isinstance(result, Exception):
+                logger.error(
+                    "Token refresh for chat %s failed", chat_id, exc_info=result
+                )
+        return len(chat_ids)
+
+    async def close(self) -> None:
+        """Stop the background loop and pending refreshes"""
+        tasks = list(self._pending.values())
+        if self._task is not None:
+            tasks.append(self._task)
+            self._task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+tokens = TokenRefresher(
+    interval=settings.TOKEN_REFRESH_INTERVAL,
+    ahead=settings.TOKEN_REFRESH_AHEAD,
+    batch_size=settings.TOKEN_REFRESH_BATCH_SIZE,
+    concurrency=settings.TOKEN_REFRESH_CONCURRENCY,
+)
+
+
+async def _retry_token(stale_token: str) -> str | None:
+    chat_id = current_chat.get()
+    if chat_id is None:
+        return None
+    user = await tokens.refresh(chat_id, stale_token, trigger="unauthorized")
+    return user.token if user else None
+
+
+on_unauthorized(_retry_token)
@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import signal
+from functools import partial
+from hmac import compare_digest
+from typing import Awaitable, Callable
+
+from aiogram import Bot, Dispatcher
+from aiohttp import web
+
+from services.metrics import metrics_handler
+from services.payments import stripe_webhook
+from services.scheduler import UpdateScheduler, slow_down
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+Dispatch = Callable[[dict], Awaitable]
+
+
+class WebhookHandler:
+    """Accept Telegram updates over HTTP and hand them to dispatch
+
+    The response is sent once dispatch has accepted the update, so a
+    full UpdateScheduler slows Telegram down instead of piling up tasks.
+    """
+
+    def __init__(self, dispatch: Dispatch, secret: str):
+        if not secret:
+            raise ValueError("The webhook needs a secret token")
+        self.dispatch = dispatch
+        self.secret = secret
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if not compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            return web.Response(status=401)
+
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        if not isinstance(update, dict) or "update_id" not in update:
+            return web.Response(status=400)
+
+        await self.dispatch(update)
+        return web.Response()
+
+
+async def serve(app: web.Application, host: str, port: int) -> web.AppRunner:
+    """Start an aiohttp application and return its runner"""
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Listening on http://%s:%s", host, port)
+    return runner
+
+
+def stop_on_signals() -> asyncio.Event:
+    """Event that is set on SIGINT/SIGTERM"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    return stop
+
+
+def create_app(dp: Dispatcher, bot: Bot) -> web.Application:
+    """HTTP endpoints served next to the bot in every run mode"""
+    app = web.Application()
+    if settings.METRICS_PATH:
+        app.router.add_get(settings.METRICS_PATH, metrics_handler)
+    if stripe_webhook:
+        stripe_webhook.bind(dp, bot)
+        app.router.add_post(settings.STRIPE_WEBHOOK_PATH, stripe_webhook.handle)
+    return app
+
+
+def create_metrics_app() -> web.Application:
+    """Metrics endpoint alone, served by worker processes"""
+    app = web.Application()
+    app.router.add_get(settings.METRICS_PATH, metrics_handler)
+    return app
+
+
+async def start_server(dp: Dispatcher, bot: Bot) -> web.AppRunner | None:
+    """Serve create_app() in polling mode, if it has any endpoints"""
+    app = create_app(dp, bot)
+    if not app.router.routes():
+        return None
+    return await serve(app, settings.WEBHOOK_LISTEN_HOST, settings.WEBHOOK_PORT)
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, dispatch: Dispatch | None = None):
+    """Receive updates through a webhook until SIGINT/SIGTERM
+
+    Updates go to the dispatcher through an UpdateScheduler unless another
+    dispatch callable is given.
+    """
+    scheduler = None
+    if dispatch is None:
+        scheduler = UpdateScheduler(
+            partial(dp.feed_raw_update, bot),
+            concurrency=settings.UPDATE_CONCURRENCY,
+            max_queued=settings.UPDATE_QUEUE_SIZE,
+            max_per_chat=settings.UPDATE_CHAT_QUEUE_SIZE,
+            on_drop=slow_down(bot),
+        )
+        dispatch = scheduler.submit
+    handler = WebhookHandler(dispatch, secret=settings.WEBHOOK_SECRET)
+    app = create_app(dp, bot)
+    app.router.add_post(settings.WEBHOOK_PATH, handler.handle)
+
+    stop = stop_on_signals()
+    await dp.emit_startup(bot=bot, dispatcher=dp, **dp.workflow_data)
+    runner = await serve(app, settings.WEBHOOK_LISTEN_HOST, settings.WEBHOOK_PORT)
+    if settings.WEBHOOK_URL:
+        await bot.set_webhook(
+            f"{settings.WEBHOOK_URL}{settings.WEBHOOK_PATH}",
+            secret_token=settings.WEBHOOK_SECRET,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+
+    try:
+        await stop.wait()
+    finally:
+        for site in list(runner.sites):
+            await site.stop()
+        if scheduler is not None:
+            await scheduler.close(settings.WEBHOOK_DRAIN_TIMEOUT)
+        await runner.cleanup()
+        await dp.emit_shutdown(bot=bot, dispatcher=dp, **dp.workflow_data)
@@ -0,0 +1,229 @@
+import asyncio
+import logging
+import multiprocessing
+from functools import partial
+from queue import Full
+from typing import Callable
+
+from aiogram import Bot, Dispatcher
+from aiogram.methods import GetUpdates
+
+from classes.metrics import Counter, Gauge
+from services.scheduler import (
+    UpdateScheduler,
+    backpressure_waits,
+    shard_key,
+    slow_down,
+)
+from services.web import run_webhook, start_server, stop_on_signals
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+queue_depth = Gauge(
+    "bot_worker_queue_depth", "Updates waiting for a worker", labels=("worker",)
+)
+worker_restarts = Counter(
+    "bot_worker_restarts_total", "Crashed workers restarted", labels=("worker",)
+)
+
+
+class Supervisor:
+    """Runs worker processes and routes updates to them by chat_id
+
+    Each worker has a queue of `queue_size` updates; route() waits while
+    the worker's queue is full, which stops the intake.
+    """
+
+    def __init__(self, target: Callable, workers: int, queue_size: int):
+        self.target = target
+        self.queue_size = queue_size
+        self._ctx = multiprocessing.get_context("spawn")
+        self.queues = [self._ctx.Queue(queue_size) for _ in range(workers)]
+        self.processes: list = [None] * workers
+        self.restarts = [0] * workers
+
+    def start(self) -> None:
+        for index in range(len(self.queues)):
+            self._spawn(index)
+
+    def _spawn(self, index: int) -> None:
+        process = self._ctx.Process(
+            target=self.target,
+            args=(index, self.queues[index]),
+            name=f"worker-{index}",
+        )
+        process.start()
+        self.processes[index] = process
+        logger.info("Started worker-%d (pid %s)", index, process.pid)
+
+    def _restart(self, index: int) -> None:
+        # A worker that died inside queue.get() leaves the queue's reader
+        # lock held, so its replacement needs a fresh queue
+        lost = self.queues[index].qsize()
+        self.queues[index].close()
+        self.queues[index] = self._ctx.Queue(self.queue_size)
+        self.restarts[index] += 1
+        worker_restarts.inc(str(index))
+        logger.error(
+            "worker-%d exited with code %s, restarting (%d queued updates lost)",
+            index,
+            self.processes[index].exitcode,
+            lost,
+        )
+        self._spawn(index)
+
+    async def route(self, update: dict) -> None:
+        index = hash(shard_key(update)) % len(self.queues)
+        try:
+            self.queues[index].put_nowait(update)
+            return
+        except Full:
+            backpressure_waits.inc()
+
+        loop = asyncio.get_running_loop()
+        while True:
+            # Retried on the queue a restarted worker gets, if it crashed
+            put = partial(
+                self.queues[index].put, update, timeout=settings.WORKER_RESTART_DELAY
+            )
+            try:
+                await loop.run_in_executor(None, put)
+                return
+            except (Full, ValueError):
+                # ValueError: the queue was closed by _restart() meanwhile
+                continue
+
+    def queue_depths(self) -> list[int]:
+        depths = [queue.qsize() for queue in self.queues]
+        for index, depth in enumerate(depths):
+            queue_depth.set(depth, str(index))
+        return depths
+
+    async def monitor(self) -> None:
+        """Restart crashed workers and periodically log queue depths"""
+        loop = asyncio.get_running_loop()
+        next_stats = loop.time() + settings.WORKER_STATS_INTERVAL
+
+        while True:
+            await asyncio.sleep(settings.WORKER_RESTART_DELAY)
+            for index, process in enumerate(self.processes):
+                if not process.is_alive():
+                    self._restart(index)
+            self.queue_depths()
+
+            if loop.time() >= next_stats:
+                next_stats = loop.time() + settings.WORKER_STATS_INTERVAL
+                logger.info(
+                    "Worker queue depths: %s, restarts: %s",
+                    self.queue_depths(),
+                    self.restarts,
+                )
+
+    async def stop(self, timeout: float) -> None:
+        """Let workers finish their queues, then terminate stragglers"""
+        loop = asyncio.get_running_loop()
+        for worker_queue in self.queues:
+            try:
+                await loop.run_in_executor(
+                    None, partial(worker_queue.put, None, timeout=timeout)
+                )
+            except Full:
+                # A dead worker never drains it; join() times out below
+                pass
+
+        for process in self.processes:
+            await loop.run_in_executor(None, process.join, timeout)
+            if process.is_alive():
+                logger.warning("%s did not stop in time, terminating", process.name)
+                process.terminate()
+
+
+async def poll_updates(dp: Dispatcher, bot: Bot, dispatch) -> None:
+    """Long-poll Telegram and hand raw updates to dispatch"""
+    method = GetUpdates(
+        timeout=settings.POLLING_TIMEOUT,
+        allowed_updates=dp.resolve_used_update_types(),
+    )
+    while True:
+        try:
+            updates = await bot(method)
+        except Exception:
+            logger.exception("Failed to fetch updates")
+            await asyncio.sleep(settings.WORKER_RESTART_DELAY)
+            continue
+
+        for update in updates:
+            await dispatch(update.model_dump(mode="json", exclude_unset=True))
+            method.offset = update.update_id + 1
+
+
+async def run_polling(dp: Dispatcher, bot: Bot) -> None:
+    """Long-poll and process updates in this process until SIGINT/SIGTERM"""
+    scheduler = UpdateScheduler(
+        partial(dp.feed_raw_update, bot),
+        concurrency=settings.UPDATE_CONCURRENCY,
+        max_queued=settings.UPDATE_QUEUE_SIZE,
+        max_per_chat=settings.UPDATE_CHAT_QUEUE_SIZE,
+        on_drop=slow_down(bot),
+    )
+    await bot.delete_webhook()
+    stop = stop_on_signals()
+    await dp.emit_startup(bot=bot, dispatcher=dp, **dp.workflow_data)
+    runner = await start_server(dp, bot)
+    intake = asyncio.create_task(poll_updates(dp, bot, scheduler.submit))
+
+    try:
+        await stop.wait()
+    finally:
+        intake.cancel()
+        await asyncio.gather(intake, return_exceptions=True)
+        await scheduler.close(settings.WEBHOOK_DRAIN_TIMEOUT)
+        if runner is not None:
+            await runner.cleanup()
+        await dp.emit_shutdown(bot=bot, dispatcher=dp, **dp.workflow_data)
+
+
+async def run_supervisor(dp: Dispatcher, bot: Bot, target: Callable) -> None:
+    """Receive updates in this process and process them in worker processes"""
+    supervisor = Supervisor(target, settings.WORKERS, settings.WORKER_QUEUE_SIZE)
+    supervisor.start()
+    monitor = asyncio.create_task(supervisor.monitor())
+
+    try:
+        if settings.RUN_MODE == "webhook":
+            await run_webhook(dp, bot, dispatch=supervisor.route)
+        else:
+            await bot.delete_webhook()
+            stop = stop_on_signals()
+            runner = await start_server(dp, bot)
+            intake = asyncio.create_task(poll_updates(dp, bot, supervisor.route))
+            await stop.wait()
+            intake.cancel()
+            await asyncio.gather(intake, return_exceptions=True)
+            if runner is not None:
+                await runner.cleanup()
+    finally:
+        monitor.cancel()
+        await supervisor.stop(settings.WEBHOOK_DRAIN_TIMEOUT)
+
+
+async def process_queue(dp: Dispatcher, bot: Bot, queue) -> None:
+    """Worker loop: feed updates from the supervisor queue to the dispatcher
+
+    While the scheduler is full the worker stops reading, and updates
+    wait in the supervisor queue (bot_worker_queue_depth).
+    """
+    loop = asyncio.get_running_loop()
+    scheduler = UpdateScheduler(
+        partial(dp.feed_raw_update, bot),
+        concurrency=settings.UPDATE_CONCURRENCY,
+        max_queued=settings.UPDATE_QUEUE_SIZE,
+        max_per_chat=settings.UPDATE_CHAT_QUEUE_SIZE,
+        on_drop=slow_down(bot),
+    )
+
+    while (update := await loop.run_in_executor(None, queue.get)) is not None:
+        await scheduler.submit(update)
+
+    await scheduler.close(settings.WEBHOOK_DRAIN_TIMEOUT)
@@ -1,3 +1,7 @@
+import re
+from typing import Literal
+
+from pydantic import model_validator
 from pydantic_settings import BaseSettings
 
 
@@ -7,12 +11,156 @@ class Settings(BaseSettings):
 
     STRIPE_PUBLISHABLE_KEY: str
     STRIPE_SECRET_KEY: str
+    STRIPE_API_BASE: str = ""
+    STRIPE_TERMINAL_TTL: float = 24 * 60 * 60
+    STRIPE_PENDING_TTL: float = 5
+    STRIPE_WEBHOOK_SECRET: str = ""
+    STRIPE_WEBHOOK_PATH: str = "/stripe/webhook"
 
     DB_PORT: int
     DB_HOST: str
     DB_PASSWORD: str
     DB_USER: str
     DB_NAME: str
+    DB_POOL_SIZE: int = 10
+    DB_POOL_MIN_SIZE: int = 2
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: float = 30
+    DB_POOL_RECYCLE: int = 30 * 60
+    DB_POOL_PRE_PING: bool = True
+    DB_STATEMENT_CACHE_SIZE: int = 100
+
+    RUN_MODE: Literal["polling", "webhook"] = "polling"
+
+    POLLING_TIMEOUT: int = 10
+    WORKERS: int = 1
+    WORKER_RESTART_DELAY: float = 1
+    WORKER_STATS_INTERVAL: float = 60
+    # Updates waiting for each worker beyond which the intake waits
+    WORKER_QUEUE_SIZE: int = 1000
+
+    WEBHOOK_URL: str = ""
+    WEBHOOK_PATH: str = "/webhook"
+    # Required with RUN_MODE=webhook: Telegram sends it with every update,
+    # 1-256 characters of A-Z, a-z, 0-9, _ and -
+    WEBHOOK_SECRET: str = ""
+    WEBHOOK_LISTEN_HOST: str = "0.0.0.0"
+    WEBHOOK_PORT: int = 8080
+    WEBHOOK_DRAIN_TIMEOUT: float = 30
+
+    # Updates processed at once; one chat's updates always run one by one
+    UPDATE_CONCURRENCY: int = 100
+    # Accepted updates beyond which polling and the webhook wait
+    UPDATE_QUEUE_SIZE: int = 1000
+    # Queued updates of one chat beyond which its new updates are dropped
+    UPDATE_CHAT_QUEUE_SIZE: int = 20
+
+    # Opt-in log of incoming updates for bench.replay
+    RECORD_UPDATES: bool = False
+    RECORD_DIR: str = "recordings"
+    RECORD_MAX_BYTES: int = 64 * 1024 * 1024
+    RECORD_KEEP_FILES: int = 20
+    RECORD_FLUSH_INTERVAL: float = 1
+    RECORD_BUFFER_SIZE: int = 10000
+
+    # Served next to the webhook without authentication, so opt-in: set a
+    # path only where the port is not reachable from outside
+    METRICS_PATH: str = ""
+    # Worker N serves its own metrics on this port + N
+    METRICS_WORKER_PORT: int = 9100
+
+    FSM_STORAGE: Literal["memory", "redis", "postgres"] = "memory"
+    FSM_STATE_TTL: int = 2 * 24 * 60 * 60
+    REDIS_URL: str = "redis://localhost:6379/0"
+
+    SEND_GLOBAL_RATE: float = 30
+    SEND_GLOBAL_BURST: float = 30
+    SEND_CHAT_RATE: float = 1
+    SEND_CHAT_BURST: float = 3
+    SEND_MAX_RETRIES: int = 3
+    SEND_CHAT_BUCKETS_SIZE: int = 100_000
+    SEND_CHAT_BUCKETS_TTL: float = 600
+
+    HTTP_POOL_SIZE: int = 100
+    HTTP_POOL_PER_HOST: int = 30
+    HTTP_KEEPALIVE_TIMEOUT: float = 30
+    HTTP_CONNECT_TIMEOUT: float = 5
+    HTTP_READ_TIMEOUT: float = 15
+
+    # Request timeout: p99 of recent calls × factor, within min..max seconds
+    BACKEND_TIMEOUT_MIN: float = 1
+    BACKEND_TIMEOUT_MAX: float = 15
+    BACKEND_TIMEOUT_P99_FACTOR: float = 3
+    # POST and DELETE are not retried and may succeed after a timeout, so
+    # they wait longer than the adaptive GET timeout
+    BACKEND_WRITE_TIMEOUT: float = 60
+    # Failures in a row that open an endpoint's breaker, seconds until a probe
+    BACKEND_BREAKER_FAILURES: int = 5
+    BACKEND_BREAKER_RESET: float = 30
+    BACKEND_RETRIES: int = 2
+    BACKEND_RETRY_BACKOFF: float = 0.1
+    # Retries per request on top of BACKEND_RETRY_MIN_PER_SECOND
+    BACKEND_RETRY_RATIO: float = 0.1
+    BACKEND_RETRY_MIN_PER_SECOND: float = 1
+
+    AUTH_CACHE_SIZE: int = 10000
+    AUTH_CACHE_TTL: float = 300
+
+    # Lifetime assumed for access tokens without an exp claim
+    TOKEN_DEFAULT_TTL_HOURS: int = 50
+    TOKEN_REFRESH_INTERVAL: float = 60
+    # Tokens expiring within this many seconds are refreshed in the background
+    TOKEN_REFRESH_AHEAD: float = 10 * 60
+    TOKEN_REFRESH_BATCH_SIZE: int = 200
+    TOKEN_REFRESH_CONCURRENCY: int = 10
+
+    ACTIVITY_FLUSH_INTERVAL: float = 5
+    ACTIVITY_MAX_USERS: int = 10000
+    ACTIVITY_BATCH_SIZE: int = 1000
+
+    CART_CACHE_SIZE: int = 10000
+    CART_CACHE_TTL: float = 30
+
+    CALLBACK_CODES_CACHE_SIZE: int = 50000
+
+    CATALOG_CACHE_TTL: float = 60
+    CATALOG_CACHE_STALE_TTL: float = 600
+    CATALOG_CACHE_MAX_BYTES: int = 16 * 1024 * 1024
+    CATALOG_PREFETCH: bool = False
+    CATALOG_PREFETCH_TOP_N: int = 3
+    CATALOG_PREFETCH_CONCURRENCY: int = 8
+
+    # Copy of the catalog in Postgres, browsed with keyset pagination.
+    # Worker 0 syncs it; older than MAX_LAG, it is bypassed for the backend
+    CATALOG_REPLICA: bool = True
+    CATALOG_REPLICA_SYNC_INTERVAL: float = 60
+    CATALOG_REPLICA_MAX_LAG: float = 5 * 60
+    # Unchanged products keep their details this long between syncs
+    CATALOG_REPLICA_DETAIL_TTL: float = 60 * 60
+    CATALOG_REPLICA_FETCH_CONCURRENCY: int = 4
+    CATALOG_REPLICA_PAGE_SIZE: int = 10
+
+    # Inline mode (@bot query) answered from a local index of the catalog;
+    # inline mode must also be enabled for the bot in @BotFather. Opt-in:
+    # every process crawls the whole catalog to build its index
+    SEARCH_INLINE: bool = False
+    SEARCH_REFRESH_INTERVAL: float = 5 * 60
+    # Unchanged products keep their details this long between rebuilds
+    SEARCH_DETAIL_TTL: float = 60 * 60
+    SEARCH_FETCH_CONCURRENCY: int = 4
+    SEARCH_PAGE_SIZE: int = 20
+
+    @model_validator(mode="after")
+    def _check_webhook_secret(self):
+        # Without it anyone who finds the URL can post updates for any chat
+        if self.RUN_MODE == "webhook" and not re.fullmatch(
+            r"[A-Za-z0-9_-]{1,256}", self.WEBHOOK_SECRET
+        ):
+            raise ValueError(
+                "RUN_MODE=webhook needs WEBHOOK_SECRET: 1-256 characters "
+                "of A-Z, a-z, 0-9, _ and -"
+            )
+        return self
 
     @property
     def DATABASE_URL(self):
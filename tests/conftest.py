@@ -0,0 +1,39 @@
+import os
+
+import pytest
+
+# Settings without defaults; tests never reach these services
+for name, value in {
+    "BOT_TOKEN": "123456:test",
+    "STRIPE_PUBLISHABLE_KEY": "pk_test",
+    "STRIPE_SECRET_KEY": "sk_test",
+    "DB_HOST": "localhost",
+    "DB_PORT": "5432",
+    "DB_USER": "test",
+    "DB_PASSWORD": "test",
+    "DB_NAME": "test",
+}.items():
+    os.environ.setdefault(name, value)
+
+
+@pytest.fixture(scope="session")
+def postgres_url(tmp_path_factory) -> str:
+    """A throwaway local PostgreSQL server, started once per test run"""
+    pgserver = pytest.importorskip("pgserver")
+    server = pgserver.get_server(tmp_path_factory.mktemp("pg"), cleanup_mode="stop")
+    return server.get_uri().replace("postgresql://", "postgresql+asyncpg://", 1)
+
+
+@pytest.fixture
+async def db_engine(postgres_url):
+    """Engine on the test server with the bot's tables, emptied for each test"""
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    from database.base import Base
+
+    engine = create_async_engine(postgres_url)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    yield engine
+    await engine.dispose()
@@ -0,0 +1,72 @@
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+import app
+from database.models import CachedUser
+
+LOGGED_IN = CachedUser(
+    "token", None, None, datetime.now(timezone.utc) + timedelta(hours=1)
+)
+
+
+@pytest.fixture
+def users(monkeypatch):
+    users = {}
+
+    @asynccontextmanager
+    async def session():
+        yield None
+
+    async def get_auth_user(session, chat_id):
+        return users.get(chat_id)
+
+    monkeypatch.setattr(app, "async_session", session)
+    monkeypatch.setattr(app, "get_auth_user", get_auth_user)
+    return users
+
+
+def message_update(text: str):
+    answers = []
+
+    async def answer(text, **kwargs):
+        answers.append(text)
+
+    message = SimpleNamespace(
+        from_user=SimpleNamespace(id=10), text=text, answer=answer
+    )
+    return SimpleNamespace(message=message, callback_query=None), answers
+
+
+async def call(text: str):
+    handled = []
+
+    async def handler(event, data):
+        handled.append(data)
+
+    event, answers = message_update(text)
+    await app.AuthMiddleware()(handler, event, {})
+    return handled, answers
+
+
+@pytest.mark.parametrize("text", ["/start", "/start@shop_bot", "/login a b"])
+async def test_auth_commands_work_without_login(users, text):
+    handled, answers = await call(text)
+    assert handled == [{}]
+    assert answers == []
+
+
+@pytest.mark.parametrize("text", ["/startx", "/registered", "5"])
+async def test_other_text_needs_login(users, text):
+    handled, answers = await call(text)
+    assert handled == []
+    assert "login first" in answers[0]
+
+
+async def test_auth_commands_still_pass_a_known_user(users):
+    # In ToCard.quantity "/start payload" reaches a handler that needs the user
+    users[10] = LOGGED_IN
+    handled, _ = await call("/start payload")
+    assert handled == [{"user": LOGGED_IN}]
@@ -0,0 +1,26 @@
+import pytest
+from sqlalchemy import event, text
+from sqlalchemy.exc import DBAPIError
+
+from database.base import _query_finished, _query_started, pool_metrics
+
+
+@pytest.fixture
+def timed_engine(db_engine):
+    event.listen(db_engine.sync_engine, "before_cursor_execute", _query_started)
+    event.listen(db_engine.sync_engine, "after_cursor_execute", _query_finished)
+    return db_engine
+
+
+async def test_failed_queries_leave_nothing_behind(timed_engine):
+    queries = pool_metrics.queries
+    async with timed_engine.connect() as conn:
+        for _ in range(3):
+            with pytest.raises(DBAPIError):
+                await conn.execute(text("SELECT 1 / 0"))
+            await conn.rollback()
+        await conn.execute(text("SELECT 1"))
+        info = (await conn.get_raw_connection()).info
+
+    assert pool_metrics.queries == queries + 1
+    assert "query_started" not in info
@@ -0,0 +1,91 @@
+from uuid import uuid4
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+import classes.callback
+from classes.callback import (
+    ShortCodeRegistry,
+    is_catalog_page,
+    pack_id,
+    unpack_id,
+)
+from database.models import save_callback_codes
+
+
+@pytest.mark.parametrize("value", ["7", "123456789", str(uuid4()), "007", "abc"])
+def test_pack_id_round_trip(value):
+    assert unpack_id(pack_id(value)) == value
+
+
+@pytest.mark.parametrize(
+    "value", ["~", "~n", "~u!!", "~uAAAA", "~x" + "A" * 22, "../users", "1/../2"]
+)
+def test_unpack_id_rejects_forged_values(value):
+    assert unpack_id(value) is None
+
+
+@pytest.mark.parametrize(
+    "path",
+    ["/api/v1/products/", "/api/v1/products/?page=2", "/api/v1/products?page=2"],
+)
+def test_catalog_pages_are_accepted(path):
+    assert is_catalog_page(path)
+
+
+@pytest.mark.parametrize(
+    "path",
+    [
+        "@evil.example/x",
+        "//evil.example/api/v1/products/",
+        "http://evil.example/api/v1/products/",
+        "/api/v1/products/../users/",
+        "/api/v1/products/7",
+        "/api/v1/users/?page=2",
+    ],
+)
+def test_other_paths_are_rejected(path):
+    assert not is_catalog_page(path)
+
+
+@pytest.fixture
+async def registry(db_engine, monkeypatch):
+    session_factory = sessionmaker(
+        db_engine, expire_on_commit=False, class_=AsyncSession
+    )
+    monkeypatch.setattr(classes.callback, "async_session", session_factory)
+    registry = ShortCodeRegistry(maxsize=10)
+    yield registry
+    await registry.flush()
+
+
+async def test_code_for_resolves_collisions(registry):
+    # Another value already holds the code "b" hashes to
+    taken = registry.make_code("b")
+    registry._remember(taken, "a")
+
+    code = registry.code_for("b")
+
+    assert code != taken
+    assert registry.code_for("b") == code
+    assert await registry.resolve(code) == "b"
+    assert await registry.resolve(taken) == "a"
+
+
+async def test_code_survives_restart(registry, db_engine):
+    code = registry.code_for("/api/v1/products/?page=2")
+    await registry.flush()
+
+    assert await ShortCodeRegistry(maxsize=10).resolve(code) == (
+        "/api/v1/products/?page=2"
+    )
+
+
+async def test_save_callback_codes_reports_taken_codes(db_engine):
+    session_factory = sessionmaker(
+        db_engine, expire_on_commit=False, class_=AsyncSession
+    )
+    async with session_factory() as session:
+        assert await save_callback_codes(session, {"~x": "a", "~y": "b"}) == {}
+        assert await save_callback_codes(session, {"~x": "a", "~y": "c"}) == {"~y": "b"}
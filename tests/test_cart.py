@@ -0,0 +1,82 @@
+import asyncio
+import copy
+import json
+
+import pytest
+
+import services.cart
+from services.cart import CartCache
+from utils import Response
+
+CART = {
+    "total_price": 30.0,
+    "products": [
+        {"id": 1, "quantity": 1, "total_price": 10.0},
+        {"id": 2, "quantity": 2, "total_price": 20.0},
+    ],
+}
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    """Cart endpoint of the backend, counting fetches"""
+    fetches = []
+
+    async def request_get(url, auth_token=None, headers=None):
+        fetches.append(auth_token)
+        return Response(200, {}, json.dumps(copy.deepcopy(CART)).encode())
+
+    monkeypatch.setattr(services.cart, "request_get", request_get)
+    return fetches
+
+
+@pytest.fixture
+def carts():
+    return CartCache(maxsize=10, ttl=0.2)
+
+
+async def test_edits_patch_the_cached_cart(backend, carts):
+    await carts.get(10, "token")
+    carts.set_quantity(10, "2", 5)
+    carts.remove(10, "1")
+    cart = await carts.get(10, "token")
+
+    assert backend == ["token"]
+    assert cart["products"] == [{"id": 2, "quantity": 5, "total_price": 50.0}]
+    assert cart["total_price"] == 50.0
+
+
+async def test_edit_after_expiry_does_not_revive_the_cart(backend, carts):
+    await carts.get(10, "token")
+    await asyncio.sleep(0.3)
+    carts.set_quantity(10, "2", 5)
+    cart = await carts.get(10, "token")
+
+    assert len(backend) == 2
+    assert cart == CART
+
+
+async def test_edits_keep_the_cart_expiry(backend, carts):
+    await carts.get(10, "token")
+    await asyncio.sleep(0.15)
+    carts.set_quantity(10, "2", 5)
+    await asyncio.sleep(0.1)
+    await carts.get(10, "token")
+
+    assert len(backend) == 2
+
+
+async def test_edit_of_unknown_product_drops_the_cart(backend, carts):
+    await carts.get(10, "token")
+    carts.remove(10, "3")
+    await carts.get(10, "token")
+
+    assert len(backend) == 2
+
+
+async def test_invalidate_refetches_with_the_new_token(backend, carts):
+    await carts.get(10, "old")
+    carts.invalidate(10)
+    await carts.get(10, "new")
+
+    assert backend == ["old", "new"]
@@ -0,0 +1,35 @@
+import json
+
+from services.catalog import CatalogCache, CatalogEntry
+from utils import Response
+
+
+def catalog_response(count: int) -> Response:
+    products = [
+        {"id": i, "name": f"Product {i}", "price": "9.99", "stock": 3}
+        for i in range(count)
+    ]
+    content = json.dumps({"results": products, "next": None}).encode()
+    return Response(200, {}, content)
+
+
+def test_entry_size_counts_parsed_json():
+    response = catalog_response(50)
+    entry = CatalogEntry(response, ttl=60)
+
+    assert entry.size > 3 * len(response.content)
+
+
+def test_entry_size_of_non_json_body():
+    entry = CatalogEntry(Response(200, {}, b"<html>"), ttl=60)
+
+    assert entry.size == len(b"<html>") + 256
+
+
+def test_cache_bound_includes_parsed_json():
+    response = catalog_response(50)
+    cache = CatalogCache(ttl=60, stale_ttl=600, max_bytes=2 * len(response.content))
+
+    cache._store("/api/v1/products/", CatalogEntry(response, ttl=60))
+
+    assert cache.size == 0
@@ -0,0 +1,24 @@
+from classes.metrics import registry
+from services.metrics import _senders
+
+
+def sent_total() -> float:
+    for line in registry.render().splitlines():
+        if line.startswith("bot_sent_messages_total "):
+            return float(line.split()[1])
+    raise AssertionError("bot_sent_messages_total is not exported")
+
+
+async def test_sender_metrics_cover_every_bot():
+    from app import create_bot
+
+    before = sent_total()
+    # A second bot in the same process must not register the metrics again
+    bots = [create_bot(), create_bot()]
+    try:
+        _senders[-2].sent += 2
+        _senders[-1].sent += 3
+        assert sent_total() == before + 5
+    finally:
+        for bot in bots:
+            await bot.session.close()
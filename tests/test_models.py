@@ -0,0 +1,78 @@
+import pytest
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from database.models import (
+    User,
+    get_login_status,
+    get_or_create_user,
+    update_user_token,
+    user_cache,
+)
+
+CHAT_ID = 10
+
+
+@pytest.fixture
+def session_factory(db_engine):
+    # As autocommit_session: single statements without BEGIN/COMMIT
+    return sessionmaker(
+        db_engine.execution_options(isolation_level="AUTOCOMMIT"),
+        expire_on_commit=False,
+        class_=AsyncSession,
+    )
+
+
+@pytest.fixture
+def statements(db_engine):
+    """SQL statements sent to the test database"""
+    sent = []
+
+    def count(conn, cursor, statement, *args):
+        sent.append(statement)
+
+    user_cache.clear()
+    event.listen(db_engine.sync_engine, "before_cursor_execute", count)
+    yield sent
+    event.remove(db_engine.sync_engine, "before_cursor_execute", count)
+    user_cache.clear()
+
+
+async def run(session_factory, operation, *args):
+    async with session_factory() as session:
+        return await operation(session, CHAT_ID, *args)
+
+
+async def test_get_or_create_user_is_one_statement(session_factory, statements):
+    created = await run(session_factory, get_or_create_user)
+    assert len(statements) == 1
+
+    assert await run(session_factory, get_or_create_user) == created
+    assert len(statements) == 2
+
+
+async def test_update_user_token_is_one_statement(session_factory, statements):
+    user = await run(session_factory, update_user_token, "token", 50)
+    assert len(statements) == 1
+    assert user.token == "token"
+
+    # The existing row is updated by the same single statement
+    user = await run(session_factory, update_user_token, "new", 50)
+    assert len(statements) == 2
+    assert user.token == "new"
+
+    async with session_factory() as session:
+        users = (await session.execute(select(User))).scalars().all()
+    assert [(u.chat_id, u.token) for u in users] == [(CHAT_ID, "new")]
+
+
+async def test_get_login_status_is_cached(session_factory, statements):
+    await run(session_factory, update_user_token, "token", 50)
+    user_cache.clear()
+    statements.clear()
+
+    assert (await run(session_factory, get_login_status)).token == "token"
+    assert len(statements) == 1
+    assert (await run(session_factory, get_login_status)).token == "token"
+    assert len(statements) == 1
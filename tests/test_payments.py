@@ -0,0 +1,266 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import time
+from collections import Counter
+
+import pytest
+from aiogram import Bot, Dispatcher
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+import services.payments
+from database.models import claim_checkout_notification, save_checkout_session
+from services.payments import (
+    PAYMENT_EXPIRED_TEXT,
+    PAYMENT_SUCCESS_TEXT,
+    PaymentChecker,
+    StripeWebhook,
+)
+from settings import settings
+
+
+class StubStripe:
+    """Local stand-in for the Stripe Checkout Sessions API"""
+
+    def __init__(self, latency: float = 0.05):
+        self.latency = latency
+        self.sessions: dict[str, tuple[str, str]] = {}
+        self.requests: Counter = Counter()
+        self._runner: web.AppRunner | None = None
+
+    async def retrieve(self, request: web.Request) -> web.Response:
+        session_id = request.match_info["id"]
+        self.requests[session_id] += 1
+        await asyncio.sleep(self.latency)
+        status, payment_status = self.sessions[session_id]
+        return web.json_response(
+            {
+                "id": session_id,
+                "object": "checkout.session",
+                "status": status,
+                "payment_status": payment_status,
+            }
+        )
+
+    async def start(self) -> str:
+        app = web.Application()
+        app.router.add_get("/v1/checkout/sessions/{id}", self.retrieve)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}"
+
+    async def close(self) -> None:
+        await self._runner.cleanup()
+
+
+@pytest.fixture
+async def stripe_stub(monkeypatch):
+    stub = StubStripe()
+    monkeypatch.setattr(settings, "STRIPE_API_BASE", await stub.start())
+    yield stub
+    await stub.close()
+
+
+@pytest.fixture
+async def checker(stripe_stub):
+    checker = PaymentChecker(terminal_ttl=60, pending_ttl=0.2)
+    yield checker
+    await checker.close()
+
+
+async def test_concurrent_checks_share_one_request(stripe_stub, checker):
+    stripe_stub.sessions["cs_1"] = ("open", "unpaid")
+
+    statuses = await asyncio.gather(*(checker.get_status("cs_1") for _ in range(10)))
+
+    assert {(s.status, s.payment_status) for s in statuses} == {("open", "unpaid")}
+    assert stripe_stub.requests["cs_1"] == 1
+
+
+@pytest.mark.parametrize(
+    "status", [("complete", "paid"), ("expired", "unpaid")], ids=["paid", "expired"]
+)
+async def test_terminal_status_is_cached(stripe_stub, checker, status):
+    stripe_stub.sessions["cs_1"] = status
+
+    await checker.get_status("cs_1")
+    # Past the pending TTL; a terminal status must not be asked again
+    await asyncio.sleep(0.3)
+    assert (await checker.get_status("cs_1")).is_terminal
+
+    assert stripe_stub.requests["cs_1"] == 1
+
+
+async def test_pending_status_is_memoized_briefly(stripe_stub, checker):
+    stripe_stub.sessions["cs_1"] = ("open", "unpaid")
+
+    await checker.get_status("cs_1")
+    await checker.get_status("cs_1")
+    assert stripe_stub.requests["cs_1"] == 1
+
+    await asyncio.sleep(0.3)
+    stripe_stub.sessions["cs_1"] = ("complete", "paid")
+    assert (await checker.get_status("cs_1")).payment_status == "paid"
+    assert stripe_stub.requests["cs_1"] == 2
+
+
+async def test_failed_request_is_not_cached(stripe_stub, checker):
+    with pytest.raises(Exception):
+        await checker.get_status("cs_unknown")
+
+    stripe_stub.sessions["cs_unknown"] = ("open", "unpaid")
+    assert (await checker.get_status("cs_unknown")).status == "open"
+    assert stripe_stub.requests["cs_unknown"] == 2
+
+
+WEBHOOK_SECRET = "whsec_test"
+
+
+def checkout_event(event_type: str, status: str, payment_status: str) -> bytes:
+    return json.dumps(
+        {
+            "id": "evt_1",
+            "object": "event",
+            "type": event_type,
+            "data": {
+                "object": {
+                    "id": "cs_1",
+                    "object": "checkout.session",
+                    "status": status,
+                    "payment_status": payment_status,
+                }
+            },
+        }
+    ).encode()
+
+
+def sign(payload: bytes, secret: str = WEBHOOK_SECRET) -> str:
+    timestamp = int(time.time())
+    signature = hmac.new(
+        secret.encode(), f"{timestamp}.".encode() + payload, hashlib.sha256
+    ).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+@pytest.fixture
+async def webhook(db_engine, monkeypatch):
+    session_factory = sessionmaker(
+        db_engine, expire_on_commit=False, class_=AsyncSession
+    )
+    monkeypatch.setattr(services.payments, "async_session", session_factory)
+    monkeypatch.setattr(
+        services.payments,
+        "payments",
+        PaymentChecker(terminal_ttl=60, pending_ttl=0.2),
+    )
+    async with session_factory() as session:
+        await save_checkout_session(session, "cs_1", 10)
+
+    bot = Bot("123456:test")
+    sent = []
+
+    async def send_message(chat_id, text, **kwargs):
+        sent.append((chat_id, text))
+
+    monkeypatch.setattr(bot, "send_message", send_message)
+    dp = Dispatcher()
+    state = dp.fsm.get_context(bot, chat_id=10, user_id=10)
+    await state.update_data(session_id="cs_1")
+
+    webhook = StripeWebhook(WEBHOOK_SECRET)
+    webhook.bind(dp, bot)
+    app = web.Application()
+    app.router.add_post("/stripe/webhook", webhook.handle)
+    client = TestClient(TestServer(app))
+    await client.start_server()
+    yield client, webhook, state, sent
+    await client.close()
+    await bot.session.close()
+
+
+async def post(client, payload: bytes, signature: str):
+    return await client.post(
+        "/stripe/webhook",
+        data=payload,
+        headers={"Stripe-Signature": signature, "Content-Type": "application/json"},
+    )
+
+
+async def test_webhook_completed_notifies_user(webhook):
+    client, stripe_webhook, state, sent = webhook
+    payload = checkout_event("checkout.session.completed", "complete", "paid")
+
+    response = await post(client, payload, sign(payload))
+    await stripe_webhook.close()
+
+    assert response.status == 200
+    assert sent == [(10, PAYMENT_SUCCESS_TEXT)]
+    assert await state.get_data() == {}
+    assert services.payments.payments._statuses.get("cs_1").is_terminal
+
+
+async def test_webhook_expired_notifies_user(webhook):
+    client, stripe_webhook, state, sent = webhook
+    payload = checkout_event("checkout.session.expired", "expired", "unpaid")
+
+    response = await post(client, payload, sign(payload))
+    await stripe_webhook.close()
+
+    assert response.status == 200
+    assert sent == [(10, PAYMENT_EXPIRED_TEXT)]
+    assert await state.get_data() == {}
+
+
+async def test_webhook_rejects_bad_signature(webhook):
+    client, stripe_webhook, state, sent = webhook
+    payload = checkout_event("checkout.session.completed", "complete", "paid")
+
+    response = await post(client, payload, sign(payload, "whsec_other"))
+    await stripe_webhook.close()
+
+    assert response.status == 400
+    assert sent == []
+    assert await state.get_data() == {"session_id": "cs_1"}
+
+
+async def test_webhook_notifies_without_fsm_data(webhook):
+    # The supervisor process does not see the workers' memory storage
+    client, stripe_webhook, state, sent = webhook
+    await state.clear()
+    payload = checkout_event("checkout.session.completed", "complete", "paid")
+
+    await post(client, payload, sign(payload))
+    await stripe_webhook.close()
+
+    assert sent == [(10, PAYMENT_SUCCESS_TEXT)]
+
+
+async def test_webhook_notifies_once(webhook):
+    client, stripe_webhook, state, sent = webhook
+    payload = checkout_event("checkout.session.completed", "complete", "paid")
+
+    await asyncio.gather(*(post(client, payload, sign(payload)) for _ in range(3)))
+    await stripe_webhook.close()
+
+    assert sent == [(10, PAYMENT_SUCCESS_TEXT)]
+
+
+async def test_webhook_skips_sessions_already_checked(webhook, db_engine):
+    client, stripe_webhook, state, sent = webhook
+    # check_payment claims the notification once it sees the result
+    async with services.payments.async_session() as session:
+        assert await claim_checkout_notification(session, "cs_1") == 10
+    payload = checkout_event("checkout.session.completed", "complete", "paid")
+
+    response = await post(client, payload, sign(payload))
+    await stripe_webhook.close()
+
+    assert response.status == 200
+    assert sent == []
@@ -0,0 +1,184 @@
+import json
+from datetime import timedelta
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+import services.replica
+from services.replica import CatalogReplica
+from settings import settings
+from utils import Response
+
+LIST = "/api/v1/products/"
+
+
+class StubCatalog:
+    """The backend's product list, split into pages, and product details"""
+
+    def __init__(self, page_size: int = 3):
+        self.page_size = page_size
+        self.products: list[dict] = []
+        self.details: list[str] = []
+
+    def set(self, *names: str) -> None:
+        self.products = [{"id": int(name[1:]), "name": name} for name in names]
+
+    def _path(self, page: int) -> str:
+        return LIST if page == 1 else f"{LIST}?page={page}"
+
+    async def request_get(self, url, auth_token=None, headers=None) -> Response:
+        path = url.replace(settings.HOST, "")
+        if path.startswith(LIST) and path[len(LIST) :].isdigit():
+            product_id = int(path[len(LIST) :])
+            self.details.append(str(product_id))
+            item = next(p for p in self.products if p["id"] == product_id)
+            body = {**item, "price": 10, "discount_percent": 0, "stock": 5}
+            return Response(200, {}, json.dumps({**body, "description": ""}).encode())
+
+        page = int(path.partition("?page=")[2] or 1)
+        start = (page - 1) * self.page_size
+        results = self.products[start : start + self.page_size]
+        more = start + self.page_size < len(self.products)
+        body = {
+            "results": results,
+            "next": f"{settings.HOST}{self._path(page + 1)}" if more else None,
+        }
+        return Response(200, {}, json.dumps(body).encode())
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    backend = StubCatalog()
+    monkeypatch.setattr(services.replica, "request_get", backend.request_get)
+    return backend
+
+
+@pytest.fixture
+def saved(monkeypatch):
+    """(saved, moved, removed) counts of every save_products call"""
+    calls = []
+    save_products = services.replica.save_products
+
+    async def counting(session, rows, moved, removed, synced_at):
+        calls.append((len(rows), len(moved), len(removed)))
+        return await save_products(session, rows, moved, removed, synced_at)
+
+    monkeypatch.setattr(services.replica, "save_products", counting)
+    return calls
+
+
+@pytest.fixture
+def replica(db_engine, monkeypatch):
+    sessions = sessionmaker(db_engine, expire_on_commit=False, class_=AsyncSession)
+    monkeypatch.setattr(services.replica, "async_session", sessions)
+    monkeypatch.setattr(services.replica, "autocommit_session", sessions)
+    return CatalogReplica(
+        interval=60, max_lag=60, detail_ttl=3600, concurrency=2, page_size=2
+    )
+
+
+async def names(replica) -> list[str]:
+    return [product.name for product in await replica.products()]
+
+
+async def test_first_sync_copies_the_catalog(backend, saved, replica):
+    backend.set("p1", "p2", "p3", "p4", "p5")
+    await replica.sync()
+
+    assert saved == [(5, 0, 0)]
+    assert sorted(backend.details) == ["1", "2", "3", "4", "5"]
+    assert await names(replica) == ["p1", "p2", "p3", "p4", "p5"]
+    assert replica.rows == 5
+    assert (await replica.product("4"))["stock"] == 5
+    assert await replica.list_path(3) == f"{LIST}?page=2"
+
+
+async def test_sync_writes_only_changes(backend, saved, replica):
+    backend.set("p1", "p2", "p3", "p4", "p5")
+    await replica.sync()
+    backend.details.clear()
+
+    # p2 is renamed and p3 is gone: p4 and p5 move up, p4 to page 1
+    backend.set("p1", "p2", "p4", "p5")
+    backend.products[1]["name"] = "p2 renamed"
+    await replica.sync()
+
+    assert saved[-1] == (1, 2, 1)
+    assert backend.details == ["2"]
+    assert await names(replica) == ["p1", "p2 renamed", "p4", "p5"]
+    assert await replica.list_path(2) == LIST
+    assert replica.rows == 4
+
+
+async def test_sync_moves_positions(backend, saved, replica):
+    backend.set("p1", "p2", "p3")
+    await replica.sync()
+
+    backend.set("p0", "p1", "p2", "p3")
+    await replica.sync()
+
+    assert saved[-1] == (1, 3, 0)
+    assert await names(replica) == ["p0", "p1", "p2", "p3"]
+
+
+async def test_keyset_pages(backend, replica):
+    backend.set("p1", "p2", "p3", "p4", "p5")
+    await replica.sync()
+
+    items, next, previous = await replica.page()
+    assert [item["name"] for item in items] == ["p1", "p2"]
+    assert previous is None
+
+    items, next, previous = await replica.page(next)
+    assert [item["name"] for item in items] == ["p3", "p4"]
+
+    items, last_next, last_previous = await replica.page(next)
+    assert [item["name"] for item in items] == ["p5"]
+    assert last_next is None
+
+    items, _, _ = await replica.page(last_previous, before=True)
+    assert [item["name"] for item in items] == ["p3", "p4"]
+    items, _, first_previous = await replica.page(previous, before=True)
+    assert [item["name"] for item in items] == ["p1", "p2"]
+    assert first_previous is None
+
+
+async def test_page_after_removals(backend, replica):
+    backend.set("p1", "p2", "p3", "p4", "p5")
+    await replica.sync()
+    _, next, _ = await replica.page()
+    _, next, _ = await replica.page(next)
+
+    backend.set("p1", "p2")
+    await replica.sync()
+
+    # The button points past the end of the list: back to its start
+    items, _, previous = await replica.page(next)
+    assert [item["name"] for item in items] == ["p1", "p2"]
+    assert previous is None
+
+
+async def test_stale_replica_is_not_usable(backend, replica):
+    assert not replica.usable()
+
+    backend.set("p1")
+    await replica.sync()
+    assert replica.usable()
+
+    replica.synced_at -= timedelta(seconds=replica.max_lag + 1)
+    assert not replica.usable()
+
+
+async def test_empty_list_keeps_the_replica(backend, saved, replica):
+    backend.set("p1", "p2")
+    await replica.sync()
+    synced_at = replica.synced_at
+
+    backend.set()
+    with pytest.raises(RuntimeError):
+        await replica.sync()
+
+    assert saved == [(2, 0, 0)]
+    assert replica.synced_at == synced_at
+    assert await names(replica) == ["p1", "p2"]
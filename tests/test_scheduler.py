@@ -0,0 +1,115 @@
+import asyncio
+
+from services.scheduler import SLOW_DOWN_TEXT, UpdateScheduler, slow_down
+from services.workers import Supervisor
+from settings import settings
+
+
+def message(update_id: int, chat_id: int) -> dict:
+    return {"update_id": update_id, "message": {"chat": {"id": chat_id}}}
+
+
+async def test_flooding_chat_does_not_stop_other_chats():
+    release = asyncio.Event()
+    handled = []
+
+    async def dispatch(update):
+        await release.wait()
+        handled.append(update["update_id"])
+
+    scheduler = UpdateScheduler(dispatch, concurrency=2, max_queued=10, max_per_chat=3)
+    await scheduler.submit(message(0, 1))
+    await asyncio.sleep(0.01)
+    for update_id in range(1, 20):
+        await asyncio.wait_for(scheduler.submit(message(update_id, 1)), 1)
+    # The flooding chat holds its running update and three queued ones
+    await asyncio.wait_for(scheduler.submit(message(100, 2)), 1)
+
+    release.set()
+    await scheduler.close(1)
+
+    assert sorted(handled) == [0, 1, 2, 3, 100]
+    assert scheduler.dropped == 16
+
+
+def callback_query(update_id: int, chat_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": {"id": chat_id},
+            "message": {"chat": {"id": chat_id}},
+        },
+    }
+
+
+class FakeBot:
+    def __init__(self):
+        self.calls = []
+
+    async def answer_callback_query(self, callback_query_id, text):
+        self.calls.append(("answer", callback_query_id, text))
+
+    async def send_message(self, chat_id, text):
+        self.calls.append(("send", chat_id, text))
+
+
+async def test_flooding_chat_is_asked_to_slow_down():
+    release = asyncio.Event()
+    bot = FakeBot()
+
+    async def dispatch(update):
+        await release.wait()
+
+    scheduler = UpdateScheduler(
+        dispatch, concurrency=1, max_queued=10, max_per_chat=1, on_drop=slow_down(bot)
+    )
+    await scheduler.submit(message(0, 1))
+    await asyncio.sleep(0.01)
+    await scheduler.submit(message(1, 1))
+    for update_id in range(2, 5):
+        await scheduler.submit(message(update_id, 1))
+    await scheduler.submit(callback_query(5, 1))
+    await scheduler.submit(callback_query(6, 1))
+
+    release.set()
+    await scheduler.close(1)
+    # A chat that got through its queue is told again next time it floods
+    release.clear()
+    await scheduler.submit(message(7, 1))
+    await asyncio.sleep(0.01)
+    await scheduler.submit(message(8, 1))
+    await scheduler.submit(message(9, 1))
+    release.set()
+    await scheduler.close(1)
+
+    assert bot.calls == [
+        ("send", 1, SLOW_DOWN_TEXT),
+        ("answer", "5", SLOW_DOWN_TEXT),
+        ("answer", "6", SLOW_DOWN_TEXT),
+        ("send", 1, SLOW_DOWN_TEXT),
+    ]
+    assert scheduler.dropped == 6
+
+
+async def test_supervisor_route_waits_for_a_full_worker_queue(monkeypatch):
+    monkeypatch.setattr(settings, "WORKER_RESTART_DELAY", 0.1)
+    supervisor = Supervisor(target=None, workers=1, queue_size=2)
+    worker_queue = supervisor.queues[0]
+    try:
+        await supervisor.route(message(1, 1))
+        await supervisor.route(message(2, 1))
+        routed = asyncio.create_task(supervisor.route(message(3, 1)))
+        await asyncio.sleep(0.3)
+        assert not routed.done()
+
+        loop = asyncio.get_running_loop()
+        assert (await loop.run_in_executor(None, worker_queue.get))["update_id"] == 1
+        await asyncio.wait_for(routed, 1)
+        assert [
+            (await loop.run_in_executor(None, worker_queue.get))["update_id"]
+            for _ in range(2)
+        ] == [2, 3]
+    finally:
+        worker_queue.close()
+        worker_queue.join_thread()
@@ -0,0 +1,90 @@
+from time import monotonic
+from types import SimpleNamespace
+
+import pytest
+
+import routers.search
+from services.search import ProductSearch, SearchEntry, SearchIndex
+
+
+class FakeInlineQuery(SimpleNamespace):
+    async def answer(self, results, **kwargs):
+        self.answered = (results, kwargs)
+
+
+def build_index(*products: tuple[str, str]) -> SearchIndex:
+    return SearchIndex(
+        [
+            SearchEntry({"id": i, "name": name, "description": description}, {}, 0)
+            for i, (name, description) in enumerate(products)
+        ]
+    )
+
+
+@pytest.fixture
+def search(monkeypatch):
+    search = ProductSearch(interval=60, detail_ttl=60, concurrency=1, page_size=20)
+    monkeypatch.setattr(routers.search, "search", search)
+    return search
+
+
+async def test_answers_are_not_cached_until_the_index_is_built(search):
+    query = FakeInlineQuery(query="tea", offset="")
+    await routers.search.search_products(query)
+    assert query.answered == ([], {"cache_time": 0, "next_offset": ""})
+
+    search.built_at = monotonic()
+    await routers.search.search_products(query)
+    assert query.answered[1]["cache_time"] == 60
+
+
+def test_long_terms_match_inside_words():
+    index = build_index(("Green tea", ""), ("Teapot", ""), ("Coffee", "Roasted"))
+
+    assert index.search("ree") == [0]
+    assert index.search("eapo") == [1]
+    assert index.search("tea") == [0, 1]
+    assert index.search("teas") == []
+
+
+def test_short_terms_match_word_prefixes():
+    index = build_index(("Green tea", ""), ("Mate", ""), ("Teapot", ""))
+
+    assert index.search("te") == [0, 2]
+    assert index.search("t") == [0, 2]
+    assert index.search("at") == []
+
+
+def test_every_term_has_to_match():
+    index = build_index(("Green tea", ""), ("Black tea", ""), ("Green coffee", ""))
+
+    assert index.search("green tea") == [0]
+    assert index.search("TEA, black!") == [1]
+
+
+def test_name_matches_come_first():
+    index = build_index(
+        ("Mug", "For tea"), ("Teapot", ""), ("Cup", "Tea or coffee"), ("Tea", "")
+    )
+
+    assert index.search("tea") == [1, 3, 0, 2]
+    assert index.search("") == [0, 1, 2, 3]
+
+
+def test_pages_follow_next_offset(search):
+    search.page_size = 2
+    search.index = build_index(*((f"Tea {i}", "") for i in range(5)))
+
+    pages = []
+    offset = 0
+    while offset is not None:
+        page, offset = search.search("tea", offset)
+        pages.append([entry.id for entry in page])
+
+    assert pages == [[0, 1], [2, 3], [4]]
+
+
+def test_empty_before_first_build(search):
+    assert search.age is None
+    assert search.search("tea", 0) == ([], None)
+    assert search.search("", 0) == ([], None)
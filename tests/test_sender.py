@@ -0,0 +1,47 @@
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from services.sender import SendScheduler
+
+
+def make_scheduler() -> SendScheduler:
+    return SendScheduler(
+        global_rate=1000,
+        global_burst=1000,
+        chat_rate=1000,
+        chat_burst=1000,
+        max_retries=1,
+        chat_buckets_size=10,
+        chat_buckets_ttl=60,
+    )
+
+
+def flood_once(retry_after: int):
+    calls = []
+
+    async def make_request(bot, method):
+        calls.append(method)
+        if len(calls) == 1:
+            raise TelegramRetryAfter(method, "Flood control exceeded", retry_after)
+        return True
+
+    return make_request, calls
+
+
+async def test_flood_wait_in_private_chat_pauses_every_chat():
+    scheduler = make_scheduler()
+    make_request, calls = flood_once(0)
+
+    assert await scheduler(make_request, None, SendMessage(chat_id=1, text="x"))
+    assert len(calls) == 2
+    assert scheduler.global_pauses == 1
+    assert scheduler.global_bucket.tokens <= 1
+
+
+async def test_flood_wait_in_group_pauses_only_the_group():
+    scheduler = make_scheduler()
+    make_request, calls = flood_once(0)
+
+    assert await scheduler(make_request, None, SendMessage(chat_id=-100, text="x"))
+    assert len(calls) == 2
+    assert scheduler.global_pauses == 0
@@ -0,0 +1,162 @@
+import asyncio
+import sys
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from aiogram.fsm.storage.base import StorageKey
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from classes.fsm import ToCard
+from database.models import FsmState
+from database.storage import PostgresStorage, build_key, create_storage
+from settings import settings
+
+KEY = StorageKey(bot_id=1, chat_id=10, user_id=10)
+OTHER = StorageKey(bot_id=1, chat_id=20, user_id=20)
+
+
+@pytest.fixture
+def session_factory(db_engine):
+    return sessionmaker(db_engine, expire_on_commit=False, class_=AsyncSession)
+
+
+@pytest.fixture
+def postgres_storage(session_factory):
+    return PostgresStorage(session_factory, ttl=60)
+
+
+@pytest.fixture
+async def redis_storage():
+    fakeredis = pytest.importorskip("fakeredis")
+    from database.redis_storage import PipelinedRedisStorage
+    from database.storage import compact_dumps
+
+    storage = PipelinedRedisStorage(
+        fakeredis.FakeAsyncRedis(), state_ttl=60, data_ttl=60, json_dumps=compact_dumps
+    )
+    yield storage
+    await storage.close()
+
+
+async def expire(session_factory, key: StorageKey) -> None:
+    async with session_factory() as session:
+        await session.execute(
+            update(FsmState)
+            .where(FsmState.key == build_key(key))
+            .values(expires_at=datetime.now(timezone.utc) - timedelta(seconds=1))
+        )
+        await session.commit()
+
+
+@pytest.fixture(params=["postgres", "redis"])
+def storage(request):
+    return request.getfixturevalue(f"{request.param}_storage")
+
+
+async def test_state_and_data_round_trip(storage):
+    assert await storage.get_state(KEY) is None
+    assert await storage.get_data(KEY) == {}
+
+    await storage.set_state(KEY, ToCard.quantity)
+    await storage.set_data(KEY, {"product_id": "7"})
+    assert await storage.get_state(KEY) == ToCard.quantity.state
+    assert await storage.get_data(KEY) == {"product_id": "7"}
+    assert await storage.get_state(OTHER) is None
+
+    await storage.set_state(KEY, None)
+    await storage.set_data(KEY, {})
+    assert await storage.get_state(KEY) is None
+    assert await storage.get_data(KEY) == {}
+
+
+async def test_update_data_merges_top_level_keys(storage):
+    await storage.set_data(KEY, {"product_id": "7", "cart": {"a": 1}})
+    merged = await storage.update_data(KEY, {"quantity": 3, "cart": {"b": 2}})
+    expected = {"product_id": "7", "quantity": 3, "cart": {"b": 2}}
+    assert merged == expected
+    assert await storage.get_data(KEY) == expected
+
+
+async def test_postgres_set_state_keeps_data(postgres_storage):
+    await postgres_storage.set_data(KEY, {"product_id": "7"})
+    await postgres_storage.set_state(KEY, ToCard.quantity)
+    assert await postgres_storage.get_data(KEY) == {"product_id": "7"}
+
+
+async def test_postgres_expired_rows_are_ignored(postgres_storage, session_factory):
+    await postgres_storage.set_state(KEY, ToCard.quantity)
+    await postgres_storage.set_data(KEY, {"product_id": "7"})
+    await expire(session_factory, KEY)
+
+    assert await postgres_storage.get_state(KEY) is None
+    assert await postgres_storage.get_data(KEY) == {}
+    # An expired row does not leak into the merge or the state
+    assert await postgres_storage.update_data(KEY, {"quantity": 3}) == {"quantity": 3}
+    assert await postgres_storage.get_state(KEY) is None
+
+
+async def test_postgres_purge_expired(postgres_storage, session_factory):
+    await postgres_storage.set_data(KEY, {"product_id": "7"})
+    await postgres_storage.set_data(OTHER, {"product_id": "8"})
+    await expire(session_factory, KEY)
+    await postgres_storage.purge_expired()
+
+    async with session_factory() as session:
+        assert await session.get(FsmState, build_key(KEY)) is None
+        assert await session.get(FsmState, build_key(OTHER)) is not None
+
+
+async def test_redis_keys_have_ttl(redis_storage):
+    await redis_storage.set_state(KEY, ToCard.quantity)
+    await redis_storage.set_data(KEY, {"product_id": "7"})
+    for part in ("state", "data"):
+        ttl = await redis_storage.redis.ttl(redis_storage.key_builder.build(KEY, part))
+        assert 0 < ttl <= 60
+
+
+async def test_redis_keys_expire(redis_storage):
+    redis_storage.state_ttl = redis_storage.data_ttl = 1
+    await redis_storage.set_state(KEY, ToCard.quantity)
+    await redis_storage.set_data(KEY, {"product_id": "7"})
+    await asyncio.sleep(1.1)
+    assert await redis_storage.get_state(KEY) is None
+    assert await redis_storage.get_data(KEY) == {}
+
+
+async def test_redis_data_is_compact_json(redis_storage):
+    await redis_storage.set_data(KEY, {"product_id": "7", "name": "Чай"})
+    raw = await redis_storage.redis.get(redis_storage.key_builder.build(KEY, "data"))
+    assert raw.decode() == '{"product_id":"7","name":"Чай"}'
+
+
+async def test_redis_pipelines_concurrent_commands(redis_storage):
+    keys = [StorageKey(bot_id=1, chat_id=i, user_id=i) for i in range(50)]
+    await asyncio.gather(
+        *(redis_storage.set_state(key, ToCard.quantity) for key in keys)
+    )
+    states = await asyncio.gather(*(redis_storage.get_state(key) for key in keys))
+
+    assert states == [ToCard.quantity.state] * 50
+    # 100 commands, one round trip per batch of concurrent ones
+    assert redis_storage.pipelines == 2
+
+
+async def test_redis_command_errors_stay_with_their_caller(redis_storage):
+    await redis_storage.redis.lpush(redis_storage.key_builder.build(KEY, "state"), "x")
+    results = await asyncio.gather(
+        redis_storage.get_state(KEY),
+        redis_storage.get_state(OTHER),
+        return_exceptions=True,
+    )
+    assert isinstance(results[0], Exception)
+    assert results[1] is None
+
+
+def test_redis_storage_without_redis_is_a_configuration_error(monkeypatch):
+    monkeypatch.setattr(settings, "FSM_STORAGE", "redis")
+    # None in sys.modules makes the import fail as if redis were missing
+    monkeypatch.setitem(sys.modules, "database.redis_storage", None)
+    with pytest.raises(RuntimeError, match=r"\[redis\] extra"):
+        create_storage()
@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+import utils
+from settings import settings
+
+
+@pytest.fixture
+async def slow_backend():
+    """Backend that sends the headers at once and the body after a pause"""
+
+    async def handler(request: web.Request) -> web.StreamResponse:
+        response = web.StreamResponse()
+        await response.prepare(request)
+        await asyncio.sleep(0.5)
+        await response.write(b"{}")
+        return response
+
+    async def slow_write(request: web.Request) -> web.Response:
+        await asyncio.sleep(1.2)
+        return web.json_response({"created": True})
+
+    app = web.Application()
+    app.router.add_get("/api/v1/products/", handler)
+    app.router.add_post("/api/v1/to_order/", slow_write)
+    server = TestServer(app)
+    await server.start_server()
+    await utils.init_session()
+    yield server
+    await utils.close_session()
+    await server.close()
+
+
+async def test_read_timeout_applies_per_request(slow_backend, monkeypatch):
+    monkeypatch.setattr(settings, "HTTP_READ_TIMEOUT", 0.1)
+    state = utils.Endpoint()
+    # The adaptive timeout alone would wait for the body
+    assert state.timeout.timeout >= 1
+
+    with pytest.raises(asyncio.TimeoutError):
+        await utils._send(
+            "GET", str(slow_backend.make_url("/api/v1/products/")), {}, state
+        )
+
+
+async def test_writes_are_not_cut_by_the_adaptive_timeout(slow_backend):
+    state = utils.Endpoint()
+    # Fast answers so far bring the adaptive timeout down to its minimum
+    for _ in range(100):
+        state.timeout.observe(0.01)
+    assert state.timeout.timeout < 1.2
+
+    response = await utils._send(
+        "POST", str(slow_backend.make_url("/api/v1/to_order/")), {}, state
+    )
+    assert response.json() == {"created": True}
+
+
+async def test_unexpected_errors_release_a_probing_breaker(monkeypatch):
+    url = "http://backend.test/api/v1/products/"
+    state = utils.endpoints[("GET", utils.endpoint(url))] = utils.Endpoint()
+    state.breaker.state = state.breaker.HALF_OPEN
+
+    async def broken(*args, **kwargs):
+        raise RuntimeError("bug")
+
+    monkeypatch.setattr(utils, "_send", broken)
+    try:
+        with pytest.raises(RuntimeError):
+            await utils._request("GET", url, {})
+        assert state.breaker.allow()
+    finally:
+        del utils.endpoints[("GET", utils.endpoint(url))]
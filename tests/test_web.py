@@ -0,0 +1,51 @@
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from pydantic import ValidationError
+
+from services.web import SECRET_HEADER, WebhookHandler
+from settings import Settings
+
+UPDATE = {"update_id": 1, "message": {"chat": {"id": 10}}}
+
+
+@pytest.fixture
+async def client():
+    received = []
+
+    async def dispatch(update):
+        received.append(update)
+
+    app = web.Application()
+    app.router.add_post("/webhook", WebhookHandler(dispatch, "s3cret").handle)
+    client = TestClient(TestServer(app))
+    await client.start_server()
+    client.received = received
+    yield client
+    await client.close()
+
+
+@pytest.mark.parametrize("headers", [{}, {SECRET_HEADER: "wrong"}])
+async def test_webhook_rejects_updates_without_the_secret(client, headers):
+    response = await client.post("/webhook", json=UPDATE, headers=headers)
+    assert response.status == 401
+    assert client.received == []
+
+
+async def test_webhook_accepts_updates_with_the_secret(client):
+    response = await client.post(
+        "/webhook", json=UPDATE, headers={SECRET_HEADER: "s3cret"}
+    )
+    assert response.status == 200
+    assert client.received == [UPDATE]
+
+
+@pytest.mark.parametrize("secret", ["", "not allowed!"])
+def test_webhook_mode_requires_a_valid_secret(secret):
+    with pytest.raises(ValidationError):
+        Settings(RUN_MODE="webhook", WEBHOOK_SECRET=secret)
+
+
+def test_handler_requires_a_secret():
+    with pytest.raises(ValueError):
+        WebhookHandler(lambda update: None, "")
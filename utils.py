@@ -1,34 +1,303 @@
-import requests
-from requests import Response
+import asyncio
+import json
+import random
+import re
+from collections.abc import Awaitable, Callable
+from functools import partial
+from time import perf_counter
+from urllib.parse import urlsplit
 
+import aiohttp
 
-async def request_post(url, auth_token=None, **kwargs) -> Response:
-    headers = {
-        "Content-Type": "application/json",
-    }
-    if auth_token is not None:
-        headers["Authorization"] = f"Bearer {auth_token}"
+from classes.metrics import Counter, Gauge, Histogram
+from classes.resilience import AdaptiveTimeout, CircuitBreaker, RetryBudget
+from settings import settings
 
-    data = {**kwargs}
+_session: aiohttp.ClientSession | None = None
+# Called with the rejected token on a 401, returns a new token or None
+_refresh_token: Callable[[str], Awaitable[str | None]] | None = None
 
-    return requests.post(url, json=data, headers=headers)
+request_seconds = Histogram(
+    "bot_backend_request_seconds",
+    "Backend API request latency",
+    labels=("method", "endpoint", "status"),
+)
+coalesced_requests = Counter(
+    "bot_backend_coalesced_requests_total",
+    "GET requests answered by an identical request already in flight",
+    labels=("endpoint",),
+)
 
+backend_retries = Counter(
+    "bot_backend_retries_total",
+    "GET requests retried after a timeout, connection error or 5xx",
+    labels=("method", "endpoint"),
+)
 
-async def request_get(url, auth_token=None) -> Response:
-    if auth_token is not None:
-        headers = {
-            "Authorization": f"Bearer {auth_token}",
-        }
-        return requests.get(url, headers=headers)
+# Identical GETs in flight: (url, token, headers) -> task of the first caller
+_inflight: dict[tuple, asyncio.Task] = {}
 
-    return requests.get(url)
+# Numeric and UUID path segments, collapsed so endpoints stay few
+_ID_SEGMENT = re.compile(r"/(?:\d+|[0-9a-fA-F-]{32,36})(?=/|$)")
 
 
-async def request_delete(url: str, auth_token: str | None = None) -> Response:
+def endpoint(url: str) -> str:
+    """URL path with ids replaced, used as a metrics label"""
+    return _ID_SEGMENT.sub("/{id}", urlsplit(url).path)
+
+
+class BackendUnavailable(Exception):
+    """The endpoint's circuit breaker is open, the request was not sent"""
+
+    def __init__(self, method: str, path: str):
+        super().__init__(f"{method} {path} is unavailable")
+        self.method = method
+        self.path = path
+
+
+class Endpoint:
+    """Breaker and timeout of one backend endpoint"""
+
+    __slots__ = ("breaker", "timeout")
+
+    def __init__(self):
+        self.breaker = CircuitBreaker(
+            settings.BACKEND_BREAKER_FAILURES, settings.BACKEND_BREAKER_RESET
+        )
+        self.timeout = AdaptiveTimeout(
+            settings.BACKEND_TIMEOUT_MIN,
+            settings.BACKEND_TIMEOUT_MAX,
+            settings.BACKEND_TIMEOUT_P99_FACTOR,
+        )
+
+
+# (method, endpoint) -> Endpoint, created on first use
+endpoints: dict[tuple[str, str], Endpoint] = {}
+retry_budget = RetryBudget(
+    settings.BACKEND_RETRY_RATIO, settings.BACKEND_RETRY_MIN_PER_SECOND
+)
+
+
+class Response:
+    """Fully read backend response"""
+
+    __slots__ = ("status_code", "headers", "content", "_json")
+
+    def __init__(self, status_code: int, headers, content: bytes):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self._json = None
+
+    def json(self):
+        if self._json is None:
+            self._json = json.loads(self.content)
+        return self._json
+
+
+async def init_session() -> aiohttp.ClientSession:
+    """Create the shared backend HTTP session with a keep-alive pool"""
+    global _session
+
+    connector = aiohttp.TCPConnector(
+        limit=settings.HTTP_POOL_SIZE,
+        limit_per_host=settings.HTTP_POOL_PER_HOST,
+        keepalive_timeout=settings.HTTP_KEEPALIVE_TIMEOUT,
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=None,
+        connect=settings.HTTP_CONNECT_TIMEOUT,
+        sock_read=settings.HTTP_READ_TIMEOUT,
+    )
+    _session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+    return _session
+
+
+async def close_session() -> None:
+    """Close the shared backend HTTP session"""
+    global _session
+
+    if _session is not None:
+        await _session.close()
+        _session = None
+
+
+def get_session() -> aiohttp.ClientSession:
+    if _session is None:
+        raise RuntimeError("HTTP session is not initialized, call init_session()")
+    return _session
+
+
+async def _send(
+    method: str, url: str, headers: dict, state: Endpoint, **kwargs
+) -> Response:
+    started = perf_counter()
+    status = "error"
+    # A per-request timeout replaces the session's one as a whole
+    if method == "GET":
+        timeout = aiohttp.ClientTimeout(
+            total=state.timeout.timeout,
+            connect=settings.HTTP_CONNECT_TIMEOUT,
+            sock_read=settings.HTTP_READ_TIMEOUT,
+        )
+    else:
+        # A write cut short may still have happened on the backend, so it
+        # gets a fixed, longer timeout
+        timeout = aiohttp.ClientTimeout(
+            total=settings.BACKEND_WRITE_TIMEOUT,
+            connect=settings.HTTP_CONNECT_TIMEOUT,
+        )
+    try:
+        async with get_session().request(
+            method, url, headers=headers, timeout=timeout, **kwargs
+        ) as resp:
+            content = await resp.read()
+            status = resp.status
+            return Response(resp.status, resp.headers, content)
+    except asyncio.TimeoutError:
+        status = "timeout"
+        raise
+    finally:
+        elapsed = perf_counter() - started
+        if status != "error":
+            state.timeout.observe(elapsed)
+        request_seconds.observe(elapsed, method, endpoint(url), status)
+
+
+async def _request(method: str, url: str, headers: dict, **kwargs) -> Response:
+    """Send through the endpoint's breaker; GETs are retried with jitter
+
+    Timeouts, connection errors and 5xx answers count as failures. A
+    GET is retried while the retry budget allows it; the last 5xx
+    answer is returned, the last exception raised.
+    """
+    key = (method, endpoint(url))
+    state = endpoints.get(key)
+    if state is None:
+        state = endpoints[key] = Endpoint()
+    retries = settings.BACKEND_RETRIES if method == "GET" else 0
+    retry_budget.deposit()
+
+    attempt = 0
+    while True:
+        if not state.breaker.allow():
+            raise BackendUnavailable(*key)
+        error = response = None
+        try:
+            response = await _send(method, url, headers, state, **kwargs)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+            error = exc
+        except BaseException:
+            # Cancelled, or an error that says nothing about the backend;
+            # a half-open breaker must not keep waiting for this probe
+            state.breaker.release()
+            raise
+
+        if response is not None and response.status_code < 500:
+            state.breaker.success()
+            return response
+        state.breaker.failure()
+
+        if attempt >= retries or not retry_budget.withdraw():
+            if response is not None:
+                return response
+            raise error
+        attempt += 1
+        backend_retries.inc(*key)
+        # Full jitter keeps retries of many users from arriving together
+        await asyncio.sleep(
+            random.uniform(0, settings.BACKEND_RETRY_BACKOFF * 2**attempt)
+        )
+
+
+Gauge(
+    "bot_backend_breaker_state",
+    "Circuit breaker state: 0 closed, 1 half-open, 2 open",
+    labels=("method", "endpoint"),
+    collect=lambda: {key: state.breaker.state for key, state in endpoints.items()},
+)
+Counter(
+    "bot_backend_breaker_opened_total",
+    "Times a circuit breaker opened",
+    labels=("method", "endpoint"),
+    collect=lambda: {key: state.breaker.opened for key, state in endpoints.items()},
+)
+Counter(
+    "bot_backend_breaker_rejected_total",
+    "Requests rejected by an open circuit breaker",
+    labels=("method", "endpoint"),
+    collect=lambda: {key: state.breaker.rejected for key, state in endpoints.items()},
+)
+Gauge(
+    "bot_backend_timeout_seconds",
+    "Current adaptive request timeout",
+    labels=("method", "endpoint"),
+    collect=lambda: {key: state.timeout.timeout for key, state in endpoints.items()},
+)
+Counter(
+    "bot_backend_retry_budget_exhausted_total",
+    "Retries skipped because the retry budget was spent",
+    collect=lambda: retry_budget.exhausted,
+)
+
+
+def on_unauthorized(refresh: Callable[[str], Awaitable[str | None]]) -> None:
+    """Register how to get a new token when the backend answers 401"""
+    global _refresh_token
+
+    _refresh_token = refresh
+
+
+def _auth_headers(auth_token: str | None, headers: dict | None = None) -> dict:
+    request_headers = dict(headers) if headers else {}
     if auth_token is not None:
-        headers = {
-            "Authorization": f"Bearer {auth_token}",
-        }
-        return requests.delete(url, headers=headers)
+        request_headers["Authorization"] = f"Bearer {auth_token}"
+    return request_headers
 
-    return requests.delete(url)
+
+async def _authorized(
+    method: str, url: str, auth_token: str | None, headers=None, **kwargs
+) -> Response:
+    """Request that is retried once with a refreshed token after a 401"""
+    response = await _request(method, url, _auth_headers(auth_token, headers), **kwargs)
+    if response.status_code != 401 or auth_token is None or _refresh_token is None:
+        return response
+
+    token = await _refresh_token(auth_token)
+    if token is None or token == auth_token:
+        return response
+    return await _request(method, url, _auth_headers(token, headers), **kwargs)
+
+
+async def request_post(url, auth_token=None, **kwargs) -> Response:
+    return await _authorized("POST", url, auth_token, json={**kwargs})
+
+
+async def request_get(url, auth_token=None, headers=None) -> Response:
+    """GET that shares one backend request between identical concurrent calls
+
+    Calls are identical when url, token and extra headers match, so
+    authenticated reads are only shared by requests of the same user.
+    Waiters get the same Response object and must not modify its json().
+    """
+    key = (url, auth_token, tuple(sorted(headers.items())) if headers else ())
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(_authorized("GET", url, auth_token, headers))
+        _inflight[key] = task
+        task.add_done_callback(partial(_request_done, key))
+    else:
+        coalesced_requests.inc(endpoint(url))
+    # A waiter that is cancelled must not cancel the request of the others
+    return await asyncio.shield(task)
+
+
+def _request_done(key: tuple, task: asyncio.Task) -> None:
+    if _inflight.get(key) is task:
+        del _inflight[key]
+    if not task.cancelled():
+        task.exception()
+
+
+async def request_delete(url: str, auth_token: str | None = None) -> Response:
+    return await _authorized("DELETE", url, auth_token)